@@ -0,0 +1,437 @@
+"""
+backend.py contains execution backends running external programs (SIESTA, ATOM scripts)
+as managed subprocesses with core budget, timeouts and completion futures
+"""
+
+import os
+import sys
+import time
+import errno
+import shlex
+import signal
+import resource
+import threading
+import subprocess
+
+FAKE_SIESTA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_siesta.py")
+
+# functions called with the future of every submitted job, e.g. to collect job timing (see timing.py)
+_submit_hooks = []
+
+
+def add_submit_hook(fn):
+    if fn not in _submit_hooks:
+        _submit_hooks.append(fn)
+
+
+class JobError(subprocess.CalledProcessError):
+    """ Raised when a job exits with non-zero code, is killed by timeout or cancelled
+    """
+
+    def __init__(self, returncode, cmd, reason=None):
+        super(JobError, self).__init__(returncode, cmd)
+        self.reason = reason
+
+    def __str__(self):
+        if self.reason is not None:
+            return "Command '{}' {}".format(" ".join(self.cmd), self.reason)
+        return "Command '{}' returned non-zero exit status {}".format(" ".join(self.cmd), self.returncode)
+
+
+class Job(object):
+
+    def __init__(self, args, cwd=None, stdin=None, stdout=None, n_proc=1, mpi=False,
+                 timeout=None, env=None, name=None, rlimits=None, priority=0, group=None,
+                 monitor=None, monitor_interval=1.):
+        """ Description of an external program run
+
+        Arguments:
+            args {list} -- program and its arguments
+
+        Keyword Arguments:
+            cwd {string} -- working directory (default: {None})
+            stdin {string} -- file name (relative to cwd) to read standard input from (default: {None})
+            stdout {string} -- file name (relative to cwd) to write standard output to (default: {None})
+            n_proc {int} -- number of cores used by the job (default: {1})
+            mpi {bool} -- if True, the program is run by MPI launcher with n_proc ranks (default: {False})
+            timeout {float} -- the job is killed after timeout seconds (default: {None})
+            env {dict} -- environment of the job (default: {None})
+            name {string} -- job name, e.g. 'siesta' or 'atom' (default: {None})
+            rlimits {dict} -- resource limits {resource.RLIMIT_*: value} set for the job (default: {None})
+            priority {int} -- jobs with higher priority are started first (default: {0})
+            group {string} -- fair share group of the job, e.g. element (default: {None})
+            monitor {function} -- called every monitor_interval seconds while the job runs; if it returns
+                                  a string, the job is killed with this reason (default: {None})
+            monitor_interval {float} -- interval of monitor calls, s (default: {1.})
+        """
+        self.args = list(args)
+        self.cwd = cwd
+        self.stdin = stdin
+        self.stdout = stdout
+        self.n_proc = n_proc
+        self.mpi = mpi
+        self.timeout = timeout
+        self.env = env
+        self.name = name
+        self.rlimits = rlimits or {}
+        self.priority = priority
+        self.group = group
+        self.monitor = monitor
+        self.monitor_interval = monitor_interval
+
+
+class Future(object):
+
+    def __init__(self, job):
+        """ Result of the job which may not be finished yet
+        """
+        self.job = job
+        self.cmd = None
+        self.returncode = None
+        self.reason = None
+        self.start_time = None
+        self.end_time = None
+        # True if the job was killed by its monitor
+        self.aborted = False
+        # resource usage of the finished process {"utime": s, "stime": s, "maxrss": MB}
+        self.rusage = None
+        self._process = None
+        self._cancelled = False
+        self._finished = False
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def running(self):
+        return self._process is not None and not self.done()
+
+    def done(self):
+        return self._finished
+
+    @property
+    def wall_time(self):
+        if self.start_time is None or self.end_time is None:
+            return None
+        return self.end_time - self.start_time
+
+    def wait(self, timeout=None):
+        """ Waits for the job to finish and its done callbacks to be called, returns True if it has finished
+        """
+        # Event.wait without timeout cannot be interrupted by Ctrl-C in python 2
+        while not self._event.wait(timeout if timeout is not None else 1.):
+            if timeout is not None:
+                break
+        return self._event.is_set()
+
+    def result(self, timeout=None):
+        """ Waits for the job and returns its exit code, raises JobError if the job failed
+        """
+        if not self.wait(timeout):
+            raise RuntimeError("Job is not finished yet")
+        if self.reason is not None or self.returncode != 0:
+            raise JobError(self.returncode, self.cmd, self.reason)
+        return self.returncode
+
+    def failed(self):
+        return self.done() and (self.reason is not None or self.returncode != 0)
+
+    def cancel(self, reason="cancelled"):
+        """ Cancels pending job or kills running one
+        """
+        with self._lock:
+            if self.done():
+                return False
+            self._cancelled = True
+            self.reason = reason
+            process = self._process
+        if process is not None:
+            # the backend waiter resolves the future when the process is gone
+            _kill(process)
+        else:
+            self._set_done(None)
+        return True
+
+    def add_done_callback(self, fn):
+        with self._lock:
+            if not self.done():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def _set_done(self, returncode, reason=None):
+        with self._lock:
+            if self._finished:
+                return
+            self.returncode = returncode
+            if self.reason is None:
+                self.reason = reason
+            self.end_time = time.time()
+            self._finished = True
+            callbacks, self._callbacks = self._callbacks, []
+        # waiters are released after the callbacks, so they see their results
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception as e:
+                print "Future: done callback failed: {}".format(e)
+        self._event.set()
+
+
+def _kill(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+def _wait4(process, block=False):
+    """ Reaps the finished process and sets its returncode, returns its resource usage (which includes
+    the descendants it has waited for, e.g. the ranks of mpirun), or None if the process is still running
+    """
+    while True:
+        try:
+            pid, status, usage = os.wait4(process.pid, 0 if block else os.WNOHANG)
+            break
+        except OSError as e:
+            if e.errno != errno.EINTR:
+                raise
+    if pid == 0:
+        return None
+    if os.WIFSIGNALED(status):
+        process.returncode = -os.WTERMSIG(status)
+    else:
+        process.returncode = os.WEXITSTATUS(status)
+    return {"utime": usage.ru_utime,
+            "stime": usage.ru_stime,
+            "maxrss": usage.ru_maxrss / 1024.}
+
+
+class LocalBackend(object):
+
+    poll_interval = 0.05
+
+    def __init__(self, n_cores=None, mpirun="mpirun", mpi_options=""):
+        """ Runs jobs as local subprocesses, keeping the number of cores used by running jobs within n_cores.
+        Pending jobs are started in order of priority; among jobs of equal priority, the job of the group
+        using the least cores (relative to its share in shares dict, 1 by default) goes first, then FIFO
+
+        Keyword Arguments:
+            n_cores {int} -- core budget, unlimited if None (default: {None})
+            mpirun {string} -- MPI launcher (default: {"mpirun"})
+            mpi_options {string} -- additional options of MPI launcher (default: {""})
+        """
+        self.n_cores = n_cores
+        self.mpirun = mpirun
+        self.mpi_options = shlex.split(mpi_options)
+        self.shares = {}
+        self._pending = []
+        self._running = set()
+        self._used_cores = 0
+        self._group_cores = {}
+        self._lock = threading.RLock()
+
+    def command(self, job):
+        if job.mpi:
+            return [self.mpirun, "-np", str(job.n_proc)] + self.mpi_options + job.args
+        return job.args
+
+    def submit(self, job):
+        """ Queues the job, returns its Future
+        """
+        future = Future(job)
+        future.cmd = self.command(job)
+        for hook in _submit_hooks:
+            hook(future)
+        with self._lock:
+            self._pending.append(future)
+        self._schedule()
+        return future
+
+    def run(self, job):
+        """ Runs the job and waits for it, raises JobError if it failed
+        """
+        return self.submit(job).result()
+
+    def _fits(self, future):
+        if self.n_cores is None:
+            return True
+        # a job larger than the whole budget is still run, but alone
+        n_proc = min(future.job.n_proc, self.n_cores)
+        return self._used_cores + n_proc <= self.n_cores
+
+    def _order(self, future):
+        job = future.job
+        usage = self._group_cores.get(job.group, 0) / float(self.shares.get(job.group, 1.))
+        return -job.priority, usage
+
+    def _next(self):
+        """ Returns the next pending future to be started, or None
+        """
+        # futures cancelled while pending
+        self._pending = [future for future in self._pending if not future.done()]
+        if not self._pending:
+            return None
+        # min keeps FIFO order among futures of equal rank
+        future = min(self._pending, key=self._order)
+        if self._fits(future):
+            return future
+        # a large job is not overtaken by smaller ones of lower rank
+        return None
+
+    def _acquire(self, future):
+        job = future.job
+        self._used_cores += job.n_proc
+        self._group_cores[job.group] = self._group_cores.get(job.group, 0) + job.n_proc
+
+    def _release(self, future):
+        job = future.job
+        with self._lock:
+            self._used_cores -= job.n_proc
+            self._group_cores[job.group] -= job.n_proc
+            self._running.discard(future)
+
+    def _schedule(self):
+        with self._lock:
+            while True:
+                future = self._next()
+                if future is None:
+                    break
+                self._pending.remove(future)
+                self._acquire(future)
+                try:
+                    self._start(future)
+                except (OSError, IOError) as e:
+                    self._release(future)
+                    future._set_done(None, "could not be started: {}".format(e))
+
+    def _open(self, job, file_name, mode):
+        if file_name is None:
+            return None
+        return open(os.path.join(job.cwd or ".", file_name), mode)
+
+    def _start(self, future):
+        job = future.job
+
+        def preexec():
+            # own process group, so that the whole MPI job can be killed
+            os.setsid()
+            for res, value in job.rlimits.items():
+                resource.setrlimit(res, (value, value))
+
+        stdin = self._open(job, job.stdin, "r")
+        stdout = self._open(job, job.stdout, "w")
+        try:
+            future.start_time = time.time()
+            process = subprocess.Popen(future.cmd,
+                                       cwd=job.cwd,
+                                       stdin=stdin,
+                                       stdout=stdout,
+                                       env=job.env,
+                                       preexec_fn=preexec)
+        finally:
+            for f in (stdin, stdout):
+                if f is not None:
+                    f.close()
+        with future._lock:
+            future._process = process
+            if future._cancelled:
+                _kill(process)
+        self._running.add(future)
+        waiter = threading.Thread(target=self._wait, args=(future,))
+        waiter.daemon = True
+        waiter.start()
+
+    def _wait(self, future):
+        process = future._process
+        deadline = None
+        if future.job.timeout is not None:
+            deadline = future.start_time + future.job.timeout
+        monitor = future.job.monitor
+        next_check = future.start_time + future.job.monitor_interval
+        reason = None
+        # the process is reaped by wait4 rather than by Popen, to get its resource usage
+        while True:
+            future.rusage = _wait4(process)
+            if future.rusage is not None:
+                break
+            if deadline is not None and time.time() > deadline:
+                reason = "timed out after {} s".format(future.job.timeout)
+            elif monitor is not None and time.time() > next_check:
+                next_check = time.time() + future.job.monitor_interval
+                try:
+                    reason = monitor()
+                except Exception as e:
+                    print "LocalBackend: job monitor failed: {}".format(e)
+                    monitor = None
+                future.aborted = reason is not None
+            if reason is not None:
+                _kill(process)
+                future.rusage = _wait4(process, block=True)
+                break
+            time.sleep(self.poll_interval)
+        self._release(future)
+        future._set_done(process.returncode, reason)
+        self._schedule()
+
+    def shutdown(self, kill=False):
+        """ Cancels pending jobs; if kill is True, running jobs are killed as well
+        """
+        with self._lock:
+            futures, self._pending = self._pending, []
+            if kill:
+                futures += list(self._running)
+        for future in futures:
+            future.cancel()
+
+
+class DryRunBackend(LocalBackend):
+    """ Prints SIESTA commands instead of running them, these jobs succeed immediately. ATOM jobs are run
+    as usual, since the pseudopotential file and the errors read from their output are needed by the next steps
+    """
+
+    def _start(self, future):
+        job = future.job
+        if job.name != "siesta":
+            return super(DryRunBackend, self)._start(future)
+        print "[dry-run] cd {} && {}{}{}".format(job.cwd or ".",
+                                                 " ".join(future.cmd),
+                                                 " < " + job.stdin if job.stdin else "",
+                                                 " > " + job.stdout if job.stdout else "")
+        future.start_time = time.time()
+        self._release(future)
+        future._set_done(0)
+
+
+class FakeBackend(LocalBackend):
+    """ Runs fake_siesta.py instead of SIESTA (ATOM jobs are run as usual), which makes it possible
+    to test and benchmark the orchestration without real SIESTA calculations
+    """
+
+    def command(self, job):
+        if job.name == "siesta":
+            return [sys.executable, FAKE_SIESTA]
+        return super(FakeBackend, self).command(job)
+
+
+BACKENDS = {"local": LocalBackend,
+            "dry-run": DryRunBackend,
+            "fake": FakeBackend}
+
+_backends = {}
+
+
+def get_backend(settings):
+    """ Returns the backend given by settings.backend (one of BACKENDS keys, default 'local'),
+    shared by all calculations in the process that use the same backend options;
+    settings.backend may also be a backend instance, e.g. the one shared by a campaign
+    """
+    name = getattr(settings, 'backend', 'local')
+    if not isinstance(name, basestring):
+        return name
+    options = (name,
+               getattr(settings, 'n_cores', None),
+               getattr(settings, 'mpirun', 'mpirun'),
+               getattr(settings, 'mpi_options', ''))
+    if options not in _backends:
+        _backends[options] = BACKENDS[name](*options[1:])
+    return _backends[options]
@@ -0,0 +1,159 @@
+"""
+cache.py contains on-disk cache of generated pseudopotentials
+"""
+
+import os
+import uuid
+import shutil
+import hashlib
+import numpy as np
+
+_program_ids = {}
+
+
+def program_identity(program):
+    """ Returns a hash identifying the program binary, so that the cache is invalidated when
+    ATOM is recompiled or replaced
+
+    Arguments:
+        program {string} -- path to the program executable
+    """
+    try:
+        st = os.stat(program)
+    except OSError:
+        return program
+    stamp = (program, st.st_size, st.st_mtime)
+    if stamp not in _program_ids:
+        h = hashlib.sha1()
+        with open(program, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        _program_ids[stamp] = h.hexdigest()
+    return _program_ids[stamp]
+
+
+class PseudoCache(object):
+
+    _err_file = "err_pseudo"
+    _array_dir = "arrays"
+
+    def __init__(self, cache_dir, max_size=500):
+        """ On-disk cache of generated pseudopotentials keyed by the hash of ATOM input.
+        Least recently used entries are evicted when the cache size exceeds max_size
+
+        Arguments:
+            cache_dir {string} -- cache directory
+
+        Keyword Arguments:
+            max_size {float} -- maximum size of the cache, MB (default: {500})
+        """
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_size = max_size * 1024 * 1024
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def key(self, input_text, program):
+        h = hashlib.sha1()
+        h.update(input_text.encode("utf-8"))
+        h.update(program_identity(program).encode("utf-8"))
+        return h.hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def get(self, key, files, dest_dir="."):
+        """ Copies cached files to dest_dir, returns stored pseudopotential error
+        or None if there is no such entry in the cache
+        """
+        entry = self._entry(key)
+        err_file = os.path.join(entry, self._err_file)
+        if not os.path.exists(err_file):
+            return None
+        try:
+            for file_name in files:
+                shutil.copy(os.path.join(entry, file_name), dest_dir)
+            with open(err_file, "r") as f:
+                err = float(f.read())
+        except (IOError, OSError, ValueError):
+            return None
+        # mark entry as recently used
+        os.utime(entry, None)
+        return err
+
+    def put(self, key, files, err, src_dir="."):
+        """ Stores files from src_dir and pseudopotential error under key
+        """
+        entry = self._entry(key)
+        if os.path.exists(entry):
+            return
+        parent = os.path.dirname(entry)
+        if not os.path.exists(parent):
+            os.makedirs(parent)
+        # fill a temporary directory first so that concurrent readers never see half-written entries
+        tmp = os.path.join(parent, ".tmp-" + uuid.uuid4().hex[:8])
+        os.makedirs(tmp)
+        for file_name in files:
+            shutil.copy(os.path.join(src_dir, file_name), tmp)
+        with open(os.path.join(tmp, self._err_file), "w") as f:
+            f.write(repr(err))
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict()
+
+    def get_array(self, key):
+        """ Returns small array stored under key (these are not evicted), None if there is no such array
+        """
+        file_name = os.path.join(self.cache_dir, self._array_dir, key + ".npy")
+        if not os.path.exists(file_name):
+            return None
+        try:
+            return np.load(file_name)
+        except (IOError, ValueError):
+            return None
+
+    def put_array(self, key, array):
+        dirname = os.path.join(self.cache_dir, self._array_dir)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        tmp = os.path.join(dirname, ".tmp-" + uuid.uuid4().hex[:8] + ".npy")
+        np.save(tmp, array)
+        os.rename(tmp, os.path.join(dirname, key + ".npy"))
+
+    def _entries(self):
+        entries = []
+        for sub in os.listdir(self.cache_dir):
+            if sub == self._array_dir:
+                continue
+            sub = os.path.join(self.cache_dir, sub)
+            if not os.path.isdir(sub):
+                continue
+            for name in os.listdir(sub):
+                if name.startswith("."):
+                    continue
+                entry = os.path.join(sub, name)
+                size = sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+                entries.append((os.path.getmtime(entry), size, entry))
+        return entries
+
+    def evict(self):
+        """ Removes least recently used entries until the cache fits into max_size
+        """
+        entries = sorted(self._entries())
+        total = sum(e[1] for e in entries)
+        while entries and total > self.max_size:
+            _, size, entry = entries.pop(0)
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+
+def get_pseudo_cache(settings, work_dir=None):
+    """ Returns PseudoCache configured by settings.pseudo_cache_dir (relative to work_dir, the current
+    directory by default) and settings.pseudo_cache_size, or None if caching is switched off
+    """
+    cache_dir = getattr(settings, 'pseudo_cache_dir', None)
+    if cache_dir is None:
+        return None
+    return PseudoCache(os.path.join(os.path.abspath(work_dir or "."), cache_dir),
+                       getattr(settings, 'pseudo_cache_size', 500))
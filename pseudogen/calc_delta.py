@@ -6,11 +6,42 @@
 """
 
 import os
+import time
+import shutil
+import threading
 import numpy as np
+from scipy.optimize import brentq
+from backend import JobError
 from siesta import SiestaCalculation
+from fidelity import FULL, fidelity_options
+from cache import get_pseudo_cache
+from cutoff import get_mesh_cutoff
+from reference import get_reference, get_references, reference_code
 
 echarge = 1.60217733e-19
 
+# the lowest delta of the full fidelity candidates evaluated so far, {element: delta}
+_best_deltas = {}
+_best_lock = threading.Lock()
+# elements warned that their candidates cannot be pruned
+_pruning_warned = set()
+
+
+def update_best_delta(element, delta):
+    """ Registers delta of the evaluated candidate, so that the runs of the candidates which cannot
+    beat it are stopped early (see DeltaCalculation._cant_win)
+    """
+    if delta is None:
+        return
+    with _best_lock:
+        if element not in _best_deltas or delta < _best_deltas[element]:
+            _best_deltas[element] = float(delta)
+
+
+def best_delta(element):
+    with _best_lock:
+        return _best_deltas.get(element)
+
 def read_ref_data(file_name):
     """ Read reference data on V0, B0 and B1 from file
     
@@ -43,8 +74,7 @@ def BM(energies):
             break
 
     if volume0 == 0:
-        print('Error: No minimum could be found')
-        exit()
+        raise ValueError("BM: no minimum could be found")
     
     derivV2 = 4./9. * x**5. * deriv2(x)
     derivV3 = (-20./9. * x**(13./2.) * deriv2(x) -
@@ -54,18 +84,70 @@ def BM(energies):
 
     return volume0, bulk_modulus0, bulk_deriv0, residuals0
 
-def calcDelta(data_f, data_w, useasymm):
+def BM_batch(volumes, energies):
+    """ Fits Birch-Murnaghan EOS to many sets of (volume, energy) points at once
+
+    Arguments:
+        volumes {np.array} -- volumes, shape (n_sets, n_points)
+        energies {np.array} -- energies, shape (n_sets, n_points)
+
+    Returns:
+        tuple -- arrays of equilibrium volumes, bulk moduli, bulk modulus derivatives and
+                 residuals, and the mask of sets for which no minimum could be found
     """
-    Calculate the Delta using the data in data_f, data_w 
+    volumes = np.atleast_2d(np.asarray(volumes, dtype=float))
+    energies = np.atleast_2d(np.asarray(energies, dtype=float))
+    x = volumes ** (-2./3.)
+    # fit cubic polynomial in scaled variable t = (x - x_c) / x_s to keep the fit well-conditioned
+    x_c = (x.max(axis=1) + x.min(axis=1)) / 2.
+    x_s = (x.max(axis=1) - x.min(axis=1)) / 2.
+    x_s[x_s == 0] = 1.
+    t = (x - x_c[:, None]) / x_s[:, None]
+    # the cubic is undetermined by 3 points, then the second order EOS (B1 = 4) is fitted
+    a = t[:, :, None] ** np.arange(min(4, x.shape[1]))
+    c = np.zeros((x.shape[0], 4))
+    c[:, :a.shape[2]] = np.einsum('nij,nj->ni', np.linalg.pinv(a), energies)
+    ssr = np.sum((np.einsum('nij,nj->ni', a, c[:, :a.shape[2]]) - energies)**2., axis=1)
+    sst = np.sum((energies - energies.mean(axis=1)[:, None])**2., axis=1)
+    residuals0 = ssr / sst
+
+    # the first derivative 3 c3 t^2 + 2 c2 t + c1 has at most one root with positive second derivative,
+    # which equals sqrt of the discriminant there
+    qa, qb, qc = 3. * c[:, 3], 2. * c[:, 2], c[:, 1]
+    disc = qb**2. - 4. * qa * qc
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sqrt_disc = np.sqrt(disc)
+        t0 = np.where(qb > 0,
+                      -2. * qc / (qb + sqrt_disc),
+                      (-qb + sqrt_disc) / (2. * qa))
+        x0 = x_c + x_s * t0
+        failed = ~(np.isfinite(x0) & (disc > 0) & (x0 > 0))
+        x0[failed] = np.nan
+        deriv2 = (2. * c[:, 2] + 6. * c[:, 3] * t0) / x_s**2.
+        deriv3 = 6. * c[:, 3] / x_s**3.
+
+        volume0 = x0**(-3./2.)
+        derivV2 = 4./9. * x0**5. * deriv2
+        derivV3 = (-20./9. * x0**(13./2.) * deriv2 -
+            8./27. * x0**(15./2.) * deriv3)
+        bulk_modulus0 = derivV2 / x0**(3./2.)
+        bulk_deriv0 = -1 - x0**(-3./2.) * derivV3 / derivV2
+
+    return volume0, bulk_modulus0, bulk_deriv0, residuals0, failed
+
+def calcDelta_batch(data_f, data_w, useasymm):
+    """
+    Calculate the Delta using the data in data_f, data_w for many records at once;
+    V0, B0 and BP fields of data_f and data_w must be broadcastable arrays
     """
 
-    v0w = data_w['V0']
-    b0w = data_w['B0'] * 10.**9. / 1.602176565e-19 / 10.**30.
-    b1w = data_w['BP']
+    v0w = np.asarray(data_w['V0'], dtype=float)
+    b0w = np.asarray(data_w['B0'], dtype=float) * 10.**9. / 1.602176565e-19 / 10.**30.
+    b1w = np.asarray(data_w['BP'], dtype=float)
 
-    v0f = data_f['V0']
-    b0f = data_f['B0'] * 10.**9. / 1.602176565e-19 / 10.**30.
-    b1f = data_f['BP']
+    v0f = np.asarray(data_f['V0'], dtype=float)
+    b0f = np.asarray(data_f['B0'], dtype=float) * 10.**9. / 1.602176565e-19 / 10.**30.
+    b1f = np.asarray(data_f['BP'], dtype=float)
 
     vref = 30.
     bref = 100. * 10.**9. / 1.602176565e-19 / 10.**30.
@@ -87,38 +169,31 @@ def calcDelta(data_f, data_w, useasymm):
     a1w = 9. * v0w**(5./3.) * b0w / 16. * (3. * b1w - 16.)
     a0w = 9. * v0w * b0w / 16. * (6. - b1w)
 
-    x = [0, 0, 0, 0, 0, 0, 0]
-
-    x[0] = (a0f - a0w)**2
-    x[1] = 6. * (a1f - a1w) * (a0f - a0w)
-    x[2] = -3. * (2. * (a2f - a2w) * (a0f - a0w) + (a1f - a1w)**2.)
-    x[3] = -2. * (a3f - a3w) * (a0f - a0w) - 2. * (a2f - a2w) * (a1f - a1w)
-    x[4] = -3./5. * (2. * (a3f - a3w) * (a1f - a1w) + (a2f - a2w)**2.)
-    x[5] = -6./7. * (a3f - a3w) * (a2f - a2w)
-    x[6] = -1./3. * (a3f - a3w)**2.
-
-    y = [0, 0, 0, 0, 0, 0, 0]
-
-    y[0] = (a0f + a0w)**2 / 4.
-    y[1] = 3. * (a1f + a1w) * (a0f + a0w) / 2.
-    y[2] = -3. * (2. * (a2f + a2w) * (a0f + a0w) + (a1f + a1w)**2.) / 4.
-    y[3] = -(a3f + a3w) * (a0f + a0w) / 2. - (a2f + a2w) * (a1f + a1w) / 2.
-    y[4] = -3./20. * (2. * (a3f + a3w) * (a1f + a1w) + (a2f + a2w)**2.)
-    y[5] = -3./14. * (a3f + a3w) * (a2f + a2w)
-    y[6] = -1./12. * (a3f + a3w)**2.
-
-    Fi = np.zeros_like(Vi)
-    Ff = np.zeros_like(Vf)
-
-    Gi = np.zeros_like(Vi)
-    Gf = np.zeros_like(Vf)
-
-    for n in range(7):
-        Fi = Fi + x[n] * Vi**(-(2.*n-3.)/3.)
-        Ff = Ff + x[n] * Vf**(-(2.*n-3.)/3.)
-
-        Gi = Gi + y[n] * Vi**(-(2.*n-3.)/3.)
-        Gf = Gf + y[n] * Vf**(-(2.*n-3.)/3.)
+    x = np.array(np.broadcast_arrays(
+        (a0f - a0w)**2,
+        6. * (a1f - a1w) * (a0f - a0w),
+        -3. * (2. * (a2f - a2w) * (a0f - a0w) + (a1f - a1w)**2.),
+        -2. * (a3f - a3w) * (a0f - a0w) - 2. * (a2f - a2w) * (a1f - a1w),
+        -3./5. * (2. * (a3f - a3w) * (a1f - a1w) + (a2f - a2w)**2.),
+        -6./7. * (a3f - a3w) * (a2f - a2w),
+        -1./3. * (a3f - a3w)**2.))
+
+    y = np.array(np.broadcast_arrays(
+        (a0f + a0w)**2 / 4.,
+        3. * (a1f + a1w) * (a0f + a0w) / 2.,
+        -3. * (2. * (a2f + a2w) * (a0f + a0w) + (a1f + a1w)**2.) / 4.,
+        -(a3f + a3w) * (a0f + a0w) / 2. - (a2f + a2w) * (a1f + a1w) / 2.,
+        -3./20. * (2. * (a3f + a3w) * (a1f + a1w) + (a2f + a2w)**2.),
+        -3./14. * (a3f + a3w) * (a2f + a2w),
+        -1./12. * (a3f + a3w)**2.))
+
+    # powers V^(-(2n-3)/3) for n = 0..6
+    powers = (-(2. * np.arange(7) - 3.) / 3.).reshape((7,) + (1,) * np.ndim(Vi))
+    Fi = np.sum(x * Vi**powers, axis=0)
+    Ff = np.sum(x * Vf**powers, axis=0)
+
+    Gi = np.sum(y * Vi**powers, axis=0)
+    Gf = np.sum(y * Vf**powers, axis=0)
 
     Delta = 1000. * np.sqrt((Ff - Fi) / (Vf - Vi))
     Deltarel = 100. * np.sqrt((Ff - Fi) / (Gf - Gi))
@@ -129,8 +204,48 @@ def calcDelta(data_f, data_w, useasymm):
         Delta1 = 1000. * np.sqrt((Ff - Fi) / (Vf - Vi)) \
                  / (v0w + v0f) / (b0w + b0f) * 4. * vref * bref
 
+    return Delta, Deltarel, Delta1
+
+def calcDelta(data_f, data_w, useasymm):
+    """
+    Calculate the Delta using the data in data_f, data_w 
+    """
+    Delta, Deltarel, Delta1 = calcDelta_batch(data_f, data_w, useasymm)
     return Delta[0], Deltarel[0], Delta1[0]
 
+def _bm_energy(volume, v0, b0, b1):
+    # Birch-Murnaghan energy relative to the minimum, b0 in eV/A^3
+    eta = (v0 / volume) ** (2./3.)
+    return 9. * v0 * b0 / 16. * ((eta - 1.) ** 3 * b1 + (eta - 1.) ** 2 * (6. - 4. * eta))
+
+def estimate_delta(volumes, energies, ref):
+    """ Rough delta factor of per-atom (volume, energy) points: V0 and B0 of the parabola fitted to at least
+    3 points, or, for 2 points, V0 of the reference-shaped (B0, B1 of the reference) EOS through them;
+    B1 is taken from the reference. Returns None if the points have no minimum
+    """
+    b1 = float(ref["BP"][0])
+    if len(volumes) == 2:
+        # only the volume deviates from the reference, so the estimate does not exceed the actual delta much
+        b0 = float(ref["B0"][0])
+        b0_ev = b0 / (echarge * 1.0e21)
+        v_ref = float(ref["V0"][0])
+        de = energies[0] - energies[1]
+        f = lambda v0: _bm_energy(volumes[0], v0, b0_ev, b1) - _bm_energy(volumes[1], v0, b0_ev, b1) - de
+        if f(0.7 * v_ref) * f(1.3 * v_ref) > 0:
+            return None
+        v0 = brentq(f, 0.7 * v_ref, 1.3 * v_ref)
+    else:
+        if len(volumes) < 2:
+            return None
+        a, b, _ = np.polyfit(volumes, energies, 2)
+        if a <= 0:
+            return None
+        v0 = -b / (2. * a)
+        # eV/A^3 -> GPa
+        b0 = 2. * a * v0 * echarge * 1.0e21
+    data = np.core.records.fromrecords([("X", v0, b0, b1)], names=('element', 'V0', 'B0', 'BP'))
+    return float(calcDelta(data, ref, useasymm=False)[0])
+
 def get_volumes(n_vol, calc, alat=None):
     abc = np.array(calc["vectors"])
     vol = np.linalg.det(abc) * (calc["alat"] ** 3)
@@ -141,86 +256,385 @@ def get_alats(volumes, calc):
     vol_abc = np.linalg.det(np.array(calc["vectors"]))
     return (volumes / vol_abc) ** (1./3)
 
+def eos_uncertainty(volumes, energies):
+    """ Fits BM EOS to the points and estimates uncertainties of V0, B0 and B1 by jackknife
+
+    Returns:
+        tuple -- (V0, B0, B1, residuals), array of (V0, B0, B1) standard errors (inf if cannot be estimated)
+                 and failure flag
+    """
+    volumes = np.asarray(volumes, dtype=float)
+    energies = np.asarray(energies, dtype=float)
+    n = len(volumes)
+    fit = BM_batch(volumes, energies)
+    failed = fit[-1][0]
+    fit = tuple(f[0] for f in fit[:4])
+    sigma = np.inf * np.ones(3)
+    if failed or n < 5:
+        return fit, sigma, failed
+    # leave-one-out fits
+    idx = np.array([[j for j in range(n) if j != i] for i in range(n)])
+    jk = BM_batch(volumes[idx], energies[idx])
+    if not jk[-1].any():
+        params = np.vstack(jk[:3]).T
+        sigma = np.sqrt((n - 1.) / n * np.sum((params - params.mean(axis=0))**2., axis=0))
+    return fit, sigma, failed
+
+def next_volumes(volumes, energies, v0=None, n_new=2):
+    """ Proposes n_new volumes from the grid of Delta factor integration interval (0.94-1.06)*V0
+    lying farthest from the already calculated ones; if V0 is unknown, the grid is centered
+    at the volume with the lowest energy
+    """
+    volumes = np.asarray(volumes, dtype=float)
+    if v0 is None or not np.isfinite(v0):
+        v0 = volumes[np.argmin(energies)]
+    grid = v0 * np.linspace(0.94, 1.06, 7)
+    new = []
+    for _ in range(n_new):
+        known = np.concatenate((volumes, new))
+        dist = np.min(np.abs(grid[:, None] - known[None, :]), axis=1) / v0
+        if dist.max() < 0.005:
+            break
+        new.append(grid[np.argmax(dist)])
+    return np.array(new)
+
 
 class DeltaCalculation(object):
     
-    def __init__(self, settings, uuid, logger=None):
-        """ A class for delta factor calculation
+    def __init__(self, settings, uuid, logger=None, work_dir=None):
+        """ A class for delta factor calculation, made in {work_dir}/{element}/{uuid}
+        (work_dir is the current directory by default)
         """
+        self._log = False
         if logger is not None:
             self._log = True
             self._logger = logger
-        self._cwd = os.getcwd()
+        self._cwd = os.path.abspath(work_dir or ".")
         self.settings = settings
         self.element = settings.calc["element"]
+        self.uuid = uuid
         self.pseudo_file = None
+        self.mesh_cutoff = None
+        # reason of aborting the SIESTA runs, see _check_run
+        self.aborted = None
+        # delta estimated from the finished volumes of the pruned candidate, see _cant_win
+        self.estimated_delta = None
+        self._fidelity = FULL
         if self._log:
             self._logger.info("Uuid: {}".format(uuid))
-        self._calc_dir = os.path.join(self.element, uuid)
+        self._calc_dir = os.path.join(self._cwd, self.element, uuid)
         if not os.path.exists(self._calc_dir):
             os.makedirs(self._calc_dir)
-        self._switch_dir()
-
 
-    def _switch_dir(self):
-        if os.getcwd() == self._cwd:
-            os.chdir(self._calc_dir)
-        elif os.getcwd() == self._calc_dir:
-            os.chdir(self._cwd)
-        else:
-            print "DeltaCalculation._switch_dir: found myself in a strange directory: {}".format(os.getcwd())
+    @property
+    def calc_dir(self):
+        return self._calc_dir
 
     def add_pseudo(self, pseudo_file):
-        self.pseudo_file = pseudo_file
+        self.pseudo_file = os.path.join(self._calc_dir, pseudo_file)
 
-    def run_calcs(self, fdf_file):
-        volumes = get_volumes(self.settings.volumes, self.settings.calc)
-        alats = get_alats(volumes, self.settings.calc)
-        x, y = [], []
-        siesta_calc = SiestaCalculation(self.settings, self.pseudo_file, fdf_file=fdf_file)
+    def _cant_win(self, siesta_calc, alats):
+        """ Returns the reason to stop the candidate if delta estimated from its finished volumes
+        is more than settings.prune_factor times the best delta found so far, None otherwise
+        """
+        prune_factor = getattr(self.settings, 'prune_factor', None)
+        best = best_delta(self.element)
+        if prune_factor is None or best is None or self._fidelity != FULL:
+            return None
+        volumes, energies = self._results(siesta_calc, alats)
+        if len(volumes) < max(2, getattr(self.settings, 'prune_min_points', 2)):
+            return None
+        reference = get_reference(self.settings, work_dir=self._cwd)
+        if self.element not in reference:
+            return None
+        delta = estimate_delta(volumes, energies, reference.get(self.element))
+        if delta is None or delta <= prune_factor * best:
+            return None
+        self.estimated_delta = float(delta)
+        return "pruned: estimated delta = {:.4} > {} x best delta {:.4}".format(delta, prune_factor, best)
+
+    def _warn_pruning(self, n_volumes):
+        """ Warns if candidates with n_volumes volume points cannot be pruned, since no run is left
+        when prune_min_points of them have finished
+        """
+        n_min = max(2, getattr(self.settings, 'prune_min_points', 2))
+        if getattr(self.settings, 'prune_factor', None) is None or n_min < n_volumes:
+            return
+        with _best_lock:
+            if self.element in _pruning_warned:
+                return
+            _pruning_warned.add(self.element)
+        message = "prune_min_points = {} is not less than the number of volumes {}, " \
+                  "candidates are never pruned".format(n_min, n_volumes)
+        if self._log:
+            self._logger.warning(message)
+        else:
+            print "DeltaCalculation: " + message
+
+    def _check_run(self, siesta_calc, alats, future=None, remaining=True):
+        """ Sets self.aborted if the finished run was killed by its SCF monitor or the candidate
+        cannot win (checked only if some runs remain), returns True if the candidate is aborted
+        """
+        if self.aborted is None:
+            if future is not None and future.aborted:
+                self.aborted = future.reason
+            elif remaining:
+                self.aborted = self._cant_win(siesta_calc, alats)
+            if self.aborted is not None and self._log:
+                self._logger.info("SIESTA runs aborted: {}".format(self.aborted))
+        return self.aborted is not None
+
+    def _wait_runs(self, siesta_calc, alats, futures):
+        """ Waits for the submitted runs; once the candidate is aborted, the remaining runs are cancelled
+        """
+        pending = list(futures)
+        while pending:
+            done = [f for f in pending if f.done()]
+            if not done:
+                time.sleep(0.2)
+                continue
+            pending = [f for f in pending if f not in done]
+            for future in done:
+                try:
+                    future.result()
+                except JobError as e:
+                    if self._log:
+                        self._logger.error("SIESTA run failed: {}".format(e))
+                if self._check_run(siesta_calc, alats, future, remaining=bool(pending)):
+                    reason = self.aborted if self.aborted.startswith("pruned") else "pruned: " + self.aborted
+                    for f in pending:
+                        f.cancel(reason)
+                    pending = []
+                    break
+        for future in futures:
+            future.wait()
+
+    def _run_parallel(self, siesta_calc, alats):
+        """ Submits SIESTA runs for all alats not calculated yet at once, the number of simultaneous runs
+        is limited by the core budget of the backend
+        """
+        futures = []
         for alat in alats:
             siesta_calc.prepare(alat)
             if not siesta_calc.is_run:
-                siesta_calc.run()
-            e = siesta_calc.results()
+                futures.append(siesta_calc.submit(alat))
+        if futures and self._log:
+            self._logger.debug("Submitted {} SIESTA calculations".format(len(futures)))
+        self._wait_runs(siesta_calc, alats, futures)
+
+    @property
+    def _seeds_dir(self):
+        # density matrices of the last finished candidate, used as starting guesses
+        return os.path.join(self._cwd, self.element, "dm_seeds")
+
+    def _read_seeds(self):
+        seeds = {}
+        if os.path.isdir(self._seeds_dir):
+            for file_name in os.listdir(self._seeds_dir):
+                if file_name.endswith(".DM"):
+                    seeds[float(file_name[:-3])] = os.path.join(self._seeds_dir, file_name)
+        return seeds
+
+    def _save_seeds(self, siesta_calc, alats):
+        if not os.path.isdir(self._seeds_dir):
+            os.makedirs(self._seeds_dir)
+        for alat in alats:
+            dm_file = os.path.join(siesta_calc._path(alat), self.element + ".DM")
+            if not (os.path.exists(dm_file) and siesta_calc.check(alat)):
+                continue
+            tmp = os.path.join(self._seeds_dir, ".tmp-" + self.uuid)
+            shutil.copy(dm_file, tmp)
+            os.rename(tmp, os.path.join(self._seeds_dir, siesta_calc.dir_name(alat) + ".DM"))
+
+    def _seed(self, siesta_calc, alat, previous, finished):
+        """ Returns DM file to start SIESTA run for alat from: the same volume of the previous candidate,
+        or the nearest finished volume of this candidate, or the nearest volume of the previous candidate
+        """
+        nearest = lambda alats: min(alats, key=lambda a: abs(a - alat))
+        if previous:
+            a = nearest(previous.keys())
+            if abs(a - alat) < 5e-5:
+                return previous[a]
+        dm_files = [a for a in finished if os.path.exists(os.path.join(siesta_calc._path(a), self.element + ".DM"))]
+        if dm_files:
+            return os.path.join(siesta_calc._path(nearest(dm_files)), self.element + ".DM")
+        if previous:
+            return previous[nearest(previous.keys())]
+        return None
+
+    def _run_warm(self, siesta_calc, alats, parallel, finished=()):
+        """ Runs SIESTA starting from density matrices of the previous candidate or of the finished volumes.
+        Volumes are run from the center of the interval outwards; if there is no previous candidate, the central
+        volume is run first, so that the others can be started from its density matrix
+        """
+        previous = self._read_seeds()
+        center = np.median(alats)
+        finished = list(finished)
+        futures = []
+        for alat in sorted(alats, key=lambda a: abs(a - center)):
+            siesta_calc.prepare(alat, dm_seed=self._seed(siesta_calc, alat, previous, finished))
+            if siesta_calc.is_run:
+                finished.append(alat)
+            elif not parallel or (not previous and not finished):
+                future = siesta_calc.run(alat)
+                if siesta_calc.check(alat):
+                    finished.append(alat)
+                if self._check_run(siesta_calc, alats, future, remaining=len(finished) < len(alats)):
+                    break
+            else:
+                futures.append(siesta_calc.submit(alat))
+        self._wait_runs(siesta_calc, alats, futures)
+        if self.aborted is None:
+            self._save_seeds(siesta_calc, alats)
+
+    def _run_alats(self, siesta_calc, alats, finished=()):
+        """ Runs SIESTA calculations for alats in the mode given by settings
+        """
+        parallel = getattr(self.settings, 'n_cores', None) is not None
+        if getattr(self.settings, 'dm_warm_start', False):
+            self._run_warm(siesta_calc, alats, parallel, finished)
+        elif parallel:
+            self._run_parallel(siesta_calc, alats)
+        else:
+            for i, alat in enumerate(alats):
+                siesta_calc.prepare(alat)
+                if siesta_calc.is_run:
+                    continue
+                future = siesta_calc.run(alat)
+                if self._check_run(siesta_calc, alats, future, remaining=i < len(alats) - 1):
+                    break
+
+    def _results(self, siesta_calc, alats):
+        """ Returns per-atom volumes and energies of the finished calculations
+        """
+        x, y = [], []
+        for alat in alats:
+            e = siesta_calc.results(alat)
             if e is not None:
                 x.append(float(e[0]))
                 y.append(e[1])
-        self.volumes = np.array(x) / self.settings.calc["nat"]
-        self.energies = np.array(y) / self.settings.calc["nat"]
+        return np.array(x) / self.settings.calc["nat"], np.array(y) / self.settings.calc["nat"]
+
+    def _check_points(self, volumes, n_planned, n_min=4):
+        """ Sets self.aborted if fewer than n_min (or all n_planned, if there are fewer) SIESTA runs
+        have finished, so that the candidate is rejected instead of fitting EOS to too few points
+        """
+        n_min = min(n_min, n_planned)
+        if len(volumes) < n_min:
+            self.aborted = "only {} of {} SIESTA runs finished, {} needed for EOS fit".format(len(volumes),
+                                                                                          n_planned, n_min)
+            if self._log:
+                self._logger.error(self.aborted)
+        return self.aborted is None
+
+    def _run_adaptive(self, siesta_calc):
+        """ Adds volume points until BM fit residual and jackknife errors of V0, B0 and B1
+        are within tolerances, returns alats of all calculated points
+        """
+        nat = self.settings.calc["nat"]
+        n_initial = getattr(self.settings, 'eos_initial_points', 5)
+        n_max = getattr(self.settings, 'eos_max_points', 9)
+        n_step = getattr(self.settings, 'eos_points_per_step', 2)
+        res_tol = getattr(self.settings, 'eos_residual_tol', 1e-4)
+        # relative tolerance of V0, B0 and absolute tolerance of B1
+        tols = np.array([getattr(self.settings, 'eos_v0_tol', 1e-3),
+                         getattr(self.settings, 'eos_b0_tol', 1e-2),
+                         getattr(self.settings, 'eos_b1_tol', 0.1)])
+        alats = list(get_alats(get_volumes(n_initial, self.settings.calc), self.settings.calc))
+        new_alats = alats
+        while True:
+            self._run_alats(siesta_calc, new_alats, finished=[a for a in alats if a not in new_alats])
+            if self.aborted is not None:
+                break
+            volumes, energies = self._results(siesta_calc, alats)
+            if not self._check_points(volumes, len(alats)):
+                break
+            (v0, b0, b1, res), sigma, failed = eos_uncertainty(volumes, energies)
+            errors = sigma / np.abs([v0, b0, 1.]) if not failed else np.inf * tols
+            converged = (not failed and res <= res_tol and np.all(errors <= tols)
+                         and volumes.min() < v0 < volumes.max())
+            if self._log:
+                self._logger.debug("Adaptive EOS: {} points, V0 = {:.6} +- {:.3}, B0 = {:.6} +- {:.3}, "
+                                   "B1 = {:.4} +- {:.3}, residual = {:.3}".format(len(volumes), v0, sigma[0],
+                                                                                  b0, sigma[1], b1, sigma[2], res))
+            if converged or len(alats) >= n_max:
+                break
+            new_volumes = next_volumes(volumes, energies, None if failed else v0, min(n_step, n_max - len(alats)))
+            if len(new_volumes) == 0:
+                break
+            new_alats = list(get_alats(new_volumes * nat, self.settings.calc))
+            alats += new_alats
+        return sorted(alats)
+
+    def run_calcs(self, fdf_file, fidelity=FULL):
+        """ Runs SIESTA calculations for the volume points; at lower fidelity the fdf template is changed
+        by the overrides of settings.screening and its number of volumes is used. At full fidelity
+        MeshCutoff converged for the pseudopotential is used if settings.mesh_cutoff_convergence is set.
+        If the runs are aborted (see _check_run) or too few of them finish, self.aborted holds the reason
+        """
+        self._fidelity = fidelity
+        fdf_overrides, n_volumes = fidelity_options(self.settings, fidelity)
+        if fidelity == FULL:
+            self.mesh_cutoff = get_mesh_cutoff(self.settings, self.pseudo_file, fdf_file,
+                                               os.path.join(self._calc_dir, "mesh_cutoff"),
+                                               cache=get_pseudo_cache(self.settings, self._cwd),
+                                               logger=self._logger if self._log else None)
+            if self.mesh_cutoff is not None:
+                fdf_overrides = {"MeshCutoff": "%g Ry" % (self.mesh_cutoff,)}
+        siesta_calc = SiestaCalculation(self.settings, self.pseudo_file, fdf_file=fdf_file, work_dir=self._calc_dir,
+                                        fdf_overrides=fdf_overrides)
+        if fidelity == FULL and getattr(self.settings, 'adaptive_eos', False):
+            alats = self._run_adaptive(siesta_calc)
+        else:
+            volumes = get_volumes(n_volumes or self.settings.volumes, self.settings.calc)
+            alats = get_alats(volumes, self.settings.calc)
+            self._warn_pruning(len(alats))
+            self._run_alats(siesta_calc, alats)
+        if self.aborted is not None:
+            return
+        self.volumes, self.energies = self._results(siesta_calc, alats)
+        if not self._check_points(self.volumes, len(alats)):
+            return
         if self._log:
             data_str = "\n".join([" "*52 + "{0:12.8}          {1:12.8}".format(v, e) for v, e in zip(self.volumes, self.energies)])
             self._logger.debug("  Volumes, A^3/atom   Energies, eV/atom\n" + data_str)
 
     def get_delta(self):
-        if hasattr(self.settings, 'reference_file'):
-            ref_file_name = self.settings.reference_file
-        else:
-            ref_file_name = "delta/WIEN2k.txt"
-
-        ref_data = read_ref_data(ref_file_name)
-        ref_data_el = ref_data[ref_data['element'] == self.element]
-
-#        if len(self.volumes) == 7:
-        x_p = self.volumes
-        y_p = self.energies
-        # else:
-        #     p = np.polyfit(self.volumes, self.energies, 2)
-        #     min_p = -p[1] / (2*p[0])
-        #     x_p = np.linspace(0.94*min_p, 1.06*min_p, 7)
-        #     y_p = np.polyval(p, x_p)
-        vol, bulk_mod, bulk_deriv, _ = BM(np.vstack((x_p, y_p)).T)
-        bulk_mod *= (echarge * 1.0e21)
+        """ Fits EOS to the volume points and calculates delta factor; if the EOS has no minimum,
+        self.aborted holds the reason
+        """
+        vol, bulk_mod, bulk_deriv, _, failed = BM_batch(self.volumes, self.energies)
+        if failed[0]:
+            # the candidate is rejected (see evaluate.Candidate.fit)
+            self.aborted = "no minimum of EOS could be found"
+            if self._log:
+                self._logger.error(self.aborted)
+            return
+        vol, bulk_mod, bulk_deriv = float(vol[0]), float(bulk_mod[0]) * (echarge * 1.0e21), float(bulk_deriv[0])
         if self._log:
             self._logger.debug("Equil. vol\tBulk modulus\tBulk mod. deriv")
             self._logger.debug("{}\t{}\t{}".format(vol, bulk_mod, bulk_deriv))
         our_data = np.core.records.fromrecords([(self.element, vol, bulk_mod, bulk_deriv), ], names=('element', 'V0', 'B0', 'BP'))
-        delta, rel_delta, _ = calcDelta(our_data, ref_data_el, useasymm=False)
+        # delta factors with respect to all references with data for the element
+        references = get_references(self.settings, work_dir=self._cwd)
+        code = reference_code(self.settings)
+        ref_codes = sorted(ref_code for ref_code, ref_data in references.items() if self.element in ref_data)
+        if code not in ref_codes:
+            raise KeyError("No {} reference data for {}".format(code, self.element))
+        ref_data = [references[ref_code].get(self.element) for ref_code in ref_codes]
+        ref_data = dict((name, np.array([float(r[name][0]) for r in ref_data])) for name in ('V0', 'B0', 'BP'))
+        deltas, rel_deltas, _ = calcDelta_batch(our_data, ref_data, useasymm=False)
+        self.deltas = dict(zip(ref_codes, zip(deltas, rel_deltas)))
+        delta, rel_delta = self.deltas[code]
         self.delta = delta
-        self.rel_delta = rel_delta 
+        self.rel_delta = rel_delta
+        self.v0, self.b0, self.b1 = vol, bulk_mod, bulk_deriv
         if self._log:
             self._logger.info("Equilibrium volume per atom =    {min_p:6.6} A^3".format(min_p=vol))
             self._logger.info("""
                                 delta, meV/atom  rel_delta, % 
 Delta factor                =    {delta:6.4}       {rel_delta:6.4}""".format(delta=self.delta, rel_delta=self.rel_delta))
+            for ref_code in sorted(self.deltas):
+                if ref_code != code:
+                    self._logger.info("Delta factor ({:8}) =    {:6.4}       {:6.4}".format(ref_code, *self.deltas[ref_code]))
     
\ No newline at end of file
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+"""
+campaign.py runs pseudopotential searches for several elements at once in one process.
+All ATOM and SIESTA jobs go to one backend with a single core budget; pending jobs are started
+in order of priority (settings.priority) and shared fairly between elements (settings.share)
+"""
+
+import os
+import sys
+import imp
+import time
+import argparse
+import importlib
+import threading
+import traceback
+import multiprocessing
+import numpy as np
+from backend import BACKENDS
+from find_pseudo import find_pseudo
+from minimize_delta import minimize_delta
+
+
+def load_settings(name):
+    """ Imports settings module given by module name (e.g. settings_Al) or by file name
+    """
+    if name.endswith(".py") or os.sep in name:
+        module_name = os.path.splitext(os.path.basename(name))[0]
+        return imp.load_source(module_name, name)
+    return importlib.import_module(name)
+
+
+class Campaign(object):
+
+    def __init__(self, settings_list, n_cores=None, backend="local", mode="minimize", work_dir=None,
+                 mpirun="mpirun", mpi_options=""):
+        """ Pseudopotential search for several elements sharing one backend
+
+        Arguments:
+            settings_list {list} -- settings modules, one per element
+
+        Keyword Arguments:
+            n_cores {int} -- core budget of the campaign (default: {None}, the number of CPUs)
+            backend {string} -- backend name, one of backend.BACKENDS keys (default: {"local"})
+            mode {string} -- "minimize" to minimize delta starting from settings.radii (the first
+                             settings.n_optimized radii are optimized), "find" to evaluate settings.radii
+                             (default: {"minimize"})
+            work_dir {string} -- directory of the calculations and of SIESTA fdf templates (default: {None},
+                                 the current directory)
+            mpirun {string} -- MPI launcher (default: {"mpirun"})
+            mpi_options {string} -- additional options of MPI launcher (default: {""})
+        """
+        if mode not in ("minimize", "find"):
+            raise ValueError("Campaign: unknown mode {}".format(mode))
+        elements = [settings.calc["element"] for settings in settings_list]
+        if len(set(elements)) != len(elements):
+            raise ValueError("Campaign: each element can be run only once, got {}".format(elements))
+        self.settings_list = list(settings_list)
+        self.n_cores = n_cores or multiprocessing.cpu_count()
+        self.mode = mode
+        self.work_dir = os.path.abspath(work_dir or ".")
+        self.backend = BACKENDS[backend](self.n_cores, mpirun, mpi_options)
+        for settings in self.settings_list:
+            # all calculations of the campaign use its backend, volume points are submitted at once
+            settings.backend = self.backend
+            settings.n_cores = self.n_cores
+            self.backend.shares[settings.calc["element"]] = float(getattr(settings, 'share', 1.))
+        self.results = {}
+        self.errors = {}
+        self.wall_times = {}
+
+    def _run_element(self, settings):
+        element = settings.calc["element"]
+        t0 = time.time()
+        try:
+            if self.mode == "find":
+                result = find_pseudo(settings, work_dir=self.work_dir)
+            else:
+                n_opt = getattr(settings, 'n_optimized', 2)
+                radii = [float(r) for r in settings.radii]
+                result = minimize_delta(settings, np.array(radii[:n_opt]), (radii[n_opt:],), work_dir=self.work_dir)
+            self.results[element] = result
+        except Exception:
+            self.errors[element] = traceback.format_exc()
+            print "Campaign: {} failed\n{}".format(element, self.errors[element])
+        self.wall_times[element] = time.time() - t0
+
+    def run(self):
+        """ Runs all elements concurrently and waits for them
+
+        Returns:
+            dict -- {element: result of find_pseudo or minimize_delta}, failed elements are in errors dict
+        """
+        threads = []
+        for settings in self.settings_list:
+            thread = threading.Thread(target=self._run_element, args=(settings,),
+                                      name="campaign-" + settings.calc["element"])
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        try:
+            for thread in threads:
+                # join without timeout cannot be interrupted by Ctrl-C in python 2
+                while thread.is_alive():
+                    thread.join(1.)
+        except KeyboardInterrupt:
+            self.backend.shutdown(kill=True)
+            raise
+        return self.results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Runs pseudopotential search for several elements at once")
+    parser.add_argument("settings", nargs="+", help="settings modules (e.g. settings_Al) or files")
+    parser.add_argument("-n", "--cores", type=int, default=None, help="core budget (default: number of CPUs)")
+    parser.add_argument("-b", "--backend", default="local", choices=sorted(BACKENDS), help="execution backend")
+    parser.add_argument("-m", "--mode", default="minimize", choices=("minimize", "find"))
+    args = parser.parse_args(argv)
+    sys.path.insert(0, os.getcwd())
+    campaign = Campaign([load_settings(name) for name in args.settings],
+                        n_cores=args.cores,
+                        backend=args.backend,
+                        mode=args.mode)
+    results = campaign.run()
+    for element in sorted(campaign.wall_times):
+        print "{:3} {:10.1f} s  {}".format(element, campaign.wall_times[element],
+                                           results.get(element, "failed"))
+    return 1 if campaign.errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
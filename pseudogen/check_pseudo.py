@@ -12,7 +12,8 @@ import shutil
 import matplotlib.pyplot as plt
 from generate import PGInputFile, PTInputFile
 from get_energies import read_energy
-from calc_delta import BM, read_ref_data, calcDelta, get_alats, get_volumes
+from calc_delta import BM, calcDelta, get_alats, get_volumes
+from reference import get_reference
 
 
 def check_pseudo(settings, data_dir):
@@ -22,20 +23,19 @@ def check_pseudo(settings, data_dir):
         settings {[type]} -- [description]
         data_dir {[type]} -- [description]
     """
-    cwd = os.getcwd()
     element = settings.calc["element"]
     x, y = [], []
-    os.chdir(data_dir)
-    pseudo_file = glob.glob("*.psf")[0]
+    ref_data = get_reference(settings)
+    pseudo_file = glob.glob(os.path.join(data_dir, "*.psf"))[0]
     
-    for root, dirs, _ in os.walk(os.getcwd()):
+    for root, dirs, _ in os.walk(data_dir):
         if "check" in root: continue
         for dir_i in dirs:
             try:
                 alat = float(dir_i)
             except:
                 continue
-            energies = read_energy(element, alat)
+            energies = read_energy(element, alat, data_dir)
             if energies is not None:
                 x_i, y_i = energies
                 x.append(x_i)
@@ -53,22 +53,24 @@ def check_pseudo(settings, data_dir):
         y_p = np.poly1d(p)(x_p)
 
     # get check directory
-    if not os.path.exists("check"):
-        os.makedirs("check")
-    shutil.copy(pseudo_file, "check")
-    os.chdir("check")
+    check_dir = os.path.join(data_dir, "check")
+    if not os.path.exists(check_dir):
+        os.makedirs(check_dir)
+    shutil.copy(pseudo_file, check_dir)
 
     # write original data
-    np.savetxt("energies_original.txt", np.vstack((x, y)).T)
+    np.savetxt(os.path.join(check_dir, "energies_original.txt"), np.vstack((x, y)).T)
 
-    vol, bulk_mod, bulk_deriv, _ = BM(np.vstack((x_p, y_p)).T)
-    np.savetxt("energies_BM.txt", np.vstack((x_p, y_p)).T)
+    try:
+        vol, bulk_mod, bulk_deriv, _ = BM(np.vstack((x_p, y_p)).T)
+    except ValueError:
+        raise ValueError("check_pseudo: EOS of the energies in {} has no minimum".format(data_dir))
+    np.savetxt(os.path.join(check_dir, "energies_BM.txt"), np.vstack((x_p, y_p)).T)
     
     our_data = np.core.records.fromrecords([(element, vol, bulk_mod, bulk_deriv), ], names=('element', 'V0', 'B0', 'BP'))
-    ref_data = read_ref_data(os.path.join(cwd, "delta", "WIEN2k.txt"))
-    ref_data_el = ref_data[ref_data['element'] == element]
+    ref_data_el = ref_data.get(element)
     delta, delta_rel, _ = calcDelta(our_data, ref_data_el, useasymm=False)
-    with open("BP.dat", "w") as f:
+    with open(os.path.join(check_dir, "BP.dat"), "w") as f:
         f.write("Our data: {}\n".format(our_data))
         f.write("Reference data: {}\n".format(ref_data_el))
         f.write("Delta factor: {} {}\n".format(delta, delta_rel))
@@ -0,0 +1,101 @@
+"""
+cutoff.py finds the lowest MeshCutoff at which SIESTA total energy is converged for the pseudopotential:
+single-volume runs are made at increasing cutoffs until the energy changes by less than the tolerance.
+Converged cutoffs are cached by the hash of the pseudopotential and of the calculation settings
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+from siesta import SiestaCalculation, read_fdf_file
+
+DEFAULT_CUTOFFS = (100., 150., 200., 250., 300., 400.)
+
+# converged cutoffs found by this process, {key: cutoff}
+_converged = {}
+
+
+def cutoff_key(settings, pseudo_file, fdf_file, cutoffs, tolerance):
+    """ Hash of everything the converged cutoff depends on
+    """
+    h = hashlib.sha1()
+    with open(pseudo_file, "r") as f:
+        h.update(f.read().encode("utf-8"))
+    h.update(read_fdf_file(fdf_file).encode("utf-8"))
+    h.update(json.dumps([settings.calc, settings.siesta_calc, list(cutoffs), tolerance],
+                        sort_keys=True).encode("utf-8"))
+    return h.hexdigest()
+
+
+def converge_cutoff(settings, pseudo_file, fdf_file, work_dir, cutoffs=DEFAULT_CUTOFFS, tolerance=1e-3,
+                    logger=None):
+    """ Runs SIESTA at the lattice constant of settings.calc for increasing cutoffs; every run starts from
+    the density matrix of the previous one
+
+    Arguments:
+        settings {module} -- settings of the calculation
+        pseudo_file {string} -- pseudopotential (psf) file
+        fdf_file {string} -- SIESTA fdf template
+        work_dir {string} -- the runs are made in {work_dir}/{cutoff}
+
+    Keyword Arguments:
+        cutoffs {list} -- mesh cutoffs to try, Ry (default: {DEFAULT_CUTOFFS})
+        tolerance {float} -- energy tolerance, eV/atom (default: {1e-3})
+        logger {Logger} -- logger (default: {None})
+
+    Returns:
+        float -- the lowest cutoff whose energy differs from the one at the next cutoff by less than tolerance,
+                 the highest cutoff if the energy is not converged, None if all runs failed
+    """
+    nat = settings.calc["nat"]
+    alat = settings.calc["alat"]
+    previous = None
+    dm_seed = None
+    for cutoff in sorted(cutoffs):
+        siesta_calc = SiestaCalculation(settings, pseudo_file, fdf_file=fdf_file,
+                                        work_dir=os.path.join(work_dir, "%g" % (cutoff,)),
+                                        fdf_overrides={"MeshCutoff": "%g Ry" % (cutoff,)})
+        siesta_calc.prepare(alat, dm_seed=dm_seed)
+        if not siesta_calc.is_run:
+            siesta_calc.run(alat)
+        result = siesta_calc.results(alat)
+        if result is None:
+            if logger is not None:
+                logger.error("MeshCutoff convergence: SIESTA run at {:g} Ry failed".format(cutoff))
+            continue
+        energy = result[1] / nat
+        dm_file = os.path.join(siesta_calc._path(alat), siesta_calc.element + ".DM")
+        dm_seed = dm_file if os.path.exists(dm_file) else dm_seed
+        if logger is not None:
+            logger.debug("MeshCutoff convergence: {:g} Ry, energy = {:.6f} eV/atom".format(cutoff, energy))
+        if previous is not None and abs(energy - previous[1]) < tolerance:
+            return previous[0]
+        previous = (cutoff, energy)
+    return previous[0] if previous is not None else None
+
+
+def get_mesh_cutoff(settings, pseudo_file, fdf_file, work_dir, cache=None, logger=None):
+    """ Returns converged MeshCutoff for the pseudopotential, or None if settings.mesh_cutoff_convergence
+    is not set; the cutoff is looked up in this process, then in the pseudopotential cache, and converged
+    if it is found in neither
+    """
+    if not getattr(settings, 'mesh_cutoff_convergence', False):
+        return None
+    cutoffs = getattr(settings, 'mesh_cutoffs', DEFAULT_CUTOFFS)
+    tolerance = getattr(settings, 'mesh_cutoff_tol', 1e-3)
+    key = "mesh_cutoff-" + cutoff_key(settings, pseudo_file, fdf_file, cutoffs, tolerance)
+    if key not in _converged and cache is not None:
+        cached = cache.get_array(key)
+        if cached is not None:
+            _converged[key] = float(cached[0])
+    if key not in _converged:
+        cutoff = converge_cutoff(settings, pseudo_file, fdf_file, work_dir, cutoffs, tolerance, logger)
+        if cutoff is None:
+            return None
+        _converged[key] = cutoff
+        if cache is not None:
+            cache.put_array(key, np.array([cutoff]))
+    if logger is not None:
+        logger.info("MeshCutoff = {:g} Ry".format(_converged[key]))
+    return _converged[key]
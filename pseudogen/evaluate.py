@@ -0,0 +1,245 @@
+"""
+evaluate.py runs the whole chain of calculations for one set of pseudopotential radii:
+pseudopotential generation and test with ATOM, SIESTA calculations and delta factor
+"""
+
+import os
+import time
+import uuid
+from backend import get_backend
+from generate import generate_pseudo, test_pseudo
+from calc_delta import DeltaCalculation, get_volumes, get_alats, update_best_delta
+from fidelity import FULL
+from psf import load_pseudo, describe
+from siesta import read_fdf_file, render_fdf, nearest_neighbour_distance
+from screening import check_errors, check_descriptors, penalty
+from timing import CandidateTiming, get_timing_log
+from log import get_logger, interlog
+
+
+def rejected(settings, logger, reason, excess=1., delta=None, **record):
+    """ Returns the record of the candidate rejected before delta calculation; its delta is the penalty
+    unless the estimated one is given
+    """
+    logger.info("Pseudopotential rejected: {}".format(reason))
+    interlog(logger)
+    record.update(delta=penalty(settings, excess) if delta is None else delta,
+                  rel_delta=None,
+                  rejected=reason,
+                  volumes=[],
+                  energies=[])
+    return record
+
+
+class Candidate(object):
+
+    def __init__(self, settings, radii, work_dir=None, fidelity=FULL):
+        """ One set of pseudopotential radii passing through the stages of evaluation: ATOM generation
+        and test (generate), descriptors of the pseudopotential file (prescreen), SIESTA calculations
+        (run_siesta) and EOS fit (fit). The stages of different
+        candidates may run in different threads at the same time; their timing is written to timing.jsonl
+        next to log.dat (see timing.py)
+
+        Arguments:
+            settings {module} -- settings of the calculation
+            radii {list} -- pseudopotential radii (r_s, r_p, r_d, r_f, r_ps)
+
+        Keyword Arguments:
+            work_dir {string} -- the calculation is made in {work_dir}/{element}/{uuid} (default: {None},
+                                 the current directory)
+            fidelity {string} -- fidelity of SIESTA calculations, fidelity.FULL or fidelity.COARSE
+                                 (default: {FULL})
+        """
+        self.settings = settings
+        self.fidelity = fidelity
+        self.element = settings.calc["element"]
+        self.uuid = uuid.uuid4().hex[:8]
+        self.work_dir = os.path.abspath(work_dir or ".")
+        self.radii = [float(r) for r in radii]
+        self.started = time.time()
+        # record of the evaluation, set when the candidate is rejected or fitted
+        self.record = None
+        self.logger = get_logger('find_pseudo', self.element, self.work_dir)
+        self.delta_calc = DeltaCalculation(settings, self.uuid, self.logger, work_dir=self.work_dir)
+        self.err_pseudo = self.err_mean = self.err_max = None
+        self.descriptors = {}
+        self.timing = CandidateTiming(get_timing_log(settings, self.work_dir), self.uuid, self.radii, fidelity)
+
+    @property
+    def done(self):
+        return self.record is not None
+
+    def generate(self, cache=None):
+        """ Generates and tests the pseudopotential, returns False if it is rejected by ATOM errors
+        """
+        settings = self.settings
+        backend = get_backend(settings)
+        priority = getattr(settings, 'priority', 0)
+        calc_dir = self.delta_calc.calc_dir
+        if self.fidelity == FULL:
+            self.logger.info("Pseudo radii: {}".format(self.radii))
+        else:
+            self.logger.info("Pseudo radii: {} ({} fidelity)".format(self.radii, self.fidelity))
+        with self.timing.stage("generate"):
+            pseudo_file, err_pseudo = generate_pseudo(settings.calc, settings.electrons, self.radii, cache=cache,
+                                                      backend=backend, work_dir=calc_dir, priority=priority)
+        self.err_pseudo = float(err_pseudo)
+        # ground state error is checked before running the transferability test
+        reason, excess = check_errors(settings, err_pseudo=err_pseudo)
+        if reason is not None:
+            self.record = rejected(settings, self.logger, reason, excess,
+                                   uuid=self.uuid,
+                                   radii=self.radii,
+                                   err_pseudo=self.err_pseudo)
+            return False
+        with self.timing.stage("test"):
+            err_mean, err_max = test_pseudo(settings.calc, settings.configs,
+                                            cache=cache, backend=backend, work_dir=calc_dir, priority=priority,
+                                            reuse_ae=getattr(settings, 'reuse_ae_reference', False))
+        self.err_mean, self.err_max = float(err_mean), float(err_max)
+        message = """
+        Pseudo error (ground state) = {err_pseudo:.4} Ry
+                                        max      mean
+        Pseudo error (test configs) =    {err_max:6.4}  {err_mean:6.4} Ry"""
+        self.logger.info(message.format(err_pseudo=err_pseudo, err_max=err_max, err_mean=err_mean))
+        reason, excess = check_errors(settings, err_pseudo=err_pseudo, err_mean=err_mean, err_max=err_max)
+        if reason is not None:
+            self.record = rejected(settings, self.logger, reason, excess,
+                                   uuid=self.uuid,
+                                   radii=self.radii,
+                                   err_pseudo=self.err_pseudo,
+                                   err_mean=self.err_mean,
+                                   err_max=self.err_max)
+            return False
+        self.delta_calc.add_pseudo(pseudo_file)
+        return True
+
+    def prescreen(self, fdf_file):
+        """ Computes descriptors of the generated pseudopotential file if settings.psf_descriptors is set,
+        returns False if the pseudopotential is rejected by them
+        """
+        settings = self.settings
+        if not getattr(settings, 'psf_descriptors', False):
+            return True
+        calc = settings.calc
+        # pseudization spheres overlap most at the smallest volume
+        alat = min(get_alats(get_volumes(settings.volumes, calc), calc))
+        fdf_text = render_fdf(read_fdf_file(fdf_file), dict(settings.siesta_calc, alat=alat, vectors=calc["vectors"]))
+        try:
+            nn_distance = nearest_neighbour_distance(fdf_text)
+        except ValueError:
+            nn_distance = None
+        with self.timing.stage("prescreen"):
+            self.descriptors = describe(load_pseudo(self.delta_calc.pseudo_file), nn_distance,
+                                        tol=getattr(settings, 'descriptor_tol', 1e-3))
+        fmt = lambda f, value: f.format(value) if value is not None else "-"
+        self.logger.info("Estimated cutoff = {} Ry, ghost states for l = {}, core overlap = {}".format(
+            fmt("{:.0f}", self.descriptors["est_cutoff"]),
+            self.descriptors["ghosts"] or "none",
+            fmt("{:.3f}", self.descriptors["core_overlap"])))
+        reason, excess = check_descriptors(settings, self.descriptors)
+        if reason is not None:
+            self.record = rejected(settings, self.logger, reason, excess,
+                                   uuid=self.uuid,
+                                   radii=self.radii,
+                                   err_pseudo=self.err_pseudo,
+                                   err_mean=self.err_mean,
+                                   err_max=self.err_max,
+                                   **self.descriptors)
+            return False
+        return True
+
+    def run_siesta(self, fdf_file):
+        """ Runs SIESTA calculations for the volume points, the candidate is rejected if the runs are aborted
+        because SCF diverges or the candidate cannot beat the best one
+        """
+        delta_calc = self.delta_calc
+        with self.timing.stage("siesta"):
+            delta_calc.run_calcs(fdf_file, self.fidelity)
+        self._check_aborted()
+
+    def _check_aborted(self):
+        """ Rejects the candidate if its delta calculation is aborted, returns True if it is. The pruned
+        candidate gets its estimated delta instead of the penalty, so that the finite difference gradient
+        at its neighbour stays meaningful
+        """
+        delta_calc = self.delta_calc
+        if delta_calc.aborted is None:
+            return False
+        self.record = rejected(self.settings, self.logger, delta_calc.aborted,
+                               delta=delta_calc.estimated_delta,
+                               uuid=self.uuid,
+                               radii=self.radii,
+                               mesh_cutoff=delta_calc.mesh_cutoff,
+                               err_pseudo=self.err_pseudo,
+                               err_mean=self.err_mean,
+                               err_max=self.err_max,
+                               **self.descriptors)
+        return True
+
+    def fit(self):
+        """ Fits EOS and calculates delta factor, unless the candidate is rejected by its SIESTA runs;
+        the candidate is rejected if the EOS has no minimum
+        """
+        if self.done:
+            return
+        delta_calc = self.delta_calc
+        with self.timing.stage("fit"):
+            delta_calc.get_delta()
+        if self._check_aborted():
+            return
+        interlog(self.logger)
+        self.record = {"uuid": self.uuid,
+                       "radii": self.radii,
+                       "delta": float(delta_calc.delta),
+                       "rel_delta": float(delta_calc.rel_delta),
+                       "v0": float(delta_calc.v0),
+                       "b0": float(delta_calc.b0),
+                       "b1": float(delta_calc.b1),
+                       "mesh_cutoff": delta_calc.mesh_cutoff,
+                       "err_pseudo": self.err_pseudo,
+                       "err_mean": self.err_mean,
+                       "err_max": self.err_max,
+                       "volumes": [float(v) for v in delta_calc.volumes],
+                       "energies": [float(e) for e in delta_calc.energies]}
+        self.record.update(self.descriptors)
+
+    def finish(self, results=None):
+        """ Adds timing and path to the record and stores it in results database, returns the record
+        """
+        self.record.update(fidelity=self.fidelity,
+                           started=self.started,
+                           wall_time=time.time() - self.started,
+                           path=self.delta_calc.calc_dir)
+        self.logger.info(self.timing.report(self.timing.finish(self.record)))
+        if self.fidelity == FULL and not self.record.get("rejected"):
+            update_best_delta(self.element, self.record["delta"])
+        if results is not None:
+            results.add(self.element, self.record)
+        return self.record
+
+
+def evaluate(settings, radii, fdf_file, cache=None, results=None, work_dir=None, fidelity=FULL):
+    """ Generates and tests the pseudopotential with given radii, then calculates delta factor for it
+
+    Arguments:
+        settings {module} -- settings of the calculation
+        radii {list} -- pseudopotential radii (r_s, r_p, r_d, r_f, r_ps)
+        fdf_file {string} -- absolute path to SIESTA fdf template
+
+    Keyword Arguments:
+        cache {PseudoCache} -- cache of generated pseudopotentials (default: {None})
+        results {ResultsStore} -- database the evaluation is recorded to (default: {None})
+        work_dir {string} -- the calculation is made in {work_dir}/{element}/{uuid} (default: {None},
+                             the current directory); the working directory of the process is not changed,
+                             so several candidates can be evaluated at once in threads
+        fidelity {string} -- fidelity of SIESTA calculations, fidelity.FULL or fidelity.COARSE (default: {FULL})
+
+    Returns:
+        dict -- results of the evaluation
+    """
+    candidate = Candidate(settings, radii, work_dir, fidelity)
+    if candidate.generate(cache) and candidate.prescreen(fdf_file):
+        candidate.run_siesta(fdf_file)
+        candidate.fit()
+    return candidate.finish(results)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+"""
+fake_siesta.py is a stand-in for SIESTA executable used to test and benchmark the orchestration
+of calculations. It reads fdf file from standard input and writes SIESTA-like output with the energy
+given by Birch-Murnaghan EOS. EOS parameters (per atom) and run time are taken from environment:
+
+ * FAKE_SIESTA_V0 -- equilibrium volume, A^3 (default 12.)
+ * FAKE_SIESTA_B0 -- bulk modulus, GPa (default 100.)
+ * FAKE_SIESTA_BP -- bulk modulus derivative (default 4.5)
+ * FAKE_SIESTA_SCF -- number of SCF steps (default 10)
+ * FAKE_SIESTA_TIME -- time of one SCF step, s (default 0.)
+ * FAKE_SIESTA_ECUT -- decay constant of the energy error with MeshCutoff, Ry (default 30.); the error per atom
+   is exp(-MeshCutoff / FAKE_SIESTA_ECUT) eV
+ * FAKE_SIESTA_DIVERGE -- fraction of pseudopotentials for which SCF diverges (default 0.): dDmax grows
+   after the 5th step, and the run ends without the final energy
+
+Equilibrium volume is shifted by up to 2% depending on the contents of the pseudopotential file,
+so that different pseudopotentials give different delta factors.
+"""
+
+import os
+import sys
+import time
+import hashlib
+import numpy as np
+
+
+def read_fdf(text):
+    """ Returns label, number of atoms, cell volume and mesh cutoff (Ry) from fdf text
+    """
+    lines = [l.split("#")[0].strip() for l in text.splitlines()]
+    values = dict((l.split()[0].lower(), l.split()[1:]) for l in lines if l and not l.startswith("%"))
+    label = values.get("systemlabel", ["siesta"])[0]
+    nat = int(values.get("numberofatoms", [1])[0])
+    alat = float(values.get("latticeconstant", [1.])[0])
+    mesh_cutoff = float(values.get("meshcutoff", [100.])[0])
+    start = lines.index("%block LatticeVectors")
+    vectors = np.array([[float(x) for x in l.split()] for l in lines[start+1:start+4]])
+    return label, nat, np.linalg.det(vectors) * alat ** 3, mesh_cutoff
+
+
+def energy(volume, v0, b0, bp):
+    """ Birch-Murnaghan energy (eV) for volume (A^3), b0 in eV/A^3
+    """
+    eta = (v0 / volume) ** (2./3.)
+    return 9. * v0 * b0 / 16. * ((eta - 1.) ** 3 * bp + (eta - 1.) ** 2 * (6. - 4. * eta))
+
+
+def main():
+    label, nat, volume, mesh_cutoff = read_fdf(sys.stdin.read())
+    v0 = float(os.environ.get("FAKE_SIESTA_V0", 12.))
+    b0 = float(os.environ.get("FAKE_SIESTA_B0", 100.)) / 160.21766
+    bp = float(os.environ.get("FAKE_SIESTA_BP", 4.5))
+    n_scf = int(os.environ.get("FAKE_SIESTA_SCF", 10))
+    t_scf = float(os.environ.get("FAKE_SIESTA_TIME", 0.))
+    e_cut = float(os.environ.get("FAKE_SIESTA_ECUT", 30.))
+    diverge = float(os.environ.get("FAKE_SIESTA_DIVERGE", 0.))
+    diverges = False
+    psf_file = label + ".psf"
+    if os.path.exists(psf_file):
+        with open(psf_file, "rb") as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        h = int(digest[:8], 16)
+        v0 *= 1. + 0.02 * (2. * h / 0xffffffff - 1.)
+        diverges = float(int(digest[8:16], 16)) / 0xffffffff < diverge
+    e_total = nat * (energy(volume / nat, v0, b0, bp) - 100. + np.exp(-mesh_cutoff / e_cut))
+    t0 = time.time()
+    print "outcell: Cell volume (Ang**3)        : {:12.4f}".format(volume)
+    print "siesta: iscf   Eharris(eV)      E_KS(eV)   FreeEng(eV)   dDmax  Ef(eV)"
+    for i in range(n_scf):
+        time.sleep(t_scf)
+        ddmax = 10. ** (-i * 4. / n_scf) if not diverges or i < 5 else 3. ** (i - 4)
+        e = e_total + ddmax * 1e-2
+        print "   scf: {:4d} {:14.6f} {:14.6f} {:14.6f} {:9.6f} {:8.4f}".format(i + 1, e, e, e, ddmax, -4.)
+        sys.stdout.flush()
+    if diverges:
+        print "\nSCF_NOT_CONV: SCF did not converge in maximum number of steps."
+        sys.exit(1)
+    print "\nSCF Convergence by dMax criterion"
+    print "siesta: Final energy (eV):"
+    print "siesta:         Total = {:16.6f}".format(e_total)
+    print "\ntimer: Elapsed wall time (sec) = {:10.3f}".format(time.time() - t0)
+    print ">> End of run:  {}".format(time.strftime("%d-%b-%Y  %H:%M:%S").upper())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+fidelity.py contains multi-fidelity evaluation of candidates: a batch of candidates is first calculated
+with coarse SIESTA settings (smaller k-grid, lower mesh cutoff, fewer volumes), and only the best
+of them are calculated again with the settings of the fdf template
+"""
+
+import math
+import numpy as np
+
+COARSE = "coarse"
+FULL = "full"
+
+
+def fidelity_options(settings, fidelity=FULL):
+    """ Returns fdf overrides and the number of volume points of the fidelity
+
+    Returns:
+        tuple -- (dict of fdf overrides or None, number of volumes or None for the settings default)
+    """
+    if fidelity == FULL:
+        return None, None
+    if fidelity != COARSE:
+        raise ValueError("Unknown fidelity {}".format(fidelity))
+    screening = getattr(settings, 'screening', None) or {}
+    return screening.get("fdf", {}), screening.get("volumes", None)
+
+
+class Screening(object):
+
+    def __init__(self, promote=0.25, min_promoted=1):
+        """ Promotion of coarse-scored candidates to full fidelity
+
+        Keyword Arguments:
+            promote {float} -- fraction of the (not rejected) candidates of a batch promoted to full fidelity
+                               (default: {0.25})
+            min_promoted {int} -- minimum number of promoted candidates per batch (default: {1})
+        """
+        self.promote = promote
+        self.min_promoted = min_promoted
+        # differences of full and coarse delta of the promoted candidates
+        self._shifts = []
+
+    @property
+    def shift(self):
+        return float(np.mean(self._shifts)) if self._shifts else 0.
+
+    def promoted(self, records):
+        """ Returns indices of the coarse records promoted to full fidelity
+        """
+        valid = [i for i, record in enumerate(records) if not record.get("rejected")]
+        n = min(len(valid), max(self.min_promoted, int(math.ceil(self.promote * len(valid)))))
+        return sorted(valid, key=lambda i: records[i]["delta"])[:n]
+
+    def run(self, evaluate_many, radii_list):
+        """ Evaluates candidates in two stages
+
+        Arguments:
+            evaluate_many {function} -- evaluate_many(radii_list, fidelity) returns the list of records
+            radii_list {list} -- radii of the candidates
+
+        Returns:
+            tuple -- list of records (full fidelity record of the promoted candidates, coarse record
+                     of the others) and list of delta values; delta of the candidate that was not promoted
+                     is its coarse delta shifted by the mean full - coarse difference, but not below
+                     the worst promoted candidate of the batch, so that the coarse ranking is kept
+        """
+        coarse = evaluate_many(radii_list, COARSE)
+        promoted = self.promoted(coarse)
+        full = evaluate_many([radii_list[i] for i in promoted], FULL) if promoted else []
+        records = list(coarse)
+        for i, record in zip(promoted, full):
+            records[i] = record
+            if not record.get("rejected"):
+                self._shifts.append(record["delta"] - coarse[i]["delta"])
+        worst = max([records[i]["delta"] for i in promoted if not records[i].get("rejected")] or [-np.inf])
+        values = []
+        for i, record in enumerate(records):
+            if i in promoted or record.get("rejected"):
+                values.append(record["delta"])
+            else:
+                values.append(max(record["delta"] + self.shift, worst))
+        return records, values
+
+
+def get_screening(settings):
+    """ Returns Screening given by settings.screening, or None if candidates are evaluated at full fidelity only
+    """
+    screening = getattr(settings, 'screening', None)
+    if not screening:
+        return None
+    return Screening(promote=screening.get("promote", 0.25),
+                     min_promoted=screening.get("min_promoted", 1))
@@ -1,37 +1,34 @@
 #!/usr/bin/env python
 
 import os
-from log import get_logger, interlog
-import uuid
-import numpy as np
-from generate import generate_pseudo, test_pseudo
-from calc_delta import DeltaCalculation
+import time
+from cache import get_pseudo_cache
+from evaluate import evaluate
+from fidelity import get_screening
+from pipeline import Pipeline, pipeline_options
+from results import get_results_store
+from timing import log_run_summary
+from log import get_logger
 
 
-def find_pseudo(settings):
-    cwd = os.getcwd()
-    element = settings.calc["element"]
-    fdf_file = os.path.join(cwd, "siesta.fdf")
-    # get uuid
-    calc_uuid = uuid.uuid4().hex[:8]
-    # make directories for the calculation
-    dirname = os.path.join(element, calc_uuid)
-    if not os.path.exists(dirname):
-        os.makedirs(dirname)
-    # logging
-    logger = get_logger('find_pseudo', element)
-    delta_calc = DeltaCalculation(settings, calc_uuid, logger)
-
-    logger.info("Pseudo radii: {}".format(settings.radii))
-    pseudo_file, err_pseudo = generate_pseudo(settings.calc, settings.electrons, settings.radii)
-    err_mean, err_max = test_pseudo(settings.calc, settings.configs)
-    message = """
-    Pseudo error (ground state) = {err_pseudo:.4} Ry
-                                    max      mean
-    Pseudo error (test configs) =    {err_max:6.4}  {err_mean:6.4} Ry"""
-    logger.info(message.format(err_pseudo=err_pseudo, err_max=err_max, err_mean=err_mean))
-    delta_calc.add_pseudo(pseudo_file)
-    delta_calc.run_calcs(fdf_file)
-    os.chdir(cwd)
-    delta_calc.get_delta()
-    interlog(logger)
+def find_pseudo(settings, work_dir=None):
+    """ Evaluates pseudopotential with settings.radii; if settings.radii is a list of radii sets,
+    they are evaluated in a pipeline and the list of results is returned (if settings.screening is set,
+    the results of the candidates not promoted to full fidelity are the coarse ones)
+    """
+    started = time.time()
+    cwd = os.path.abspath(work_dir or os.getcwd())
+    fdf_file = os.path.join(cwd, getattr(settings, 'fdf_file', "siesta.fdf"))
+    cache = get_pseudo_cache(settings, cwd)
+    results = get_results_store(settings, cwd, fdf_file)
+    if not isinstance(settings.radii[0], (list, tuple)):
+        return evaluate(settings, settings.radii, fdf_file, cache=cache, results=results, work_dir=cwd)
+    try:
+        with Pipeline(settings, fdf_file, cache=cache, results=results, work_dir=cwd,
+                      **pipeline_options(settings)) as pipeline:
+            screening = get_screening(settings)
+            if screening is None:
+                return pipeline.map(settings.radii)
+            return screening.run(pipeline.map, settings.radii)[0]
+    finally:
+        log_run_summary(settings, cwd, started, get_logger('find_pseudo', settings.calc["element"], cwd))
@@ -7,9 +7,11 @@ generate.py contains classes and functions needed to generate and test pseudopot
 
 import os
 import shutil
-import subprocess
+import hashlib
 import numpy as np
 from scipy.optimize import minimize
+from cache import program_identity
+from backend import Job, LocalBackend
 
 orbitals = [(1, 0),(2, 0),(2, 1),
             (3, 0),(3, 1),(4, 0),
@@ -22,6 +24,18 @@ orbitals = [(1, 0),(2, 0),(2, 1),
 ATOM_PROGRAM = os.environ.get('ATOM_PROGRAM', '/home/andrey/bin/atm')
 ATOM_UTILS_DIR = os.environ.get('ATOM_UTILS_DIR', '/home/andrey/bin/ppt')
 
+# backend running ATOM scripts unless another one is given to InputFile
+_atom_backend = LocalBackend()
+
+# all-electron excitation energies of test configurations, keyed by the hash of AE input
+_ae_references = {}
+
+def _atom_env():
+    # environment of ATOM scripts; the environment of the process itself is left untouched
+    env = os.environ.copy()
+    env.update(ATOM_PROGRAM=ATOM_PROGRAM, ATOM_UTILS_DIR=ATOM_UTILS_DIR)
+    return env
+
 class InputFile(object):
 
     _execute_script = None
@@ -35,6 +49,15 @@ class InputFile(object):
         self._calc_dir = ".".join((self.element, self.xc, self.calc_type))
         self._file_name = ".".join((self._calc_dir, "inp"))
         self._electrons = []
+        self._lines_added = False
+        self._backend = kwds.get("backend", None) or _atom_backend
+        self._timeout = kwds.get("timeout", None)
+        self._priority = kwds.get("priority", 0)
+        # directory the input file and the calculation directory are made in, ATOM scripts are run there
+        self.work_dir = os.path.abspath(kwds.get("work_dir", None) or ".")
+
+    def _path(self, file_name):
+        return os.path.join(self.work_dir, file_name)
 
     def set_calc_dir(self, cdir):
         self._calc_dir = os.path.join(cdir, self._calc_dir)
@@ -75,26 +98,36 @@ class InputFile(object):
         return True
 
     def add_lines(self):
+        if self._lines_added:
+            return True
         if not (self._add_electron_lines() and self._add_radii_lines()):
             return False
+        self._lines_added = True
         return True
 
     def _pre_execute(self):
         if not self.add_lines():
             return False
 
-        if os.path.exists(self._calc_dir):
-            shutil.rmtree(self._calc_dir)
+        if os.path.exists(self._path(self._calc_dir)):
+            shutil.rmtree(self._path(self._calc_dir))
             print self.__class__.__name__ + ".execute: removed old calculation directory"
 
-        os.environ['ATOM_PROGRAM'] = ATOM_PROGRAM
-        os.environ['ATOM_UTILS_DIR'] = ATOM_UTILS_DIR
-        with open(self._file_name, "w") as f:
+        with open(self._path(self._file_name), "w") as f:
             f.write(str(self))
 
+    def _run(self, *args):
+        self._backend.run(Job([self._execute_script] + list(args),
+                              cwd=self.work_dir,
+                              env=_atom_env(),
+                              timeout=self._timeout,
+                              name="atom",
+                              priority=self._priority,
+                              group=self.element))
+
     def execute(self):
         self._pre_execute()
-        subprocess.check_call([self._execute_script, self._file_name], env=os.environ)
+        self._run(self._file_name)
         return self._post_execute()
 
     def _post_execute(self):
@@ -148,6 +181,10 @@ class PGInputFile(InputFile):
     def siesta_pp_file(self):
         return ".".join((self.element, self.xc, self.calc_type, "psf"))
 
+    @property
+    def pp_file(self):
+        return ".".join((self.element, self.xc, self.calc_type, "vps"))
+
     def _add_electron_lines(self):
         # adding electrons
         n_val = len(self._electrons)
@@ -198,7 +235,7 @@ class PGInputFile(InputFile):
         return True
 
     def _post_execute(self):
-        with open(os.path.join(self._calc_dir, 'OUT'), 'r') as f:
+        with open(os.path.join(self.work_dir, self._calc_dir, 'OUT'), 'r') as f:
             out_lines = [l for l in f.readlines() if '&v' in l]
         ae_flag = True
         ae = []
@@ -233,6 +270,38 @@ class PGInputFile(InputFile):
                                       n_core = self.n_core,
                                       n_val = self.n_val)
 
+def read_excitations(file_name, nconfs):
+    """ Reads tables of total energy differences between the test configurations from ATOM output,
+    one table per series of configurations (all-electron and pseudopotential ones)
+
+    Arguments:
+        file_name {string} -- ATOM output file (OUT)
+        nconfs {int} -- number of configurations in a series
+
+    Returns:
+        list -- symmetric (nconfs, nconfs) arrays of energy differences, Ry, in the order of the series
+    """
+    with open(file_name, 'r') as f:
+        out_lines = [l for l in f.readlines() if '&d' in l and '&v' not in l]
+    series = []
+    for line in out_lines:
+        if 'total' in line:
+            series.append(np.zeros((nconfs, nconfs)))
+            continue
+        data = line.split()[1:]
+        if not series or not data or not data[0].isdigit():
+            continue
+        idx = int(data[0]) - 1
+        values = data[1:]
+        # row i of the lower triangle has i values; the column header of the table is skipped by this check
+        if idx >= nconfs or len(values) != idx + 1:
+            continue
+        for ix, x in enumerate([float(x) for x in values]):
+            series[-1][ix, idx] = x
+            series[-1][idx, ix] = x
+    return series
+
+
 class PTInputFile(InputFile):
 
     _execute_script = os.path.join(ATOM_UTILS_DIR, "pt.sh")
@@ -243,9 +312,14 @@ class PTInputFile(InputFile):
         super(PTInputFile, self).__init__(element, n_core, n_val, **kwds)
         pp_calc_type = "pe" if kwds.get("core", False) else "pg"
         self._pp_file_name = ".".join((self.element, self.xc, pp_calc_type, "vps"))
-        assert os.path.exists(self._pp_file_name)
+        assert os.path.exists(self._path(self._pp_file_name))
         self._calc_dir = self._calc_dir + "-" + ".".join((self.element, self.xc, pp_calc_type))
         self._configurations = []
+        self._cache = kwds.get("cache", None)
+        # all-electron excitation energies are taken from the previous runs only if reuse_ae is set
+        self._reuse_ae = kwds.get("reuse_ae", False)
+        self._ae_key = None
+        self._ae_xx = None
 
     def add_configuration(self, electrons):
         conf = AEInputFile(self.element, 
@@ -257,48 +331,59 @@ class PTInputFile(InputFile):
             conf.add_electrons(el)
         self._configurations.append(conf)
 
+    def _ae_reference(self):
+        """ Returns all-electron excitation energies for the test configurations if they were 
+        calculated before (in this process or, if cache is set, in the cache directory)
+        """
+        h = hashlib.sha1()
+        for conf in self._configurations:
+            conf.add_lines()
+            h.update(str(conf).encode("utf-8"))
+        h.update(program_identity(ATOM_PROGRAM).encode("utf-8"))
+        self._ae_key = h.hexdigest()
+        if self._ae_key not in _ae_references and self._cache is not None:
+            xx = self._cache.get_array(self._ae_key)
+            if xx is not None:
+                _ae_references[self._ae_key] = xx
+        return _ae_references.get(self._ae_key)
+
     def _pre_execute(self):
-        if os.path.exists(self._calc_dir):
-            shutil.rmtree(self._calc_dir)
+        if os.path.exists(self._path(self._calc_dir)):
+            shutil.rmtree(self._path(self._calc_dir))
             print self.__class__.__name__ + ".execute: removed old calculation directory"
 
-        os.environ['ATOM_PROGRAM'] = ATOM_PROGRAM
-        os.environ['ATOM_UTILS_DIR'] = ATOM_UTILS_DIR
-        with open(self._file_name, "w") as f:
+        # all-electron part of the test does not depend on the pseudopotential
+        self._ae_xx = self._ae_reference() if self._reuse_ae else None
+        with open(self._path(self._file_name), "w") as f:
+            if self._ae_xx is None:
+                for conf in self._configurations:
+                    f.write(str(conf))
             for conf in self._configurations:
-                conf.add_lines()
-                f.write(str(conf))
                 conf.calc_type = self.calc_type
-            for conf in self._configurations:
                 f.write(str(conf))
 
     def execute(self):
         self._pre_execute()
-        subprocess.check_call([self._execute_script, self._file_name, self._pp_file_name], 
-                              env=os.environ)
+        self._run(self._file_name, self._pp_file_name)
         return self._post_execute()
 
     def _post_execute(self):
-        with open(os.path.join(self._calc_dir, 'OUT'), 'r') as f:
-            out_lines = [l for l in f.readlines() if '&d' in l and '&v' not in l]
         # cross-excitations
         nconfs = len(self._configurations)
+        series = read_excitations(os.path.join(self.work_dir, self._calc_dir, 'OUT'), nconfs)
+        # only the pseudopotential series is in the output if AE reference was taken from cache
+        n_series = 2 if self._ae_xx is None else 1
+        if len(series) != n_series:
+            raise ValueError("{} series of excitation energies in ATOM output, expected {}".format(len(series),
+                                                                                               n_series))
         self.xx = np.zeros((2, nconfs, nconfs))
-        ps_flag = 0
-        head_flag = False
-        for line in out_lines[1:]:
-            if 'total' in line:
-                ps_flag = 1
-                head_flag = True
-                continue
-            if head_flag:
-                head_flag = False
-                continue
-            data = line.split()[1:]
-            idx = int(data[0]) - 1
-            for ix, x in enumerate([float(x) for x in data[1:]]):
-                self.xx[ps_flag, ix, idx] = x
-                self.xx[ps_flag, idx, ix] = x
+        self.xx[2 - n_series:] = series
+        if self._ae_xx is not None:
+            self.xx[0] = self._ae_xx
+        elif self._reuse_ae:
+            _ae_references[self._ae_key] = self.xx[0].copy()
+            if self._cache is not None:
+                self._cache.put_array(self._ae_key, self.xx[0])
 
         err = self.xx[0] - self.xx[1]
         err_mean = np.sum(np.abs(err)) / (nconfs * (nconfs-1))
@@ -310,16 +395,31 @@ class PTInputFile(InputFile):
         return err_mean, err_max
 
 
-def generate_pseudo(calc, electrons, radii):
-    ps = PGInputFile(**calc)
+def generate_pseudo(calc, electrons, radii, cache=None, backend=None, work_dir=None, priority=0):
+    """ Generates pseudopotential in work_dir (default: current directory),
+    returns absolute path to its psf file and pseudopotential error
+    """
+    ps = PGInputFile(backend=backend, work_dir=work_dir, priority=priority, **calc)
     for e in electrons:
         ps.add_electrons(e)
     ps.add_radii(*radii)
-    file_name = ps.siesta_pp_file
-    return file_name, ps.execute()
-
-def test_pseudo(calc, configs):
-    pt = PTInputFile(**calc)
+    file_name = os.path.join(ps.work_dir, ps.siesta_pp_file)
+    if cache is None or not ps.add_lines():
+        return file_name, ps.execute()
+    files = (ps.siesta_pp_file, ps.pp_file)
+    key = cache.key(str(ps), ATOM_PROGRAM)
+    err = cache.get(key, files, dest_dir=ps.work_dir)
+    if err is None:
+        err = ps.execute()
+        cache.put(key, files, err, src_dir=ps.work_dir)
+    return file_name, err
+
+def test_pseudo(calc, configs, cache=None, backend=None, work_dir=None, priority=0, reuse_ae=False):
+    """ Tests transferability of the pseudopotential generated in work_dir (default: current directory);
+    if reuse_ae is set, all-electron excitation energies calculated before (in this process or in the cache)
+    are reused instead of running the all-electron part of the test again
+    """
+    pt = PTInputFile(cache=cache, backend=backend, work_dir=work_dir, priority=priority, reuse_ae=reuse_ae, **calc)
     for c in configs:
         pt.add_configuration(c)
     return pt.execute()    
@@ -11,50 +11,37 @@ import os
 import sys
 import numpy as np
 import matplotlib.pyplot as plt
-from calc_delta import BM, read_ref_data, calcDelta
+from calc_delta import BM, calcDelta
+from reference import get_reference
+from siesta import read_output
 
 
-def read_energy(element, alat):
+def read_energy(element, alat, data_dir="."):
     out_file = element + '.out'
     # get files in path
-    path = "%.4f" % (alat,)
+    path = os.path.join(data_dir, "%.4f" % (alat,))
     files = os.listdir(path)
     # check if the calc succeeded 
     if out_file in files:
-        with open(os.path.join(path, out_file), "r") as f:
-            lines = f.readlines()
-        final = False
-        for line in lines:
-            if "Cell volume" in line:
-                vol = float(line.split()[-1])
-            if "Final energy" in line:
-                final = True
-            if final and "Total" in line:
-                energy = float(line.split()[3])
-                final = False
-                return np.array((vol, energy))
+        return read_output(os.path.join(path, out_file)).final()
     return None
 
 
 def get_energies(settings, data_dir):
     x = []
     y = []
-    wd = os.getcwd()
     element = settings.calc["element"]
-    # os.chdir(os.path.join(data_dir, "check"))
-    os.chdir(data_dir)
-    for _, dirs, _ in os.walk(os.getcwd()):
+    for _, dirs, _ in os.walk(data_dir):
         for dir_i in dirs:
             try:
                 alat = float(dir_i)
             except:
                 continue
-            energies = read_energy(element, alat)
+            energies = read_energy(element, alat, data_dir)
             if energies is not None:
                 x_i, y_i = energies
                 x.append(x_i)
                 y.append(y_i)
-    os.chdir(wd)
     x = (np.array(x) ** 3) / settings.nat
     y = np.array(y)
     p = np.polyfit(x, y, 2)
@@ -62,9 +49,11 @@ def get_energies(settings, data_dir):
     x_p = np.linspace(0.94*x_min, 1.06*x_min, 7)
     y_p = np.polyval(p, x_p)
 #    vol, bulk_mod, bulk_deriv, res = BM(np.vstack((x_p, y_p)).T)
-    vol, bulk_mod, bulk_deriv, _ = BM(np.vstack((x, y)).T)
-    ref_data = read_ref_data("delta/WIEN2k.txt")
-    ref_data_el = ref_data[ref_data['element'] == element]
+    try:
+        vol, bulk_mod, bulk_deriv, _ = BM(np.vstack((x, y)).T)
+    except ValueError:
+        raise ValueError("get_energies: EOS of the energies in {} has no minimum".format(data_dir))
+    ref_data_el = get_reference(settings).get(element)
     our_data = np.core.records.fromrecords([(element, vol, bulk_mod, bulk_deriv), ], names=('element', 'V0', 'B0', 'BP'))
 
     print calcDelta(our_data, ref_data_el, useasymm=False)
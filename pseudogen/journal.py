@@ -0,0 +1,114 @@
+"""
+journal.py keeps a durable record of finished evaluations so that an interrupted
+minimization can be restarted without recalculating the points already done
+"""
+
+import os
+import json
+import hashlib
+from fidelity import FULL
+from screening import ERROR_THRESHOLDS, DESCRIPTOR_THRESHOLDS
+
+# optional settings which change the records: SIESTA parameters, rejection of candidates and its penalty,
+# volume points of EOS, mesh cutoff, coarse screening, aborting of SIESTA runs and the reference data
+CONTEXT_SETTINGS = (("siesta_calc",) +
+                    tuple(attr for _, attr in ERROR_THRESHOLDS + DESCRIPTOR_THRESHOLDS) +
+                    ("penalty", "psf_descriptors", "descriptor_tol", "reject_ghosts",
+                     "adaptive_eos", "eos_initial_points", "eos_points_per_step", "eos_max_points",
+                     "eos_residual_tol", "eos_v0_tol", "eos_b0_tol", "eos_b1_tol",
+                     "mesh_cutoff_convergence", "mesh_cutoffs", "mesh_cutoff_tol",
+                     "screening",
+                     "scf_monitor", "scf_divergence_factor", "scf_divergence_steps", "scf_stagnation_steps",
+                     "prune_factor", "prune_min_points",
+                     "reference_file", "reference_files", "reference_code"))
+
+
+def settings_hash(settings, fdf_file):
+    """ Hash of the settings the evaluation results depend on (besides the radii)
+    """
+    with open(fdf_file, "r") as f:
+        fdf_text = f.read()
+    data = json.dumps([settings.calc,
+                       settings.electrons,
+                       settings.configs,
+                       getattr(settings, 'volumes', None),
+                       fdf_text,
+                       dict((name, getattr(settings, name, None)) for name in CONTEXT_SETTINGS)], sort_keys=True)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+class Journal(object):
+
+    def __init__(self, file_name, tol=1e-5, context=None):
+        """ Journal of evaluations stored as JSON lines
+
+        Arguments:
+            file_name {string} -- journal file name
+
+        Keyword Arguments:
+            tol {float} -- radii that differ by less than tol are considered equal (default: {1e-5})
+            context {string} -- hash of the settings, records made with other settings are ignored (default: {None})
+        """
+        self.file_name = file_name
+        self.tol = tol
+        self.context = context
+        self._records = []
+        if os.path.exists(file_name):
+            self._read()
+
+    def _read(self):
+        with open(self.file_name, "r") as f:
+            lines = f.readlines()
+        if lines and not lines[-1].endswith("\n"):
+            # terminate the line cut when the job was killed, so that new records start on a new line
+            with open(self.file_name, "a") as f:
+                f.write("\n")
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("context") == self.context:
+                self._records.append(record)
+
+    def __len__(self):
+        return len(self._records)
+
+    def records(self):
+        return list(self._records)
+
+    def lookup(self, radii, fidelity=FULL):
+        """ Returns the record for radii evaluated at the given fidelity or None if they were not evaluated yet
+        """
+        for record in self._records:
+            if record.get("fidelity", FULL) != fidelity:
+                continue
+            r = record["radii"]
+            if len(r) == len(radii) and all(abs(a - b) <= self.tol for a, b in zip(r, radii)):
+                return record
+        return None
+
+    def add(self, record):
+        record = dict(record, context=self.context)
+        with open(self.file_name, "a") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._records.append(record)
+
+
+def get_journal(settings, fdf_file, work_dir=None):
+    """ Returns Journal configured by settings.journal_file (relative to work_dir, the current directory
+    by default) and settings.journal_tol, or None if journaling is switched off
+    """
+    element = settings.calc["element"]
+    file_name = getattr(settings, 'journal_file', os.path.join(element, "journal.dat"))
+    if file_name is None:
+        return None
+    file_name = os.path.join(os.path.abspath(work_dir or "."), file_name)
+    dirname = os.path.dirname(file_name)
+    if dirname and not os.path.exists(dirname):
+        os.makedirs(dirname)
+    return Journal(file_name,
+                   tol=getattr(settings, 'journal_tol', 1e-5),
+                   context=settings_hash(settings, fdf_file))
@@ -1,31 +1,41 @@
 
+import os
+import hashlib
 import logging
 
 loggers = {}
 
-def get_logger(name, element):
+def get_logger(name, element, work_dir="."):
     global loggers
 
-    if loggers.get(name):
-        return loggers.get(name)
+    # one logger per element and log file, so that several elements and work directories
+    # can be run in one process
+    log_dir = os.path.abspath(os.path.join(work_dir, element))
+    log_file = os.path.join(log_dir, 'log.dat')
+    key = (name, element, log_file)
+    if loggers.get(key):
+        return loggers.get(key)
     else:
-        # create logger
-        logger = logging.getLogger(name)
+        # create logger; logging.getLogger returns the same logger for the same name, so the name
+        # is made unique by the log file
+        logger = logging.getLogger("{}.{}.{}".format(name, element, hashlib.sha1(log_file).hexdigest()[:8]))
         logger.setLevel(logging.DEBUG)
 
         # create console handler and set level to debug
-        fh = logging.FileHandler(element + '/log.dat')
+        if not os.path.exists(log_dir):
+            os.makedirs(log_dir)
+        fh = logging.FileHandler(log_file)
         fh.setLevel(logging.DEBUG)
 
         # create formatter
-        formatter = logging.Formatter('%(asctime)s: %(name)s - %(levelname)s - %(message)s')
+        formatter = logging.Formatter('%(asctime)s: ' + name + '.' + element + ' - %(levelname)s - %(message)s')
 
         # add formatter to fh
         fh.setFormatter(formatter)
 
         # add fh to logger
         logger.addHandler(fh)
-        loggers[name] = logger
+        loggers[key] = logger
     return logger
 
 def interlog(logger):
@@ -1,54 +1,193 @@
 #!/usr/bin/env python
 
 """
-minimize_delta.py minimizes delta-factor by conjugate gradients method
+minimize_delta.py minimizes delta-factor by conjugate gradients method (or another scipy.optimize.minimize method),
+or by CMA-ES evaluating a population of candidates per generation
 """
 
 import os
-import uuid
+import time
 import numpy as np
+from multiprocessing.pool import ThreadPool
 from scipy.optimize import minimize
-from generate import generate_pseudo, test_pseudo
-from calc_delta import DeltaCalculation
-from log import get_logger, interlog
+from cache import get_pseudo_cache
+from evaluate import evaluate
+from calc_delta import update_best_delta
+from journal import get_journal
+from results import get_results_store
+from workqueue import get_work_queue
+from pipeline import get_pipeline
+from population import cmaes
+from surrogate import get_surrogate
+from fidelity import FULL, get_screening
+from timing import log_run_summary
+from log import get_logger
 
-def minimize_delta(settings, x0, const_radii):
-    cwd = os.getcwd()
+# scipy.optimize.minimize methods using the gradient
+GRADIENT_METHODS = ("cg", "bfgs", "newton-cg", "l-bfgs-b", "tnc", "slsqp",
+                    "dogleg", "trust-ncg", "trust-krylov", "trust-exact", "trust-constr")
+
+
+def uses_gradient(method):
+    """ Returns True if scipy.optimize.minimize method uses the gradient (the default methods do)
+    """
+    return method is None or (isinstance(method, basestring) and method.lower() in GRADIENT_METHODS)
+
+
+def minimize_delta(settings, x0, const_radii, work_dir=None):
+    started = time.time()
+    cwd = os.path.abspath(work_dir or os.getcwd())
     print cwd
-    fdf_file = os.path.join(cwd, "siesta.fdf")
+    fdf_file = os.path.join(cwd, getattr(settings, 'fdf_file', "siesta.fdf"))
     element = settings.calc["element"]
+    cache = get_pseudo_cache(settings, cwd)
+    journal = get_journal(settings, fdf_file, cwd)
+    results = get_results_store(settings, cwd, fdf_file)
+    queue = get_work_queue(settings)
+    pipeline = get_pipeline(settings, fdf_file, cache=cache, results=results, work_dir=cwd)
+    population = getattr(settings, 'optimizer', 'minimize') == 'population'
+    # predicted values of the skipped points would be mixed with the computed ones in finite difference
+    # gradients, so the surrogate screens candidates of the population search only
+    surrogate = get_surrogate(settings, journal=journal, results=results) if population else None
+    if journal is not None:
+        # the restarted search prunes candidates against the best one found before
+        for record in journal.records():
+            if record.get("fidelity", FULL) == FULL and not record.get("rejected"):
+                update_best_delta(element, record["delta"])
+    # coarse screening only ranks candidates, so it is used by the population search, which needs the ranking only
+    screening = get_screening(settings) if population else None
+    pool = None
+
+    def evaluate_many(radii_list, fidelity=FULL):
+        """ Returns records of the candidates evaluated at the given fidelity, reusing the journal records
+        """
+        records = [journal.lookup(radii, fidelity) if journal is not None else None for radii in radii_list]
+        todo = [radii for radii, record in zip(radii_list, records) if record is None]
+        run = lambda radii: evaluate(settings, radii, fdf_file, cache=cache, results=results, work_dir=cwd,
+                                     fidelity=fidelity)
+        if queue is not None and todo:
+            # evaluated by workqueue.py workers, possibly on other nodes
+            new_records = queue.map_evaluate(settings, todo, fdf_file, cwd, fidelity=fidelity)
+        elif pipeline is not None:
+            # ATOM stage of the next candidates overlaps SIESTA runs of the previous ones
+            new_records = pipeline.map(todo, fidelity=fidelity)
+        elif pool is not None and len(todo) > 1:
+            new_records = pool.map(run, todo)
+        else:
+            new_records = [run(radii) for radii in todo]
+        if journal is not None:
+            for record in new_records:
+                journal.add(record)
+        if fidelity == FULL:
+            # records of the workers of other processes are known here only
+            for record in new_records:
+                if not record.get("rejected"):
+                    update_best_delta(element, record["delta"])
+        new_records = iter(new_records)
+        return [record if record is not None else next(new_records) for record in records]
+
+    def evaluate_batch(radii_list):
+        """ Returns delta values for the list of radii, evaluating new points concurrently if pool is used
+        """
+        records = [journal.lookup(radii) if journal is not None else None for radii in radii_list]
+        logger = get_logger('find_pseudo', element, cwd)
+        todo = []
+        for radii, record in zip(radii_list, records):
+            if record is not None:
+                logger.info("Pseudo radii: {} (uuid {}) found in journal, delta = {}".format(radii, record["uuid"], record["delta"]))
+            elif radii not in todo:
+                todo.append(radii)
+        predicted = {}
+        if surrogate is not None and todo:
+            # SIESTA time is spent only on candidates which may be better than the best one
+            keep = surrogate.screen(todo)
+            skipped = [radii for radii, k in zip(todo, keep) if not k]
+            if skipped:
+                values, lower = surrogate.predict(skipped)
+                for radii, value, low in zip(skipped, values, lower):
+                    logger.info("Pseudo radii: {} skipped by surrogate model: predicted delta = {:.4}, "
+                                "lower bound = {:.4}, best = {:.4}".format(radii, value, low, surrogate.best))
+                    predicted[tuple(radii)] = float(value)
+                todo = [radii for radii, k in zip(todo, keep) if k]
+        batch = todo
+        if screening is not None and len(todo) > 1:
+            # only the best candidates by coarse SIESTA settings are calculated with the full ones;
+            # candidates found in the journal take part in the promotion again, so that the restarted
+            # search promotes the same candidates
+            known = [radii for radii, record in zip(radii_list, records) if record is not None]
+            batch = todo + [radii for i, radii in enumerate(known) if radii not in known[:i]]
+            new_records, values = screening.run(evaluate_many, batch)
+        else:
+            new_records = evaluate_many(todo)
+            values = [record["delta"] for record in new_records]
+        for radii, record in zip(todo, new_records):
+            if surrogate is not None and record.get("fidelity", FULL) == FULL:
+                surrogate.add(radii, record["delta"], record.get("rejected"))
+        evaluated = dict((tuple(radii), value) for radii, value in zip(batch, values))
+        evaluated.update(predicted)
+        return [record["delta"] if record is not None else evaluated[tuple(radii)]
+                for radii, record in zip(radii_list, records)]
 
     def fun(args, consts):
-        # get uuid
-        calc_uuid = uuid.uuid4().hex[:8]
-        # make directories for the calculation
-        dirname = os.path.join(element, calc_uuid)
-        if not os.path.exists(dirname):
-            os.makedirs(dirname)
-        # logging
-        logger = get_logger('find_pseudo', element)
-        delta_calc = DeltaCalculation(settings, calc_uuid, logger)
-        os.chdir(os.path.join(cwd, dirname))
         # generate radii iterable
         radii = list(args) + list(consts)
-        logger.info("Pseudo radii: {}".format(radii))
-        pseudo_file, err_pseudo = generate_pseudo(settings.calc, settings.electrons, radii)
-        err_mean, err_max = test_pseudo(settings.calc, settings.configs)
-        message = """
-        Pseudo error (ground state) = {err_pseudo:.4} Ry
-                                        max      mean
-        Pseudo error (test configs) =    {err_max:6.4}  {err_mean:6.4} Ry"""
-        logger.info(message.format(err_pseudo=err_pseudo, err_max=err_max, err_mean=err_mean))
-        delta_calc.add_pseudo(pseudo_file)
-        delta_calc.run_calcs(fdf_file)
-        os.chdir(cwd)
-        delta_calc.get_delta()
-        interlog(logger)
-        return delta_calc.delta
+        return evaluate_batch([radii])[0]
 
     eps = getattr(settings, 'eps', 0.1)
+
+    def fun_grad(args, consts):
+        # delta value and its forward difference gradient calculated in one batch
+        x = np.asarray(args, dtype=float)
+        points = [x] + [x + eps * e for e in np.eye(len(x))]
+        values = np.array(evaluate_batch([list(p) + list(consts) for p in points]))
+        return values[0], (values[1:] - values[0]) / eps
+
     method = getattr(settings, 'method', None)
     options = getattr(settings, 'min_options', {})
     options.update({"eps": eps})
     tolerance = getattr(settings, 'tolerance', 1e-3)
-    return minimize(fun, x0, args=const_radii, method=method, tol=tolerance, options=options)
+    popsize = getattr(settings, 'population_size', None) or 4 + int(3 * np.log(len(x0)))
+
+    def progress(generation, xs, fs, best_x, best_f):
+        message = "Generation {}: {} candidates, delta min = {:.4} mean = {:.4}; best delta = {:.4} at {}".format(
+            generation + 1, len(fs), np.min(fs), np.mean(fs), best_f, list(best_x))
+        get_logger('find_pseudo', element, cwd).info(message)
+        print message
+
+    def search():
+        if population:
+            consts = list(const_radii[0]) if const_radii else []
+            return cmaes(lambda xs: evaluate_batch([list(x) + consts for x in xs]), x0,
+                         sigma0=getattr(settings, 'population_sigma', 0.1),
+                         popsize=popsize,
+                         max_generations=getattr(settings, 'max_generations', 50),
+                         bounds=getattr(settings, 'radii_bounds', None),
+                         xtol=getattr(settings, 'population_xtol', 1e-3),
+                         ftol=tolerance,
+                         seed=getattr(settings, 'population_seed', None),
+                         callback=progress)
+        if uses_gradient(method) and (parallel or queue is not None or pipeline is not None):
+            # gradient points are evaluated at once; gradient-free methods evaluate single points
+            return minimize(fun_grad, x0, args=const_radii, method=method, jac=True, tol=tolerance, options=options)
+        return minimize(fun, x0, args=const_radii, method=method, tol=tolerance, options=options)
+
+    parallel = getattr(settings, 'parallel_gradient', False)
+    if parallel and not population and not uses_gradient(method):
+        # the gradient would cost n+1 evaluations per function value and be thrown away
+        get_logger('find_pseudo', element, cwd).warning(
+            "parallel_gradient is ignored: method {} does not use the gradient".format(method))
+        parallel = False
+    parallel = parallel or population
+    if parallel and queue is None and pipeline is None:
+        # candidates are evaluated in threads of this process (evaluate does not change the working directory),
+        # so they share the in-memory caches and the backend core budget
+        pool = ThreadPool(getattr(settings, 'n_workers', popsize if population else len(x0) + 1))
+    try:
+        return search()
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if pipeline is not None:
+            pipeline.close()
+        log_run_summary(settings, cwd, started, get_logger('find_pseudo', element, cwd))
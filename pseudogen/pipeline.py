@@ -0,0 +1,149 @@
+"""
+pipeline.py evaluates a stream of candidates with the stages overlapped: while SIESTA runs for one candidate,
+the pseudopotentials of the next ones are generated, tested with ATOM and prescreened by their descriptors. Stages are connected by bounded
+queues, so that the number of candidates waiting for SIESTA (and their files on disk) is limited
+"""
+
+import sys
+import Queue
+import itertools
+import threading
+from evaluate import Candidate
+from fidelity import FULL
+
+# tells the stage thread to exit
+_STOP = object()
+
+
+class Pipeline(object):
+
+    def __init__(self, settings, fdf_file, cache=None, results=None, work_dir=None,
+                 atom_workers=1, siesta_workers=2, max_pending=2):
+        """ Stages ATOM -> SIESTA -> fit run by their own threads
+
+        Arguments:
+            settings {module} -- settings of the calculation
+            fdf_file {string} -- absolute path to SIESTA fdf template
+
+        Keyword Arguments:
+            cache {PseudoCache} -- cache of generated pseudopotentials (default: {None})
+            results {ResultsStore} -- database the evaluations are recorded to (default: {None})
+            work_dir {string} -- directory of the calculations (default: {None}, the current directory)
+            atom_workers {int} -- number of candidates generated and tested at once (default: {1})
+            siesta_workers {int} -- number of candidates running SIESTA at once (default: {2})
+            max_pending {int} -- number of generated candidates waiting for SIESTA (default: {2})
+        """
+        self.settings = settings
+        self.fdf_file = fdf_file
+        self.cache = cache
+        self.results = results
+        self.work_dir = work_dir
+        self._atom_queue = Queue.Queue()
+        self._siesta_queue = Queue.Queue(maxsize=max_pending)
+        self._fit_queue = Queue.Queue()
+        self._lock = threading.Lock()
+        self._batch_ids = itertools.count()
+        self._batches = {}
+        self._stages = []
+        for queue, stage, n_threads in ((self._atom_queue, self._atom_stage, atom_workers),
+                                        (self._siesta_queue, self._siesta_stage, siesta_workers),
+                                        (self._fit_queue, self._fit_stage, 1)):
+            threads = []
+            for _ in range(n_threads):
+                thread = threading.Thread(target=self._loop, args=(queue, stage))
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+            self._stages.append((queue, threads))
+
+    def _loop(self, queue, stage):
+        while True:
+            item = queue.get()
+            if item is _STOP:
+                break
+            batch, i, candidate = item
+            try:
+                stage(batch, i, candidate)
+            except Exception:
+                self._done(batch, i, error=sys.exc_info())
+
+    def _atom_stage(self, batch, i, task):
+        radii, fidelity = task
+        candidate = Candidate(self.settings, radii, self.work_dir, fidelity)
+        if candidate.generate(self.cache) and candidate.prescreen(self.fdf_file):
+            # blocks if max_pending candidates are already waiting for SIESTA
+            self._siesta_queue.put((batch, i, candidate))
+        else:
+            self._done(batch, i, candidate.finish(self.results))
+
+    def _siesta_stage(self, batch, i, candidate):
+        candidate.run_siesta(self.fdf_file)
+        self._fit_queue.put((batch, i, candidate))
+
+    def _fit_stage(self, batch, i, candidate):
+        candidate.fit()
+        self._done(batch, i, candidate.finish(self.results))
+
+    def _done(self, batch, i, record=None, error=None):
+        self._batches[batch].put((i, record, error))
+
+    def map(self, radii_list, fidelity=FULL):
+        """ Evaluates candidates at the given fidelity, returns their records in the order of radii_list;
+        may be called from several threads at once
+        """
+        done = Queue.Queue()
+        with self._lock:
+            batch = next(self._batch_ids)
+            self._batches[batch] = done
+        for i, radii in enumerate(radii_list):
+            self._atom_queue.put((batch, i, (radii, fidelity)))
+        records = [None] * len(radii_list)
+        error = None
+        for _ in radii_list:
+            # get without timeout cannot be interrupted by Ctrl-C in python 2
+            while True:
+                try:
+                    i, record, exc_info = done.get(timeout=1.)
+                    break
+                except Queue.Empty:
+                    pass
+            records[i] = record
+            if exc_info is not None and error is None:
+                error = exc_info
+        with self._lock:
+            del self._batches[batch]
+        if error is not None:
+            raise error[0], error[1], error[2]
+        return records
+
+    def close(self):
+        """ Stops the stage threads after the queued candidates are done
+        """
+        # stages are stopped one by one, so that each of them passes its candidates to the next one
+        for queue, threads in self._stages:
+            for _ in threads:
+                queue.put(_STOP)
+            for thread in threads:
+                thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def pipeline_options(settings):
+    """ Returns Pipeline keyword arguments given by settings.pipeline_* variables
+    """
+    return {"atom_workers": getattr(settings, 'pipeline_atom_workers', 1),
+            "siesta_workers": getattr(settings, 'pipeline_siesta_workers', 2),
+            "max_pending": getattr(settings, 'pipeline_max_pending', 2)}
+
+
+def get_pipeline(settings, fdf_file, cache=None, results=None, work_dir=None):
+    """ Returns Pipeline configured by settings, or None if settings.pipeline is not set
+    """
+    if not getattr(settings, 'pipeline', False):
+        return None
+    return Pipeline(settings, fdf_file, cache=cache, results=results, work_dir=work_dir, **pipeline_options(settings))
@@ -0,0 +1,93 @@
+"""
+population.py contains population-based minimization (CMA-ES) of a function evaluated for a batch of points
+at once, so that all candidates of a generation can be calculated concurrently
+"""
+
+import numpy as np
+from scipy.optimize import OptimizeResult
+
+
+def cmaes(fun_batch, x0, sigma0, popsize=None, max_generations=100, bounds=None,
+          xtol=1e-3, ftol=1e-3, seed=None, callback=None):
+    """ Minimizes function by covariance matrix adaptation evolution strategy
+
+    Arguments:
+        fun_batch {function} -- takes list of points, returns list of function values
+        x0 {array} -- initial mean of the population
+        sigma0 {float} -- initial step size
+
+    Keyword Arguments:
+        popsize {int} -- number of points per generation (default: {None}, 4 + 3 ln(n))
+        max_generations {int} -- maximum number of generations (default: {100})
+        bounds {tuple} -- (lower, upper) bounds of the coordinates, sampled points are clipped to them (default: {None})
+        xtol {float} -- stop when the step size is below xtol (default: {1e-3})
+        ftol {float} -- stop when the function values of a generation and the best one differ by less than ftol
+                        (default: {1e-3})
+        seed {int} -- random seed (default: {None})
+        callback {function} -- called after each generation as callback(generation, xs, fs, best_x, best_f)
+                               (default: {None})
+
+    Returns:
+        OptimizeResult -- best point x, its value fun, number of generations nit and of evaluations nfev
+    """
+    rng = np.random.RandomState(seed)
+    mean = np.asarray(x0, dtype=float)
+    n = len(mean)
+    lam = popsize or 4 + int(3 * np.log(n))
+    mu = lam // 2
+    weights = np.log(mu + 0.5) - np.log(np.arange(1, mu + 1))
+    weights /= weights.sum()
+    mueff = 1. / np.sum(weights ** 2)
+    # adaptation constants (Hansen, The CMA Evolution Strategy: A Tutorial)
+    cc = (4. + mueff / n) / (n + 4. + 2. * mueff / n)
+    cs = (mueff + 2.) / (n + mueff + 5.)
+    c1 = 2. / ((n + 1.3) ** 2 + mueff)
+    cmu = min(1. - c1, 2. * (mueff - 2. + 1. / mueff) / ((n + 2.) ** 2 + mueff))
+    damps = 1. + 2. * max(0., np.sqrt((mueff - 1.) / (n + 1.)) - 1.) + cs
+    chi_n = np.sqrt(n) * (1. - 1. / (4. * n) + 1. / (21. * n ** 2))
+
+    sigma = float(sigma0)
+    cov = np.eye(n)
+    pc = np.zeros(n)
+    ps = np.zeros(n)
+    best_x, best_f = mean.copy(), np.inf
+    nfev = 0
+    message = "Maximum number of generations reached"
+    for generation in range(max_generations):
+        eigval, basis = np.linalg.eigh(cov)
+        d = np.sqrt(np.maximum(eigval, 1e-20))
+        z = rng.standard_normal((lam, n))
+        xs = mean + sigma * z.dot((basis * d).T)
+        if bounds is not None:
+            xs = np.clip(xs, bounds[0], bounds[1])
+        fs = np.asarray(fun_batch([list(x) for x in xs]), dtype=float)
+        nfev += lam
+        order = np.argsort(fs)
+        if fs[order[0]] < best_f:
+            best_x, best_f = xs[order[0]].copy(), fs[order[0]]
+        if callback is not None:
+            callback(generation, xs, fs, best_x, best_f)
+
+        old_mean = mean
+        # steps of the selected points (recalculated from the clipped points)
+        ys = (xs[order[:mu]] - old_mean) / sigma
+        y_w = weights.dot(ys)
+        mean = old_mean + sigma * y_w
+        inv_sqrt = basis.dot(np.diag(1. / d)).dot(basis.T)
+        ps = (1. - cs) * ps + np.sqrt(cs * (2. - cs) * mueff) * inv_sqrt.dot(y_w)
+        h_sig = (np.linalg.norm(ps) / np.sqrt(1. - (1. - cs) ** (2 * (generation + 1))) / chi_n
+                 < 1.4 + 2. / (n + 1.))
+        pc = (1. - cc) * pc + h_sig * np.sqrt(cc * (2. - cc) * mueff) * y_w
+        cov = ((1. - c1 - cmu) * cov
+               + c1 * (np.outer(pc, pc) + (1. - h_sig) * cc * (2. - cc) * cov)
+               + cmu * (ys.T * weights).dot(ys))
+        sigma *= np.exp(cs / damps * (np.linalg.norm(ps) / chi_n - 1.))
+
+        if sigma * d.max() < xtol:
+            message = "Step size is below xtol"
+            break
+        if np.max(fs) - best_f < ftol:
+            message = "Function values of the generation are within ftol"
+            break
+    return OptimizeResult(x=best_x, fun=best_f, nit=generation + 1, nfev=nfev,
+                          success=True, message=message)
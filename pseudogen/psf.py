@@ -0,0 +1,347 @@
+"""
+psf.py reads pseudopotential files written by ATOM (formatted .psf and unformatted .vps) into NumPy arrays
+and computes cheap descriptors of the pseudopotential, used to reject or rank candidates before SIESTA runs:
+
+ * mesh cutoff estimated from the Fourier tail of the pseudo charge density;
+ * ghost states of the Kleinman-Bylander form (Gonze, Stumpf, Scheffler, PRB 44, 8503 (1991));
+ * overlap of the pseudization spheres of nearest neighbours.
+
+Parsed files are kept in a binary cache next to them (.{name}.npy, memory-mapped, and .{name}.json header)
+"""
+
+import os
+import re
+import json
+import uuid
+import struct
+import numpy as np
+from scipy.linalg import eigh_tridiagonal
+
+BOHR = 0.52917721067
+
+# Fortran E format drops the exponent letter if the exponent has 3 digits, e.g. 0.962929169563-100
+_exponent = re.compile(r"(?<=\d)([+-]\d{3})\b")
+
+
+class PseudoFile(object):
+
+    def __init__(self, element, zion, r, potentials, core=None, valence=None, wavefunctions=None, text=""):
+        """ Radial data of the pseudopotential, all in atomic units (bohr, Ry)
+
+        Arguments:
+            element {string} -- chemical symbol
+            zion {float} -- valence charge
+            r {array} -- radial grid
+            potentials {dict} -- {l: r * V_l(r)}, ionic (unscreened) pseudopotentials
+
+        Keyword Arguments:
+            core {array} -- 4 pi r^2 rho_core(r) of nonlinear core correction (default: {None})
+            valence {array} -- 4 pi r^2 rho_val(r) (default: {None})
+            wavefunctions {dict} -- {l: r * R_l(r)}, pseudo wavefunctions if they are in the file (default: {None})
+            text {string} -- header text with the pseudization radii (default: {""})
+        """
+        self.element = element
+        self.zion = zion
+        self.r = r
+        self.potentials = potentials
+        self.core = core
+        self.valence = valence
+        self.wavefunctions = wavefunctions or {}
+        self.text = text
+
+    @property
+    def radii(self):
+        """ Pseudization radii given in the header, bohr
+        """
+        return [float(x) for x in re.findall(r"r=\s*([0-9.]+)", self.text)]
+
+    @property
+    def r_core(self):
+        """ The largest pseudization radius; if the header has none, the radius beyond which all
+        the potentials are Coulomb-like, -2 zion / r
+        """
+        radii = self.radii
+        if radii:
+            return max(radii)
+        r_core = 0.
+        for rv in self.potentials.values():
+            outside = np.abs(np.asarray(rv) + 2. * self.zion) > 1e-3 * self.zion
+            if outside.any():
+                r_core = max(r_core, self.r[np.nonzero(outside)[0][-1]])
+        return r_core
+
+    def _arrays(self):
+        rows = [self.r]
+        rows += [self.potentials[l] for l in sorted(self.potentials)]
+        rows.append(self.core if self.core is not None else np.zeros_like(self.r))
+        rows.append(self.valence if self.valence is not None else np.zeros_like(self.r))
+        rows += [self.wavefunctions[l] for l in sorted(self.wavefunctions)]
+        header = {"element": self.element,
+                  "zion": self.zion,
+                  "text": self.text,
+                  "potentials": sorted(self.potentials),
+                  "wavefunctions": sorted(self.wavefunctions),
+                  "core": self.core is not None,
+                  "valence": self.valence is not None}
+        return header, np.vstack(rows)
+
+    @classmethod
+    def _from_arrays(cls, header, arrays):
+        n_pot = len(header["potentials"])
+        potentials = dict(zip(header["potentials"], arrays[1:1 + n_pot]))
+        wavefunctions = dict(zip(header["wavefunctions"], arrays[3 + n_pot:]))
+        return cls(header["element"], header["zion"], arrays[0], potentials,
+                   core=arrays[1 + n_pot] if header["core"] else None,
+                   valence=arrays[2 + n_pot] if header["valence"] else None,
+                   wavefunctions=wavefunctions,
+                   text=header["text"])
+
+
+def _fortran_floats(lines):
+    text = " ".join(lines).replace("D", "E")
+    return np.array(_exponent.sub(r"E\1", text).split(), dtype=float)
+
+
+def read_psf(file_name):
+    """ Reads formatted pseudopotential file (.psf)
+    """
+    with open(file_name, "r") as f:
+        lines = f.read().splitlines()
+    element = lines[0].split()[0]
+    text = lines[2]
+    npotd, npotu, nr, b, a, zion = lines[3].split()
+    nr = int(nr)
+    # the rest of the file consists of sections, each starting with a title line
+    sections = []
+    for line in lines[4:]:
+        if re.search(r"[a-zA-Z]{3}", line):
+            sections.append((line, []))
+        elif sections:
+            sections[-1][1].append(line)
+    r = None
+    potentials, wavefunctions = {}, {}
+    core = valence = None
+    for title, body in sections:
+        values = _fortran_floats(body)
+        title = title.lower()
+        if "radial grid" in title:
+            r = values[:nr]
+        elif "down pseudopotential" in title:
+            potentials[int(values[0])] = values[1:nr + 1]
+        elif "core charge" in title:
+            core = values[:nr]
+        elif "valence charge" in title:
+            valence = values[:nr]
+        elif "wave" in title:
+            wavefunctions[int(values[0])] = values[3:nr + 3]
+    if core is not None and not core.any():
+        core = None
+    return PseudoFile(element, float(zion), r, potentials, core, valence, wavefunctions, text)
+
+
+def _fortran_records(data):
+    records = []
+    pos = 0
+    while pos + 4 <= len(data):
+        n = struct.unpack("<i", data[pos:pos + 4])[0]
+        records.append(data[pos + 4:pos + 4 + n])
+        pos += n + 8
+    return records
+
+
+def read_vps(file_name):
+    """ Reads unformatted pseudopotential file (.vps, Fortran sequential records as read by SIESTA):
+    header (name a2, xc a2, relativistic flag a3, core correction flag a4, method 6 x a10, text a70,
+    npotd, npotu, nr, b, a, zion), radial grid, npotd down and npotu up potentials (l, r V_l),
+    core and valence charges
+    """
+    with open(file_name, "rb") as f:
+        records = _fortran_records(f.read())
+    header = records[0]
+    element = header[:2].strip()
+    text = header[71:141]
+    npotd, npotu, _ = struct.unpack("<3i", header[141:153])
+    zion = struct.unpack("<3d", header[153:177])[2]
+    r = np.frombuffer(records[1], dtype="<f8")
+    nr = len(r)
+    potentials = {}
+    for record in records[2:2 + npotd]:
+        potentials[struct.unpack("<i", record[:4])[0]] = np.frombuffer(record[4:4 + 8 * nr], dtype="<f8")
+    rest = records[2 + npotd + npotu:]
+    core = np.frombuffer(rest[0], dtype="<f8") if len(rest) > 0 else None
+    valence = np.frombuffer(rest[1], dtype="<f8") if len(rest) > 1 else None
+    if core is not None and not core.any():
+        core = None
+    return PseudoFile(element, zion, r, potentials, core, valence, text=text)
+
+
+def load_pseudo(file_name):
+    """ Returns PseudoFile for psf or vps file; the arrays are read from the binary cache
+    (memory-mapped) if it was made from the current version of the file
+    """
+    file_name = os.path.abspath(file_name)
+    dirname, name = os.path.split(file_name)
+    header_name = os.path.join(dirname, "." + name + ".json")
+    array_name = os.path.join(dirname, "." + name + ".npy")
+    mtime = os.path.getmtime(file_name)
+    try:
+        with open(header_name, "r") as f:
+            header = json.load(f)
+        if header["mtime"] == mtime:
+            return PseudoFile._from_arrays(header, np.load(array_name, mmap_mode="r"))
+    except (IOError, OSError, KeyError, ValueError):
+        pass
+    pseudo = read_vps(file_name) if file_name.endswith(".vps") else read_psf(file_name)
+    header, arrays = pseudo._arrays()
+    header["mtime"] = mtime
+    tmp = ".{}.tmp".format(uuid.uuid4().hex[:8])
+    try:
+        # the header is written last, so that it always refers to the complete array file
+        np.save(array_name + tmp + ".npy", arrays)
+        os.rename(array_name + tmp + ".npy", array_name)
+        with open(header_name + tmp, "w") as f:
+            json.dump(header, f)
+        os.rename(header_name + tmp, header_name)
+    except (IOError, OSError):
+        # the cache is optional, e.g. the directory may be read-only
+        pass
+    return pseudo
+
+
+def fourier_cutoff(r, u, l=0, tol=1e-3, max_cutoff=2000., kinetic=False):
+    """ Estimates plane wave cutoff of a radial function from its Fourier tail
+
+    Arguments:
+        r {array} -- radial grid, bohr
+        u {array} -- r R(r) of a wavefunction or 4 pi r^2 rho(r) of a charge density (see kinetic)
+
+    Keyword Arguments:
+        l {int} -- angular momentum (default: {0})
+        tol {float} -- tolerance (default: {1e-3})
+        max_cutoff {float} -- the largest cutoff considered, Ry (default: {2000.})
+        kinetic {bool} -- if True, u is r R(r) and the cutoff is where the kinetic energy beyond it is below
+                          tol of the total one; otherwise u is 4 pi r^2 rho(r) and the cutoff is where
+                          |rho(q)| / rho(0) stays below tol (default: {False})
+
+    Returns:
+        float -- cutoff, Ry
+    """
+    from scipy.special import spherical_jn
+    q = np.linspace(0., np.sqrt(max_cutoff), 400)
+    jl = spherical_jn(l, np.outer(q, r))
+    if kinetic:
+        f = np.trapz(jl * (u * r)[None, :], r, axis=1)
+        # kinetic energy density in q space, cumulative from the tail
+        t = (q ** 4) * f ** 2
+        tail = np.cumsum(t[::-1])[::-1]
+        above = tail / tail[0] > tol
+    else:
+        f = np.trapz(jl * u[None, :], r, axis=1)
+        above = np.abs(f) / abs(f[0]) > tol
+    if not above.any():
+        return 0.
+    return float(q[min(np.nonzero(above)[0][-1] + 1, len(q) - 1)] ** 2)
+
+
+def _lda_potential(rho):
+    """ LDA exchange-correlation potential (Perdew-Zunger), Ry
+    """
+    rho = np.maximum(rho, 1e-30)
+    rs = (3. / (4. * np.pi * rho)) ** (1. / 3.)
+    vx = -2. * (3. / (2. * np.pi)) ** (2. / 3.) / rs
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sq = np.sqrt(rs)
+        ec_high = -0.1423 / (1. + 1.0529 * sq + 0.3334 * rs)
+        vc_high = ec_high * (1. + 7. / 6. * 1.0529 * sq + 4. / 3. * 0.3334 * rs) / (1. + 1.0529 * sq + 0.3334 * rs)
+        vc_low = 0.0311 * np.log(rs) - 0.0583 + 0.0020 * 2. / 3. * rs * np.log(rs) + (2. * -0.0116 - 0.0020) / 3. * rs
+    vc = np.where(rs >= 1., vc_high, vc_low)
+    return vx + 2. * vc
+
+
+def screening_potential(pseudo):
+    """ Hartree and LDA exchange-correlation potential of the valence (and core correction) charge, Ry
+    """
+    r = pseudo.r
+    if pseudo.valence is None:
+        return np.zeros_like(r)
+    u = np.asarray(pseudo.valence)
+    dr = np.concatenate(([r[0]], np.diff(r)))
+    charge = np.cumsum(u * dr)
+    outer = np.cumsum((u / r * dr)[::-1])[::-1]
+    # e^2 = 2 in Ry units
+    v_h = 2. * (charge / r + outer - u / r * dr)
+    total = u + (pseudo.core if pseudo.core is not None else 0.)
+    return v_h + _lda_potential(total / (4. * np.pi * r ** 2))
+
+
+def _radial_states(r, v, l, n_states=2, r_max=20., h=0.01):
+    """ The lowest eigenvalues (Ry) and normalized eigenfunctions u(x) of -u'' + (l(l+1)/x^2 + v) u = e u
+    on the uniform grid x up to r_max with u(0) = u(r_max) = 0
+    """
+    x = np.arange(h, min(r_max, r[-1]), h)
+    vx = np.interp(x, r, v) + l * (l + 1.) / x ** 2
+    values, vectors = eigh_tridiagonal(2. / h ** 2 + vx, -np.ones(len(x) - 1) / h ** 2,
+                                       select="i", select_range=(0, n_states - 1))
+    return x, values, vectors / np.sqrt(h)
+
+
+def ghost_states(pseudo, local_l=None):
+    """ Returns angular momenta whose Kleinman-Bylander projectors give ghost states below the reference level
+
+    The criterion of Gonze, Stumpf and Scheffler is applied to the semilocal potentials of the file screened by
+    the valence charge in LDA (the indicator does not depend on the functional the pseudopotential was made with)
+
+    Keyword Arguments:
+        local_l {int} -- angular momentum of the local potential (default: {None}, the highest one)
+    """
+    if local_l is None:
+        local_l = max(pseudo.potentials)
+    v_scr = screening_potential(pseudo)
+    v_loc = np.asarray(pseudo.potentials[local_l]) / pseudo.r + v_scr
+    ghosts = []
+    for l in sorted(pseudo.potentials):
+        if l == local_l:
+            continue
+        v_l = np.asarray(pseudo.potentials[l]) / pseudo.r + v_scr
+        x, e_l, phi = _radial_states(pseudo.r, v_l, l, n_states=1)
+        phi = phi[:, 0]
+        dv = np.interp(x, pseudo.r, v_l - v_loc)
+        # the projector is zero, e.g. for the channel identical to the local one
+        norm = np.sum(phi * dv * phi)
+        if abs(norm) < 1e-10:
+            continue
+        e_kb = np.sum(phi * dv ** 2 * phi) / norm
+        _, e_loc, _ = _radial_states(pseudo.r, v_loc, l, n_states=2)
+        if (e_kb > 0. and e_l[0] > e_loc[1]) or (e_kb < 0. and e_l[0] > e_loc[0]):
+            ghosts.append(l)
+    return ghosts
+
+
+def describe(pseudo, nn_distance=None, tol=1e-3, local_l=None):
+    """ Computes descriptors of the pseudopotential
+
+    Arguments:
+        pseudo {PseudoFile} -- pseudopotential
+
+    Keyword Arguments:
+        nn_distance {float} -- nearest-neighbour distance, Ang (default: {None}, overlap is not computed)
+        tol {float} -- tolerance of the Fourier tails (default: {1e-3})
+        local_l {int} -- angular momentum of the local potential for the ghost test (default: {None}, the highest)
+
+    Returns:
+        dict -- est_cutoff (Ry, from the charge density or from the pseudo wavefunctions if the file has them),
+                ghosts (comma-separated angular momenta with ghost states, empty if there are none)
+                and core_overlap (the largest pseudization radius over half of the nearest-neighbour distance)
+    """
+    descriptors = {"est_cutoff": None, "ghosts": None, "core_overlap": None}
+    if pseudo.valence is not None:
+        density = np.asarray(pseudo.valence) + (pseudo.core if pseudo.core is not None else 0.)
+        descriptors["est_cutoff"] = fourier_cutoff(pseudo.r, density, tol=tol)
+    if pseudo.wavefunctions:
+        descriptors["est_cutoff"] = max(fourier_cutoff(pseudo.r, np.asarray(u), l=l, tol=tol, kinetic=True)
+                                        for l, u in pseudo.wavefunctions.items())
+    if pseudo.potentials:
+        descriptors["ghosts"] = ",".join("spdf"[l] for l in ghost_states(pseudo, local_l))
+    if nn_distance is not None:
+        descriptors["core_overlap"] = float(2. * pseudo.r_core / (nn_distance / BOHR))
+    return descriptors
@@ -0,0 +1,117 @@
+"""
+reference.py contains the registry of reference EOS data (V0, B0, B1 per element) used for delta factor,
+each reference file is parsed once per process and kept in a binary cache next to it
+"""
+
+import os
+import numpy as np
+
+DEFAULT_REFERENCE = os.path.join("delta", "WIEN2k.txt")
+
+FIELDS = ("element", "V0", "B0", "BP")
+
+
+class ReferenceData(object):
+
+    def __init__(self, file_name):
+        """ Reference EOS data from the file in DeltaCodesDFT format (element V0 B0 BP per line)
+
+        Arguments:
+            file_name {string} -- name of the file containing data
+        """
+        self.file_name = os.path.abspath(file_name)
+        self.data = self._load()
+        self._index = dict((str(el), i) for i, el in enumerate(self.data["element"]))
+
+    def _cache_name(self):
+        dirname, name = os.path.split(self.file_name)
+        return os.path.join(dirname, "." + name + ".npz")
+
+    def _load(self):
+        mtime = os.path.getmtime(self.file_name)
+        cache_name = self._cache_name()
+        try:
+            with np.load(cache_name) as cached:
+                if float(cached["mtime"]) == mtime:
+                    return cached["data"]
+        except (IOError, OSError, KeyError, ValueError):
+            pass
+        data = np.atleast_1d(np.genfromtxt(self.file_name,
+                                           names=FIELDS,
+                                           comments="#",
+                                           dtype=None))
+        try:
+            tmp_name = cache_name + ".{}.npz".format(os.getpid())
+            np.savez(tmp_name, data=data, mtime=np.array(mtime))
+            os.rename(tmp_name, cache_name)
+        except (IOError, OSError):
+            # the cache is optional, e.g. the reference directory may be read-only
+            pass
+        return data
+
+    def __contains__(self, element):
+        return element in self._index
+
+    def elements(self):
+        return sorted(self._index)
+
+    def get(self, element):
+        """ Returns reference data for the element as a record array with one record,
+        suitable for calcDelta
+        """
+        try:
+            i = self._index[element]
+        except KeyError:
+            raise KeyError("No reference data for {} in {}".format(element, self.file_name))
+        return self.data[i:i+1]
+
+
+_registry = {}
+
+
+def load_reference(file_name):
+    """ Returns ReferenceData for the file, parsed once per process (and again only if the file is changed)
+    """
+    key = os.path.abspath(file_name)
+    mtime = os.path.getmtime(key)
+    if key not in _registry or _registry[key][0] != mtime:
+        _registry[key] = (mtime, ReferenceData(key))
+    return _registry[key][1]
+
+
+def reference_files(settings, work_dir=None):
+    """ Returns dict {reference code: file name} given by settings.reference_files,
+    or by settings.reference_file if only one reference is used; relative file names are resolved
+    against work_dir (default: the current directory)
+    """
+    files = getattr(settings, 'reference_files', None)
+    if files is None:
+        files = {"WIEN2k": getattr(settings, 'reference_file', DEFAULT_REFERENCE)}
+    work_dir = os.path.abspath(work_dir or ".")
+    return dict((code, os.path.join(work_dir, file_name)) for code, file_name in files.items())
+
+
+def reference_code(settings):
+    """ Returns the code of the main reference used for delta factor (settings.reference_code)
+    """
+    files = reference_files(settings)
+    code = getattr(settings, 'reference_code', None)
+    if code is None:
+        if len(files) > 1:
+            raise ValueError("reference_code must be set if several reference files are given")
+        code = list(files)[0]
+    return code
+
+
+def get_reference(settings, code=None, work_dir=None):
+    """ Returns ReferenceData of the reference code (default: the main reference)
+    """
+    if code is None:
+        code = reference_code(settings)
+    return load_reference(reference_files(settings, work_dir)[code])
+
+
+def get_references(settings, work_dir=None):
+    """ Returns dict {reference code: ReferenceData} of all references given in settings
+    """
+    return dict((code, load_reference(file_name)) for code, file_name in reference_files(settings, work_dir).items())
@@ -0,0 +1,188 @@
+"""
+results.py contains SQLite database of evaluated pseudopotentials with a simple query API
+"""
+
+import os
+import json
+import sqlite3
+from fidelity import FULL
+from journal import settings_hash
+
+COLUMNS = (("element", "TEXT"),
+           ("uuid", "TEXT"),
+           ("radii", "TEXT"),
+           ("r_s", "REAL"),
+           ("r_p", "REAL"),
+           ("r_d", "REAL"),
+           ("r_f", "REAL"),
+           ("r_ps", "REAL"),
+           ("err_pseudo", "REAL"),
+           ("err_mean", "REAL"),
+           ("err_max", "REAL"),
+           ("v0", "REAL"),
+           ("b0", "REAL"),
+           ("b1", "REAL"),
+           ("delta", "REAL"),
+           ("rel_delta", "REAL"),
+           ("rejected", "TEXT"),
+           ("fidelity", "TEXT"),
+           ("mesh_cutoff", "REAL"),
+           ("est_cutoff", "REAL"),
+           ("ghosts", "TEXT"),
+           ("core_overlap", "REAL"),
+           ("started", "REAL"),
+           ("wall_time", "REAL"),
+           ("path", "TEXT"),
+           ("context", "TEXT"))
+
+_column_names = [c[0] for c in COLUMNS]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS evaluations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    {columns}
+);
+CREATE INDEX IF NOT EXISTS evaluations_delta ON evaluations (element, delta);
+CREATE INDEX IF NOT EXISTS evaluations_err_max ON evaluations (element, err_max);
+CREATE INDEX IF NOT EXISTS evaluations_uuid ON evaluations (uuid);
+CREATE TABLE IF NOT EXISTS eos_points (
+    evaluation_id INTEGER REFERENCES evaluations (id),
+    volume REAL,
+    energy REAL
+);
+CREATE INDEX IF NOT EXISTS eos_points_evaluation ON eos_points (evaluation_id);
+""".format(columns=",\n    ".join(" ".join(c) for c in COLUMNS))
+
+
+class ResultsStore(object):
+
+    def __init__(self, db_file, context=None):
+        """ Database of evaluation results
+
+        Arguments:
+            db_file {string} -- SQLite database file
+
+        Keyword Arguments:
+            context {string} -- hash of the settings stored with the evaluations (see journal.settings_hash)
+                                (default: {None})
+        """
+        self.db_file = os.path.abspath(db_file)
+        self.context = context
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            self._migrate(conn)
+
+    @staticmethod
+    def _migrate(conn):
+        # columns added after the database was created; evaluations made before are at full fidelity
+        existing = set(row[1] for row in conn.execute("PRAGMA table_info(evaluations)"))
+        for name, kind in COLUMNS:
+            if name not in existing:
+                default = " DEFAULT '{}'".format(FULL) if name == "fidelity" else ""
+                conn.execute("ALTER TABLE evaluations ADD COLUMN {} {}{}".format(name, kind, default))
+
+    def _connect(self):
+        # a connection per operation, so that the store can be used from several threads and processes
+        conn = sqlite3.connect(self.db_file, timeout=60.)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def add(self, element, record):
+        """ Stores evaluation record (as returned by evaluate.evaluate), returns its id
+        """
+        row = dict((name, record.get(name)) for name in _column_names)
+        row["element"] = element
+        row["fidelity"] = record.get("fidelity", FULL)
+        row["context"] = record.get("context", self.context)
+        radii = record.get("radii", [])
+        row["radii"] = json.dumps(radii)
+        for name, r in zip(("r_s", "r_p", "r_d", "r_f", "r_ps"), radii):
+            row[name] = r
+        conn = self._connect()
+        try:
+            with conn:
+                cur = conn.execute("INSERT INTO evaluations ({}) VALUES ({})".format(
+                                       ", ".join(_column_names), ", ".join("?" * len(_column_names))),
+                                   [row[name] for name in _column_names])
+                eval_id = cur.lastrowid
+                conn.executemany("INSERT INTO eos_points (evaluation_id, volume, energy) VALUES (?, ?, ?)",
+                                 [(eval_id, v, e) for v, e in zip(record.get("volumes", []),
+                                                                  record.get("energies", []))])
+        finally:
+            conn.close()
+        return eval_id
+
+    def query(self, order_by="delta", limit=None, include_rejected=False, **conditions):
+        """ Returns evaluations satisfying conditions as a list of dicts
+
+        Keyword Arguments:
+            order_by {string} -- column to sort by (default: {"delta"})
+            limit {int} -- maximum number of records (default: {None})
+            include_rejected {bool} -- if True, candidates rejected before SIESTA are also returned (default: {False})
+            conditions -- column=value for equality, max_column=value and min_column=value for bounds,
+                          e.g. query(element="Fe", max_err_max=1e-2, limit=10)
+        """
+        where, params = [], []
+        for key, value in conditions.items():
+            op = "="
+            column = key
+            if key.startswith("max_") and key[4:] in _column_names:
+                op, column = "<=", key[4:]
+            elif key.startswith("min_") and key[4:] in _column_names:
+                op, column = ">=", key[4:]
+            if column not in _column_names:
+                raise ValueError("ResultsStore.query: unknown column {}".format(column))
+            where.append("{} {} ?".format(column, op))
+            params.append(value)
+        if not include_rejected:
+            where.append("rejected IS NULL")
+        if order_by not in _column_names + ["id"]:
+            raise ValueError("ResultsStore.query: unknown column {}".format(order_by))
+        sql = "SELECT * FROM evaluations"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY {} IS NULL, {}".format(order_by, order_by)
+        if limit is not None:
+            sql += " LIMIT {:d}".format(limit)
+        conn = self._connect()
+        try:
+            rows = conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+        return [self._to_dict(row) for row in rows]
+
+    def best(self, element, n=10, **conditions):
+        """ Returns n evaluations of element with the lowest delta, e.g. best("Fe", 10, max_err_max=1e-2);
+        only full fidelity evaluations are returned unless fidelity condition is given
+        """
+        conditions.setdefault("fidelity", FULL)
+        return self.query(order_by="delta", limit=n, element=element, **conditions)
+
+    def eos_points(self, evaluation_id):
+        """ Returns list of (volume, energy) points of the evaluation
+        """
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT volume, energy FROM eos_points WHERE evaluation_id = ? ORDER BY volume",
+                                (evaluation_id,)).fetchall()
+        finally:
+            conn.close()
+        return [tuple(row) for row in rows]
+
+    @staticmethod
+    def _to_dict(row):
+        d = dict(zip(row.keys(), row))
+        d["radii"] = json.loads(d["radii"]) if d["radii"] else []
+        return d
+
+
+def get_results_store(settings, work_dir=None, fdf_file=None):
+    """ Returns ResultsStore given by settings.results_db (default results.db; relative to work_dir,
+    the current directory by default), or None if it is switched off; the evaluations are stored
+    with the hash of the settings and fdf_file, if it is given
+    """
+    db_file = getattr(settings, 'results_db', "results.db")
+    if db_file is None:
+        return None
+    context = settings_hash(settings, fdf_file) if fdf_file is not None else None
+    return ResultsStore(os.path.join(os.path.abspath(work_dir or "."), db_file), context=context)
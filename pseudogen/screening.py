@@ -0,0 +1,65 @@
+"""
+screening.py contains cheap checks rejecting bad pseudopotentials before running SIESTA
+"""
+
+# (name of the error, settings attribute holding its threshold)
+ERROR_THRESHOLDS = (("err_pseudo", "max_err_pseudo"),
+                    ("err_mean", "max_err_mean"),
+                    ("err_max", "max_err_max"))
+
+# (name of the descriptor of the pseudopotential file, settings attribute holding its threshold)
+DESCRIPTOR_THRESHOLDS = (("est_cutoff", "max_est_cutoff"),
+                         ("core_overlap", "max_core_overlap"))
+
+
+def _check(settings, thresholds, values):
+    reasons = []
+    excess = 0.
+    for name, attr in thresholds:
+        threshold = getattr(settings, attr, None)
+        if threshold is None or values.get(name) is None:
+            continue
+        if values[name] > threshold:
+            reasons.append("{} = {:.4} > {:.4}".format(name, values[name], threshold))
+            excess = max(excess, values[name] / threshold)
+    return reasons, excess
+
+
+def check_errors(settings, **errors):
+    """ Checks ATOM errors of the pseudopotential against thresholds given in settings
+
+    Arguments:
+        settings {module} -- settings of the calculation
+        errors -- values of err_pseudo, err_mean and err_max
+
+    Returns:
+        tuple -- (reason, excess): reason of rejection (None if the pseudopotential passed) 
+                 and the largest ratio of an error to its threshold
+    """
+    reasons, excess = _check(settings, ERROR_THRESHOLDS, errors)
+    if not reasons:
+        return None, 0.
+    return ", ".join(reasons), excess
+
+
+def penalty(settings, excess=1.):
+    """ Value returned to the optimizer for a rejected pseudopotential, it grows with the excess
+    of errors over thresholds so that the optimizer is driven back to the acceptable region
+    """
+    return getattr(settings, 'penalty', 100.) * max(excess, 1.)
+
+
+def check_descriptors(settings, descriptors):
+    """ Checks descriptors of the pseudopotential file (see psf.describe) against thresholds given in settings;
+    ghost states are a reason of rejection if settings.reject_ghosts is set
+
+    Returns:
+        tuple -- (reason, excess) as in check_errors
+    """
+    reasons, excess = _check(settings, DESCRIPTOR_THRESHOLDS, descriptors)
+    if getattr(settings, 'reject_ghosts', False) and descriptors.get("ghosts"):
+        reasons.append("ghost states for l = {}".format(descriptors["ghosts"]))
+        excess = max(excess, 1.)
+    if not reasons:
+        return None, 0.
+    return ", ".join(reasons), excess
@@ -12,86 +12,439 @@ __author__ = "Andrey Sobolev"
 __year__ = 2015
 
 import os
+import re
 import sys
+import json
 import shutil
-import subprocess
+import hashlib
+import resource
 import numpy as np
+from backend import Job, JobError, get_backend
+from psf import BOHR
 
 SIESTA_EXEC = os.environ.get('SIESTA_EXEC', '/home/andrey/bin/siesta')
+# file in the calculation directory recording the input hash and the state of the run
+MANIFEST = "manifest.json"
 
 def read_fdf_file(file_name):
     with open(file_name, "r") as f:
         file_text = f.read()
     return file_text
 
+def render_fdf(file_text, calc):
+    # write vectors in a cool way (calc itself is not changed, it may be shared by several calculations)
+    calc = dict(calc, vectors="\n".join(["{0[0]}\t{0[1]}\t{0[2]}".format(v) for v in calc["vectors"]]))
+    return file_text.format(**calc)
+
+def apply_fdf_overrides(fdf_text, overrides):
+    """ Replaces values of fdf options (or contents of fdf blocks) in the rendered fdf text;
+    options missing from the text are appended to it
+
+    Arguments:
+        fdf_text {string} -- rendered fdf file
+        overrides {dict} -- {option: value}; value of a block is a list of rows (lists of values),
+                            value of an option is written as is (e.g. "200. Ry")
+
+    Returns:
+        string -- fdf text with the overrides
+    """
+    for key, value in sorted((overrides or {}).items()):
+        if isinstance(value, (list, tuple)):
+            rows = "\n".join(" ".join(str(v) for v in row) for row in value)
+            block = re.compile(r"^(\s*%block\s+{0}\b[^\n]*\n).*?^(\s*%endblock\s+{0}\b)".format(re.escape(key)),
+                               re.M | re.I | re.S)
+            text = "%block {0}\n{1}\n%endblock {0}".format(key, rows)
+            if block.search(fdf_text):
+                fdf_text = block.sub(lambda m: m.group(1) + rows + "\n" + m.group(2), fdf_text, count=1)
+            else:
+                fdf_text += "\n" + text + "\n"
+        else:
+            line = re.compile(r"^(\s*{0}\s+)[^#\n]*".format(re.escape(key)), re.M | re.I)
+            if line.search(fdf_text):
+                fdf_text = line.sub(lambda m: m.group(1) + str(value) + " ", fdf_text, count=1)
+            else:
+                fdf_text += "\n{}    {}\n".format(key, value)
+    return fdf_text
+
+def nearest_neighbour_distance(fdf_text):
+    """ Returns the shortest interatomic distance (Ang) in the crystal given by the rendered fdf text
+    """
+    lines = [l.split("#")[0].strip() for l in fdf_text.splitlines()]
+    lower = [l.lower() for l in lines]
+
+    def value(key, default):
+        for l in lines:
+            if l.lower().startswith(key.lower() + " "):
+                return l.split()[1:]
+        return default
+
+    def block(key):
+        start = lower.index("%block " + key.lower())
+        end = lower.index("%endblock " + key.lower())
+        return np.array([[float(x) for x in l.split()[:3]] for l in lines[start + 1:end] if l])
+
+    alat, unit = value("LatticeConstant", ["1.", "Ang"])[:2]
+    alat = float(alat) * (BOHR if unit.lower() == "bohr" else 1.)
+    try:
+        vectors = block("LatticeVectors") * alat
+    except ValueError:
+        vectors = np.eye(3) * alat
+    coords = block("AtomicCoordinatesAndAtomicSpecies")
+    coord_format = value("AtomicCoordinatesFormat", ["NotScaledCartesianBohr"])[0].lower()
+    if coord_format.startswith("fractional") or coord_format == "scaledbylatticevectors":
+        coords = coords.dot(vectors)
+    elif coord_format == "scaledcartesian":
+        coords = coords * alat
+    elif coord_format in ("bohr", "notscaledcartesianbohr"):
+        coords = coords * BOHR
+    shifts = np.array([[i, j, k] for i in (-1, 0, 1) for j in (-1, 0, 1) for k in (-1, 0, 1)]).dot(vectors)
+    d = coords[:, None, None, :] + shifts[None, None, :, :] - coords[None, :, None, :]
+    d = np.sqrt(np.sum(d * d, axis=3))
+    return float(d[d > 1e-8].min())
+
 def write_fdf_file(file_name, file_text, calc):
-    # write vectors in a cool way
-    calc["vectors"] = "\n".join(["{0[0]}\t{0[1]}\t{0[2]}".format(v) for v in calc["vectors"]])
     with open(file_name, "w") as f:
-        f.write(file_text.format(**calc))
+        f.write(render_fdf(file_text, calc))
+
+class SiestaOutput(object):
+    """ Results of SIESTA run read from its output file
+    """
+
+    def __init__(self):
+        self.volume = None
+        self.energy = None
+        self.scf_steps = 0
+        self.dDmax = []
+        self.wall_time = None
+        self.converged = None
+        self.completed = False
+
+    def final(self):
+        """ Returns (volume, total energy) or None if the final energy block was not found
+        """
+        if self.volume is None or self.energy is None:
+            return None
+        return np.array((self.volume, self.energy))
+
+
+def _scf_dDmax(line):
+    """ Returns (SCF step, dDmax) of the SCF line of SIESTA output, or None
+    """
+    data = line.split()
+    if data and data[0] == "scf:" and len(data) > 5 and data[1].isdigit():
+        try:
+            return int(data[1]), float(data[5])
+        except ValueError:
+            return int(data[1]), None
+    return None
+
+
+class ScfMonitor(object):
+
+    def __init__(self, out_file, divergence_factor=10., divergence_steps=5, stagnation_steps=50):
+        """ Follows SIESTA output while the run goes on, see __call__
+
+        Arguments:
+            out_file {string} -- SIESTA output file
+
+        Keyword Arguments:
+            divergence_factor {float} -- SCF diverges if dDmax of the last divergence_steps steps is
+                                         this many times larger than its minimum before (default: {10.})
+            divergence_steps {int} -- (default: {5})
+            stagnation_steps {int} -- SCF stagnates if the minimum dDmax has not decreased in this many steps,
+                                      None to switch the check off (default: {50})
+        """
+        self.out_file = out_file
+        self.divergence_factor = divergence_factor
+        self.divergence_steps = divergence_steps
+        self.stagnation_steps = stagnation_steps
+        self.dDmax = []
+        self._pos = 0
+        self._tail = ""
+
+    def _read(self):
+        # only the part written since the last call is read
+        try:
+            with open(self.out_file, "r") as f:
+                f.seek(self._pos)
+                data = f.read()
+                self._pos = f.tell()
+        except IOError:
+            return
+        lines = (self._tail + data).split("\n")
+        self._tail = lines.pop()
+        for line in lines:
+            if "scf:" in line:
+                scf = _scf_dDmax(line)
+                if scf is not None and scf[1] is not None:
+                    self.dDmax.append(scf[1])
+
+    def __call__(self):
+        """ Returns the reason to kill the run, or None if SCF goes on normally
+        """
+        self._read()
+        d = self.dDmax
+        n = self.divergence_steps
+        if len(d) > n and min(d[-n:]) > self.divergence_factor * min(d[:-n]):
+            return "SCF diverges: dDmax = {:.3} at step {}, minimum was {:.3}".format(d[-1], len(d), min(d[:-n]))
+        n = self.stagnation_steps
+        if n is not None and len(d) > n and min(d[-n:]) >= min(d[:-n]):
+            return "SCF stagnates: dDmax has not decreased below {:.3} in {} steps".format(min(d[:-n]), n)
+        return None
+
+
+def read_output(file_name):
+    """ Reads SIESTA output file in one pass without loading it into memory
+
+    Arguments:
+        file_name {string} -- name of SIESTA output file
+
+    Returns:
+        SiestaOutput -- cell volume and total energy of the final energy block, number of SCF steps,
+                        dDmax history, wall time, SCF convergence and run completion flags
+    """
+    out = SiestaOutput()
+    final = False
+    volume = None
+    with open(file_name, "r") as f:
+        for line in f:
+            if "scf:" in line:
+                scf = _scf_dDmax(line)
+                if scf is not None:
+                    out.scf_steps = scf[0]
+                    if scf[1] is not None:
+                        out.dDmax.append(scf[1])
+            elif "Cell volume" in line:
+                volume = float(line.split()[-1])
+            elif "Final energy" in line:
+                final = True
+            elif final and "Total" in line:
+                out.volume = volume
+                out.energy = float(line.split()[3])
+                final = False
+            elif "SCF Convergence" in line or "SCF cycle converged" in line:
+                out.converged = True
+            elif "SCF_NOT_CONV" in line or "SCF did not converge" in line:
+                out.converged = False
+            elif "wall time" in line and "=" in line:
+                try:
+                    out.wall_time = float(line.split("=")[-1])
+                except ValueError:
+                    pass
+            elif "End of run" in line or "Job completed" in line:
+                out.completed = True
+    return out
+
 
 class SiestaCalculation(object):
 
-    def __init__(self, settings, pseudo_file, fdf_file="siesta.fdf"):
+    def __init__(self, settings, pseudo_file, fdf_file="siesta.fdf", backend=None, work_dir=None, fdf_overrides=None):
+        """ SIESTA calculations for several lattice constants, each made in its own subdirectory of work_dir
+
+        Arguments:
+            settings {module} -- settings of the calculation
+            pseudo_file {string} -- pseudopotential (psf) file
+
+        Keyword Arguments:
+            fdf_file {string} -- SIESTA fdf template (default: {"siesta.fdf"})
+            backend {LocalBackend} -- backend running SIESTA (default: {None}, the one given by settings)
+            work_dir {string} -- directory of the calculations (default: {None}, the current directory)
+            fdf_overrides {dict} -- fdf options replaced in the rendered template, see apply_fdf_overrides
+                                    (default: {None})
+        """
         self.calc = settings.calc
         self.is_run = False
         self.siesta_calc = settings.siesta_calc
         self.element = self.calc["element"]
-        
-        self.pseudo_file = pseudo_file  
+        # number of MPI ranks per SIESTA run
+        self.n_proc = getattr(settings, 'siesta_np', 4)
+        self.timeout = getattr(settings, 'siesta_timeout', None)
+        self.rlimits = {}
+        mem_limit = getattr(settings, 'siesta_mem_limit', None)
+        if mem_limit is not None:
+            self.rlimits[resource.RLIMIT_AS] = int(mem_limit * 1024 * 1024)
+        self.backend = backend if backend is not None else get_backend(settings)
+        self.priority = getattr(settings, 'priority', 0)
+        # options of ScfMonitor, None if runs are not monitored
+        self.monitor_options = None
+        if getattr(settings, 'scf_monitor', False):
+            self.monitor_options = {"divergence_factor": getattr(settings, 'scf_divergence_factor', 10.),
+                                    "divergence_steps": getattr(settings, 'scf_divergence_steps', 5),
+                                    "stagnation_steps": getattr(settings, 'scf_stagnation_steps', 50)}
+        self.monitor_interval = getattr(settings, 'scf_monitor_interval', 2.)
+        self._hashes = {}
+        self.work_dir = os.path.abspath(work_dir or ".")
+        # lattice constant of the last prepared calculation
+        self._alat = self.calc["alat"]
+
+        self.pseudo_file = os.path.abspath(pseudo_file)
         self.fdf_file = read_fdf_file(fdf_file)
+        self.fdf_overrides = fdf_overrides
 
-    def prepare(self, alat=None):
-        if alat is not None:
-            self.siesta_calc["alat"] = alat
-        else:
-            self.siesta_calc["alat"] = self.calc["alat"]
-        self.siesta_calc["vectors"] = self.calc["vectors"]
-        path = "%.4f" % (alat,)
+    @staticmethod
+    def dir_name(alat):
+        """ Name of the calculation directory for alat
+        """
+        return "%.4f" % (alat,)
+
+    def _path(self, alat=None):
+        if alat is None:
+            alat = self._alat
+        return os.path.join(self.work_dir, self.dir_name(alat))
+
+    def prepare(self, alat=None, dm_seed=None):
+        """ Makes the calculation directory for alat and writes SIESTA input there, unless the run is completed
+
+        Keyword Arguments:
+            alat {float} -- lattice constant (default: {None})
+            dm_seed {string} -- density matrix file to start SIESTA from if the directory has none (default: {None})
+        """
+        self._alat = alat if alat is not None else self.calc["alat"]
+        siesta_calc = dict(self.siesta_calc, alat=self._alat, vectors=self.calc["vectors"])
+        path = self._path()
+        fdf_text = apply_fdf_overrides(render_fdf(self.fdf_file, siesta_calc), self.fdf_overrides)
+        with open(self.pseudo_file, "r") as f:
+            psf_text = f.read()
+        self._hashes[path] = hashlib.sha1((fdf_text + psf_text).encode("utf-8")).hexdigest()
         if not os.path.isdir(path):
             os.makedirs(path)
-            self.is_run = False
         elif self.check():
             self.is_run = True
             return
+        else:
+            self._clean(path)
+        self.is_run = False
         fdf_file_name = os.path.join(path, self.element + ".fdf")
         # copy and rename psf file
         shutil.copy(self.pseudo_file, path)
         os.rename(os.path.join(path, os.path.basename(self.pseudo_file)), os.path.join(path, self.element + ".psf"))
-        write_fdf_file(fdf_file_name, self.fdf_file, self.siesta_calc)
+        dm_file = os.path.join(path, self.element + ".DM")
+        if dm_seed is not None and not os.path.exists(dm_file):
+            shutil.copy(dm_seed, dm_file)
+        if os.path.exists(dm_file) and \
+                not re.search(r"^\s*DM\.UseSaveDM", fdf_text, re.M | re.I):
+            # start from the saved density matrix
+            fdf_text += "\nDM.UseSaveDM          true\n"
+        with open(fdf_file_name, "w") as f:
+            f.write(fdf_text)
+
+    def _clean(self, path):
+        """ Removes files of the unfinished run which cannot be used for restart because the input has changed;
+        the density matrix of the run interrupted with the same input is kept to restart from it
+        """
+        manifest = self.read_manifest(path)
+        if manifest is None or manifest.get("input_hash") == self._hashes.get(path):
+            return
+        for ext in (".DM", ".out"):
+            file_name = os.path.join(path, self.element + ext)
+            if os.path.exists(file_name):
+                os.remove(file_name)
+
+    def read_manifest(self, path):
+        """ Returns the manifest of the run in path (dict with input hash, status, wall time etc.), or None
+        """
+        try:
+            with open(os.path.join(path, MANIFEST), "r") as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def _write_manifest(self, path, **data):
+        tmp = os.path.join(path, MANIFEST + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.rename(tmp, os.path.join(path, MANIFEST))
+
+    def job(self, alat=None):
+        """ Returns the job running SIESTA in the calculation directory for the given alat
+        """
+        monitor = None
+        if self.monitor_options is not None:
+            monitor = ScfMonitor(os.path.join(self._path(alat), self.element + ".out"), **self.monitor_options)
+        return Job([SIESTA_EXEC],
+                   cwd=self._path(alat),
+                   stdin=self.element + ".fdf",
+                   stdout=self.element + ".out",
+                   n_proc=self.n_proc,
+                   mpi=True,
+                   timeout=self.timeout,
+                   name="siesta",
+                   rlimits=self.rlimits,
+                   priority=self.priority,
+                   group=self.element,
+                   monitor=monitor,
+                   monitor_interval=self.monitor_interval)
 
-    def run(self):
-        path = "%.4f" % (self.siesta_calc["alat"],)
-        cwd = os.getcwd()
-        os.system('cd ' + path + '; mpirun -np 4 ' + SIESTA_EXEC + ' < ' + self.element + ".fdf" + ' | tee ' + self.element + '.out')
-        if self.check():
+    def submit(self, alat=None):
+        """ Starts SIESTA run for the given alat without waiting for it to finish
+        
+        Returns:
+            Future -- future of the SIESTA job
+        """
+        path = self._path(alat)
+        input_hash = self._hashes.get(path)
+        self._write_manifest(path, input_hash=input_hash, status="running")
+        future = self.backend.submit(self.job(alat))
+        future.add_done_callback(lambda f: self._finish(path, input_hash, f))
+        return future
+
+    def _finish(self, path, input_hash, future):
+        """ Marks the run as done if the final energy block is in the output, as pruned if it was cancelled
+        because the candidate cannot win, as failed otherwise
+        """
+        out_file = os.path.join(path, self.element + '.out')
+        out = read_output(out_file) if os.path.exists(out_file) else SiestaOutput()
+        final = out.final()
+        if final is not None:
+            status = "done"
+        elif future.reason is not None and future.reason.startswith("pruned"):
+            status = "pruned"
+        else:
+            status = "failed"
+        self._write_manifest(path,
+                             input_hash=input_hash,
+                             status=status,
+                             returncode=future.returncode,
+                             reason=future.reason,
+                             aborted=future.aborted,
+                             wall_time=future.wall_time,
+                             rusage=future.rusage,
+                             scf_steps=out.scf_steps,
+                             converged=out.converged,
+                             volume=out.volume,
+                             energy=out.energy)
+
+    def run(self, alat=None):
+        """ Runs SIESTA for the given alat and waits for it, returns the future of the job
+        """
+        future = self.submit(alat)
+        try:
+            future.result()
+        except JobError as e:
+            print "SiestaCalculation.run: {}".format(e)
+        if self.check(alat):
             self.is_run = True
-        os.chdir(cwd)
-
-    def check(self):
-        out_file = self.element + '.out'
-        # get files in path
-        path = "%.4f" % (self.siesta_calc["alat"],)
-        files = os.listdir(path)
-        # check if the calc succeeded 
-        if out_file in files:
-            return True
-        return False
-
-    def results(self):
-        out_file = self.element + '.out'
-        path = "%.4f" % (self.siesta_calc["alat"],)
-        if self.check():
-            with open(os.path.join(path, out_file), "r") as f:
-                lines = f.readlines()
-            final = False
-            for line in lines:
-                if "Cell volume" in line:
-                    vol = float(line.split()[-1])
-                if "Final energy" in line:
-                    final = True
-                if final and "Total" in line:
-                    energy = float(line.split()[3])
-                    final = False
-                    return np.array((vol, energy))
-        return None
\ No newline at end of file
+        return future
+
+    def check(self, alat=None):
+        """ Returns True if the run for alat is completed with the current input
+        """
+        path = self._path(alat)
+        manifest = self.read_manifest(path)
+        if manifest is None:
+            # the run made before manifests were written is considered complete if it has final energy
+            out_file = os.path.join(path, self.element + '.out')
+            return os.path.exists(out_file) and read_output(out_file).final() is not None
+        input_hash = self._hashes.get(path)
+        if input_hash is not None and manifest.get("input_hash") != input_hash:
+            return False
+        return manifest.get("status") == "done"
+
+    def results(self, alat=None):
+        path = self._path(alat)
+        if not self.check(alat):
+            return None
+        manifest = self.read_manifest(path)
+        if manifest is not None:
+            return np.array((manifest["volume"], manifest["energy"]))
+        return read_output(os.path.join(path, self.element + '.out')).final()
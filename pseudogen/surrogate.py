@@ -0,0 +1,221 @@
+"""
+surrogate.py contains Gaussian process model of delta factor as a function of pseudopotential radii,
+trained on the evaluations done before; it is used to skip SIESTA calculations for candidates
+which are unlikely to be better than the best one found so far
+"""
+
+import numpy as np
+from scipy.linalg import cho_solve, solve_triangular
+from scipy.optimize import minimize
+from fidelity import FULL
+
+
+class GaussianProcess(object):
+
+    def __init__(self, noise=1e-2, refit_every=10):
+        """ Gaussian process regression with RBF kernel with separate length scale for each coordinate;
+        hyperparameters are fitted by maximizing marginal likelihood every refit_every new points,
+        between refits the Cholesky factor is extended by one row per new point
+
+        Keyword Arguments:
+            noise {float} -- initial noise level relative to the signal (default: {1e-2})
+            refit_every {int} -- hyperparameters are refitted after this number of new points (default: {10})
+        """
+        self.refit_every = refit_every
+        self.X = np.zeros((0, 0))
+        self.y = np.zeros(0)
+        self._log_params = None
+        self._noise0 = noise
+        self._chol = None
+        self._n_fitted = 0
+
+    def __len__(self):
+        return len(self.y)
+
+    def _kernel(self, A, B, log_params=None):
+        log_params = self._log_params if log_params is None else log_params
+        length = np.exp(log_params[:-2])
+        signal = np.exp(2. * log_params[-2])
+        d = (A[:, None, :] - B[None, :, :]) / length
+        return signal * np.exp(-0.5 * np.sum(d * d, axis=2))
+
+    def _noise(self, log_params=None):
+        log_params = self._log_params if log_params is None else log_params
+        return np.exp(2. * log_params[-1]) + 1e-10
+
+    def _normalized(self):
+        mean, std = self.y.mean(), self.y.std() or 1.
+        return (self.y - mean) / std, mean, std
+
+    def _neg_log_likelihood(self, log_params, y):
+        """ Returns negative log marginal likelihood and its gradient with respect to log parameters
+        """
+        n = len(y)
+        Ks = self._kernel(self.X, self.X, log_params)
+        noise = self._noise(log_params)
+        try:
+            L = np.linalg.cholesky(Ks + noise * np.eye(n))
+        except np.linalg.LinAlgError:
+            return 1e10, np.zeros_like(log_params)
+        alpha = cho_solve((L, True), y)
+        nll = 0.5 * y.dot(alpha) + np.sum(np.log(np.diag(L)))
+        # dnll/dp = -1/2 tr((alpha alpha^T - K^-1) dK/dp)
+        W = np.outer(alpha, alpha) - cho_solve((L, True), np.eye(n))
+        length = np.exp(log_params[:-2])
+        grad = np.empty_like(log_params)
+        for i in range(len(length)):
+            d2 = ((self.X[:, None, i] - self.X[None, :, i]) / length[i]) ** 2
+            grad[i] = -0.5 * np.sum(W * Ks * d2)
+        grad[-2] = -np.sum(W * Ks)
+        grad[-1] = -np.trace(W) * (noise - 1e-10)
+        return nll, grad
+
+    def _refit(self):
+        y, _, _ = self._normalized()
+        n_dim = self.X.shape[1]
+        span = np.maximum(self.X.max(axis=0) - self.X.min(axis=0), 1e-2)
+        bounds = [(np.log(1e-3), np.log(1e2))] * n_dim + [(np.log(1e-2), np.log(1e2)), (np.log(1e-4), 0.)]
+        # the likelihood has local minima, several starting points are tried
+        starts = [np.concatenate((np.log(f * span), [0., np.log(self._noise0)])) for f in (0.1, 0.3, 1.)]
+        if self._log_params is not None and len(self._log_params) == n_dim + 2:
+            starts.append(self._log_params)
+        best = None
+        for start in starts:
+            res = minimize(self._neg_log_likelihood, start, args=(y,), jac=True, method="L-BFGS-B", bounds=bounds)
+            if best is None or res.fun < best.fun:
+                best = res
+        self._log_params = best.x
+        self._factorize()
+        self._n_fitted = len(self.y)
+
+    def _factorize(self):
+        K = self._kernel(self.X, self.X) + self._noise() * np.eye(len(self.y))
+        self._chol = np.linalg.cholesky(K)
+
+    def fit(self, X, y):
+        self.X = np.atleast_2d(np.asarray(X, dtype=float))
+        self.y = np.asarray(y, dtype=float)
+        if len(self.y):
+            self._refit()
+        return self
+
+    def add(self, x, y):
+        """ Adds one observation
+        """
+        x = np.asarray(x, dtype=float)[None, :]
+        if len(self.y) == 0:
+            return self.fit(x, [y])
+        self.X = np.vstack((self.X, x))
+        self.y = np.append(self.y, y)
+        if len(self.y) - self._n_fitted >= self.refit_every:
+            self._refit()
+            return self
+        # rank-one extension of the Cholesky factor
+        k = self._kernel(self.X[:-1], x)[:, 0]
+        l = solve_triangular(self._chol, k, lower=True)
+        d2 = self._kernel(x, x)[0, 0] + self._noise() - l.dot(l)
+        if d2 <= 1e-12:
+            self._factorize()
+            return self
+        n = len(self.y)
+        chol = np.zeros((n, n))
+        chol[:-1, :-1] = self._chol
+        chol[-1, :-1] = l
+        chol[-1, -1] = np.sqrt(d2)
+        self._chol = chol
+        return self
+
+    def predict(self, X):
+        """ Returns mean and standard deviation of the prediction for points X
+        """
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        y, mean, std = self._normalized()
+        alpha = cho_solve((self._chol, True), y)
+        Ks = self._kernel(X, self.X)
+        mu = Ks.dot(alpha)
+        v = solve_triangular(self._chol, Ks.T, lower=True)
+        var = np.exp(2. * self._log_params[-2]) - np.sum(v * v, axis=0)
+        return mu * std + mean, np.sqrt(np.maximum(var, 0.)) * std
+
+
+class Surrogate(object):
+
+    def __init__(self, min_points=10, kappa=2., refit_every=10):
+        """ Model of log(delta) as a function of radii
+
+        Keyword Arguments:
+            min_points {int} -- the model is used after this number of evaluations (default: {10})
+            kappa {float} -- candidate is screened out if its lower confidence bound, prediction - kappa * std,
+                             is above the best delta (default: {2.})
+            refit_every {int} -- hyperparameters are refitted after this number of new points (default: {10})
+        """
+        self.min_points = min_points
+        self.kappa = kappa
+        self.gp = GaussianProcess(refit_every=refit_every)
+        self.best = None
+        self._pending = []
+
+    @staticmethod
+    def _transform(delta):
+        return np.log(max(float(delta), 1e-3))
+
+    def add(self, radii, delta, rejected=None):
+        """ Adds evaluated candidate; the model is trained once min_points candidates are added.
+        Rejected candidates are skipped: their delta is the penalty, not the delta factor
+        """
+        if delta is None or rejected:
+            return
+        self.best = delta if self.best is None else min(self.best, delta)
+        if len(self.gp) == 0 and len(self._pending) + 1 < self.min_points:
+            self._pending.append((radii, delta))
+            return
+        if self._pending:
+            points = self._pending + [(radii, delta)]
+            self._pending = []
+            self.gp.fit([p[0] for p in points], [self._transform(p[1]) for p in points])
+        else:
+            self.gp.add(radii, self._transform(delta))
+
+    @property
+    def ready(self):
+        return len(self.gp) >= self.min_points
+
+    def predict(self, radii_list):
+        """ Returns predicted delta and its lower confidence bound for the radii
+        """
+        mu, sigma = self.gp.predict(radii_list)
+        return np.exp(mu), np.exp(mu - self.kappa * sigma)
+
+    def screen(self, radii_list):
+        """ Returns the list of flags: True if the candidate is worth evaluating; the candidate with
+        the lowest lower confidence bound is always evaluated, so that the model keeps learning
+        """
+        if not self.ready or self.best is None or not radii_list:
+            return [True] * len(radii_list)
+        _, lower = self.predict(radii_list)
+        keep = list(lower < self.best)
+        keep[int(np.argmin(lower))] = True
+        return keep
+
+
+def get_surrogate(settings, journal=None, results=None):
+    """ Returns Surrogate trained on the full fidelity journal records (or on the records of the results
+    database made with the same settings if there is no journal), or None if settings.surrogate is not set
+    """
+    if not getattr(settings, 'surrogate', False):
+        return None
+    surrogate = Surrogate(min_points=getattr(settings, 'surrogate_min_points', 10),
+                          kappa=getattr(settings, 'surrogate_kappa', 2.),
+                          refit_every=getattr(settings, 'surrogate_refit_every', 10))
+    if journal is not None:
+        records = [r for r in journal.records() if r.get("fidelity", FULL) == FULL]
+    elif results is not None:
+        conditions = {"element": settings.calc["element"], "fidelity": FULL}
+        if results.context is not None:
+            conditions["context"] = results.context
+        records = results.query(**conditions)
+    else:
+        records = []
+    for record in records:
+        surrogate.add(record["radii"], record["delta"], record.get("rejected"))
+    return surrogate
@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+
+"""
+timing.py records where the time of the candidates goes: wall time of every stage of evaluation
+(ATOM generation and test, prescreen, SIESTA runs, EOS fit) together with CPU time and peak memory
+of the jobs run by the stage, and of every job itself. Records are written as JSON lines to
+{work_dir}/{element}/timing.jsonl next to log.dat; summarize aggregates them per stage and per program
+for the candidate or the whole run. Run as a script to print the summary of a timing file:
+
+    python timing.py Al/timing.jsonl
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from contextlib import contextmanager
+from backend import add_submit_hook
+
+# the stage of the candidate evaluated by the thread, the jobs submitted by the thread are assigned to it
+_local = threading.local()
+
+_logs = {}
+_logs_lock = threading.Lock()
+
+
+class TimingLog(object):
+
+    def __init__(self, file_name):
+        """ Timing records of one element stored as JSON lines; several threads and processes
+        (e.g. workqueue workers) may append to the same file
+        """
+        self.file_name = file_name
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, sort_keys=True) + "\n"
+        with self._lock:
+            with open(self.file_name, "a") as f:
+                f.write(line)
+
+    def read(self, since=None):
+        """ Returns the records written after the time since (all records by default)
+        """
+        if not os.path.exists(self.file_name):
+            return []
+        records = []
+        with open(self.file_name, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if since is None or record.get("start", 0.) >= since:
+                    records.append(record)
+        return records
+
+
+def get_timing_log(settings, work_dir=None):
+    """ Returns TimingLog of the element in work_dir, or None if settings.timing is switched off
+    """
+    if not getattr(settings, 'timing', True):
+        return None
+    log_dir = os.path.join(os.path.abspath(work_dir or "."), settings.calc["element"])
+    if not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+    file_name = os.path.join(log_dir, "timing.jsonl")
+    with _logs_lock:
+        if file_name not in _logs:
+            _logs[file_name] = TimingLog(file_name)
+        return _logs[file_name]
+
+
+def job_record(future):
+    """ Returns timing record of the finished job
+    """
+    job = future.job
+    record = {"type": "job",
+              "name": job.name,
+              "program": os.path.basename(job.args[0]),
+              "cwd": job.cwd,
+              "n_proc": job.n_proc,
+              "start": future.start_time,
+              "wall": future.wall_time,
+              "returncode": future.returncode,
+              "reason": future.reason}
+    record.update(future.rusage or {})
+    return record
+
+
+class Stage(object):
+
+    def __init__(self, log, name, **context):
+        """ Stage of candidate evaluation; the jobs submitted by the thread while the stage is current
+        are recorded with the context of the stage (e.g. uuid of the candidate)
+        """
+        self.log = log
+        self.name = name
+        self.context = context
+        self.jobs = []
+        self._lock = threading.Lock()
+
+    def job_done(self, future):
+        record = job_record(future)
+        record.update(self.context, stage=self.name)
+        with self._lock:
+            self.jobs.append(record)
+        if self.log is not None:
+            self.log.write(record)
+
+    def record(self, start, wall):
+        """ Returns timing record of the stage with CPU time and peak memory of its jobs
+        """
+        with self._lock:
+            jobs = list(self.jobs)
+        record = dict(self.context,
+                      type="stage",
+                      stage=self.name,
+                      start=start,
+                      wall=wall,
+                      n_jobs=len(jobs),
+                      job_wall=sum(j["wall"] or 0. for j in jobs),
+                      utime=sum(j.get("utime", 0.) for j in jobs),
+                      stime=sum(j.get("stime", 0.) for j in jobs),
+                      maxrss=max([j.get("maxrss", 0.) for j in jobs] or [0.]))
+        return record
+
+
+def _on_submit(future):
+    stage = getattr(_local, "stage", None)
+    if stage is not None:
+        future.add_done_callback(stage.job_done)
+
+
+add_submit_hook(_on_submit)
+
+
+class CandidateTiming(object):
+
+    def __init__(self, log, uuid, radii, fidelity):
+        """ Timing of the stages of one candidate
+
+        Arguments:
+            log {TimingLog} -- log the records are written to, None to keep them in memory only
+            uuid {string} -- uuid of the candidate
+            radii {list} -- pseudopotential radii
+            fidelity {string} -- fidelity of SIESTA calculations
+        """
+        self.log = log
+        self.context = {"uuid": uuid, "fidelity": fidelity}
+        self.radii = radii
+        self.started = time.time()
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name):
+        """ Context of the stage: its wall time is measured and the jobs submitted in it are recorded
+        """
+        stage = Stage(self.log, name, **self.context)
+        previous = getattr(_local, "stage", None)
+        _local.stage = stage
+        start = time.time()
+        try:
+            yield stage
+        finally:
+            _local.stage = previous
+            record = stage.record(start, time.time() - start)
+            self.stages.append(record)
+            if self.log is not None:
+                self.log.write(record)
+
+    def finish(self, record):
+        """ Writes the summary of the candidate with the result of its evaluation, returns it
+        """
+        summary = dict(self.context,
+                       type="candidate",
+                       start=self.started,
+                       wall=time.time() - self.started,
+                       radii=self.radii,
+                       delta=record.get("delta"),
+                       rejected=record.get("rejected"),
+                       stages=dict((s["stage"], s["wall"]) for s in self.stages),
+                       n_jobs=sum(s["n_jobs"] for s in self.stages),
+                       utime=sum(s["utime"] for s in self.stages),
+                       stime=sum(s["stime"] for s in self.stages),
+                       maxrss=max([s["maxrss"] for s in self.stages] or [0.]))
+        if self.log is not None:
+            self.log.write(summary)
+        return summary
+
+    def report(self, summary):
+        """ Returns one-line report of the candidate summary
+        """
+        stages = ", ".join("{} {:.1f} s".format(s["stage"], s["wall"]) for s in self.stages)
+        return "Timing of {}: {:.1f} s ({}); jobs: {}, CPU {:.1f} s, max RSS {:.0f} MB".format(
+            summary["uuid"], summary["wall"], stages, summary["n_jobs"],
+            summary["utime"] + summary["stime"], summary["maxrss"])
+
+
+def _totals(records, key):
+    totals = {}
+    for record in records:
+        t = totals.setdefault(record[key], {"count": 0, "wall": 0., "cpu": 0., "maxrss": 0.})
+        t["count"] += 1
+        t["wall"] += record["wall"] or 0.
+        t["cpu"] += record.get("utime", 0.) + record.get("stime", 0.)
+        t["maxrss"] = max(t["maxrss"], record.get("maxrss", 0.))
+    return totals
+
+
+def summarize(records):
+    """ Aggregates timing records (of a run or of a whole file)
+
+    Returns:
+        dict -- number of candidates (and rejected ones), their total wall time, totals (count, wall time,
+                CPU time, peak RSS) per stage and per job program, and the time span of the records
+    """
+    candidates = [r for r in records if r.get("type") == "candidate"]
+    stages = [r for r in records if r.get("type") == "stage"]
+    jobs = [r for r in records if r.get("type") == "job"]
+    timed = [r for r in candidates + stages + jobs if r.get("start") is not None]
+    starts = [r["start"] for r in timed]
+    ends = [r["start"] + (r["wall"] or 0.) for r in timed]
+    return {"type": "run",
+            "start": min(starts) if starts else None,
+            "span": max(ends) - min(starts) if starts else 0.,
+            "n_candidates": len(candidates),
+            "n_rejected": len([r for r in candidates if r.get("rejected")]),
+            "candidate_wall": sum(r["wall"] for r in candidates),
+            "stages": _totals(stages, "stage"),
+            "programs": _totals(jobs, "program")}
+
+
+def report(summary):
+    """ Returns text report of the summary
+    """
+    lines = ["{} candidates ({} rejected) in {:.1f} s, {:.1f} s of candidate wall time".format(
+        summary["n_candidates"], summary["n_rejected"], summary["span"], summary["candidate_wall"])]
+    for title, totals in (("Stage", summary["stages"]), ("Program", summary["programs"])):
+        lines.append("{:14} {:>6} {:>10} {:>10} {:>10} {:>10}".format(title, "count", "wall, s", "mean, s",
+                                                                      "CPU, s", "RSS, MB"))
+        for name in sorted(totals, key=lambda n: -totals[n]["wall"]):
+            t = totals[name]
+            lines.append("{:14} {:6d} {:10.1f} {:10.2f} {:10.1f} {:10.0f}".format(
+                name, t["count"], t["wall"], t["wall"] / t["count"], t["cpu"], t["maxrss"]))
+    return "\n".join(lines)
+
+
+def log_run_summary(settings, work_dir, since, logger=None):
+    """ Writes the summary of the records made after since to the timing log and to the logger
+    """
+    log = get_timing_log(settings, work_dir)
+    if log is None:
+        return None
+    summary = summarize(log.read(since))
+    log.write(summary)
+    if logger is not None:
+        logger.info("Timing of the run:\n" + report(summary))
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prints timing summary of pseudopotential search")
+    parser.add_argument("file", help="timing file ({element}/timing.jsonl)")
+    parser.add_argument("--since", type=float, default=None, help="only records started after this unix time")
+    args = parser.parse_args(argv)
+    print report(summarize(TimingLog(args.file).read(args.since)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+
+"""
+workqueue.py distributes candidate evaluations (radii -> delta) between worker processes, possibly
+running on several nodes, through a queue directory on a shared filesystem. No external services are needed:
+
+ * tasks are JSON files in {queue}/pending, a worker claims a task by renaming it to {queue}/running
+   (rename is atomic, so every task is taken by one worker only);
+ * a worker touches its heartbeat file {queue}/workers/{worker id} while it is alive; tasks of workers
+   whose heartbeat is older than the timeout are moved back to pending (clocks of the nodes must be in sync);
+ * results are written to {queue}/done, where the coordinator picks them up;
+ * the coordinator writes the heartbeat timeout to {queue}/config.json, so that the workers use the same one.
+
+Workers are started with
+    python workqueue.py QUEUE_DIR [--max-tasks N] [--idle-exit SECONDS]
+and can be added or killed at any time.
+"""
+
+import os
+import json
+import time
+import uuid
+import socket
+import argparse
+import threading
+import traceback
+from fidelity import FULL
+
+DEFAULT_TIMEOUT = 120.
+
+
+class WorkQueue(object):
+
+    poll_interval = 0.5
+
+    def __init__(self, queue_dir, timeout=None):
+        """ Queue of tasks in a directory
+
+        Arguments:
+            queue_dir {string} -- queue directory, must be shared by the coordinator and the workers
+
+        Keyword Arguments:
+            timeout {float} -- tasks of the worker are requeued if its heartbeat is older than timeout seconds
+                               (default: {None}, the timeout written by the coordinator, see write_config,
+                               or 120 s if there is none)
+        """
+        self.queue_dir = os.path.abspath(queue_dir)
+        self._timeout = timeout
+        for d in ("pending", "running", "done", "workers"):
+            path = self._dir(d)
+            if not os.path.isdir(path):
+                try:
+                    os.makedirs(path)
+                except OSError:
+                    # made by another process
+                    pass
+
+    def _dir(self, name, file_name=""):
+        return os.path.join(self.queue_dir, name, file_name)
+
+    @property
+    def timeout(self):
+        if self._timeout is not None:
+            return self._timeout
+        # read every time, so that a worker started before the coordinator gets its timeout
+        try:
+            with open(os.path.join(self.queue_dir, "config.json"), "r") as f:
+                return float(json.load(f)["timeout"])
+        except (IOError, OSError, ValueError, KeyError):
+            return DEFAULT_TIMEOUT
+
+    def write_config(self):
+        """ Writes the timeout to the queue directory for the workers started without --timeout
+        """
+        self._write(os.path.join(self.queue_dir, "config.json"), {"timeout": self.timeout})
+
+    def _write(self, path, data):
+        tmp = os.path.join(os.path.dirname(path), ".{}.{}.tmp".format(os.path.basename(path), uuid.uuid4().hex[:8]))
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.rename(tmp, path)
+
+    @staticmethod
+    def _running_name(task_id, worker_id):
+        return "{}@{}".format(task_id, worker_id)
+
+    def submit(self, task):
+        """ Puts task (JSON-serializable dict) to the queue, returns its id
+        """
+        # ids start with submission time, so that tasks are taken in FIFO order
+        task_id = "{:013d}-{}".format(int(time.time() * 1000), uuid.uuid4().hex[:8])
+        self._write(self._dir("pending", task_id + ".json"), dict(task, id=task_id))
+        return task_id
+
+    def claim(self, worker_id):
+        """ Takes the oldest pending task for the worker, returns it or None if the queue is empty
+        """
+        for file_name in sorted(os.listdir(self._dir("pending"))):
+            if not file_name.endswith(".json") or file_name.startswith("."):
+                continue
+            task_id = file_name[:-5]
+            running = self._dir("running", self._running_name(task_id, worker_id))
+            try:
+                os.rename(self._dir("pending", file_name), running)
+            except OSError:
+                # taken by another worker
+                continue
+            with open(running, "r") as f:
+                return json.load(f)
+        return None
+
+    def finish(self, worker_id, task_id, result=None, error=None):
+        """ Stores result (or error message) of the task; if the task was requeued and another worker
+        has finished it already, its result is kept
+        """
+        done = self._dir("done", task_id + ".json")
+        if not os.path.exists(done):
+            self._write(done, {"id": task_id,
+                               "worker": worker_id,
+                               "result": result,
+                               "error": error})
+        for path in (self._dir("running", self._running_name(task_id, worker_id)),
+                     # the task may have been requeued if the heartbeat was late
+                     self._dir("pending", task_id + ".json")):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def heartbeat(self, worker_id):
+        path = self._dir("workers", worker_id)
+        if os.path.exists(path):
+            os.utime(path, None)
+        else:
+            self._write(path, {"host": socket.gethostname(), "pid": os.getpid()})
+
+    def requeue_stale(self):
+        """ Moves tasks of the workers with stale heartbeat back to pending, returns their ids
+        """
+        now = time.time()
+        requeued = []
+        busy = set()
+        for file_name in os.listdir(self._dir("running")):
+            if file_name.startswith("."):
+                continue
+            task_id, worker_id = file_name.split("@", 1)
+            busy.add(worker_id)
+            try:
+                alive = now - os.path.getmtime(self._dir("workers", worker_id)) < self.timeout
+            except OSError:
+                alive = False
+            if alive or os.path.exists(self._dir("done", task_id + ".json")):
+                continue
+            try:
+                os.rename(self._dir("running", file_name), self._dir("pending", task_id + ".json"))
+                requeued.append(task_id)
+            except OSError:
+                pass
+        # heartbeat files left by killed workers
+        for worker_id in os.listdir(self._dir("workers")):
+            path = self._dir("workers", worker_id)
+            try:
+                if worker_id not in busy and now - os.path.getmtime(path) > self.timeout:
+                    os.remove(path)
+            except OSError:
+                pass
+        return requeued
+
+    def result(self, task_id):
+        """ Returns (result, error) of the finished task and removes it from the queue, or None
+        """
+        path = self._dir("done", task_id + ".json")
+        if not os.path.exists(path):
+            return None
+        with open(path, "r") as f:
+            data = json.load(f)
+        os.remove(path)
+        return data["result"], data["error"]
+
+    def wait(self, task_ids):
+        """ Waits for the tasks, requeueing tasks of lost workers meanwhile
+
+        Returns:
+            list -- results of the tasks in the order of task_ids
+
+        Raises:
+            RuntimeError -- if any of the tasks failed
+        """
+        results = {}
+        last_check = time.time()
+        while len(results) < len(task_ids):
+            for task_id in task_ids:
+                if task_id not in results:
+                    r = self.result(task_id)
+                    if r is not None:
+                        results[task_id] = r
+            if time.time() - last_check > self.timeout / 2.:
+                self.requeue_stale()
+                last_check = time.time()
+            if len(results) < len(task_ids):
+                time.sleep(self.poll_interval)
+        errors = [results[task_id][1] for task_id in task_ids if results[task_id][1] is not None]
+        if errors:
+            raise RuntimeError("WorkQueue: {} task(s) failed, first error:\n{}".format(len(errors), errors[0]))
+        return [results[task_id][0] for task_id in task_ids]
+
+    def map_evaluate(self, settings, radii_list, fdf_file, work_dir, fidelity=FULL):
+        """ Evaluates candidates with radii from radii_list at the given fidelity on the workers,
+        returns their records
+        """
+        settings_file = os.path.abspath(settings.__file__)
+        if settings_file.endswith((".pyc", ".pyo")):
+            settings_file = settings_file[:-1]
+        task_ids = [self.submit({"kind": "evaluate",
+                                 "settings": settings_file,
+                                 "radii": list(radii),
+                                 "fdf_file": os.path.abspath(fdf_file),
+                                 "work_dir": os.path.abspath(work_dir),
+                                 "fidelity": fidelity})
+                    for radii in radii_list]
+        return self.wait(task_ids)
+
+
+def get_work_queue(settings):
+    """ Returns WorkQueue given by settings.work_queue directory, or None if candidates are evaluated locally
+    """
+    queue_dir = getattr(settings, 'work_queue', None)
+    if queue_dir is None:
+        return None
+    queue = WorkQueue(queue_dir, timeout=getattr(settings, 'work_queue_timeout', DEFAULT_TIMEOUT))
+    queue.write_config()
+    return queue
+
+
+class Worker(object):
+
+    def __init__(self, queue, worker_id=None):
+        """ Takes tasks from the queue and runs them one by one
+        """
+        self.queue = queue
+        self.worker_id = worker_id or "{}-{}-{}".format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:4])
+        self._settings = {}
+        self._stop = threading.Event()
+
+    def _beat(self):
+        while not self._stop.wait(self.queue.timeout / 4.):
+            try:
+                self.queue.heartbeat(self.worker_id)
+            except (IOError, OSError) as e:
+                print "Worker {}: heartbeat failed: {}".format(self.worker_id, e)
+
+    def _load_settings(self, file_name):
+        if file_name not in self._settings:
+            # imported here, so that the queue itself does not depend on the calculation modules
+            from campaign import load_settings
+            self._settings[file_name] = load_settings(file_name)
+        return self._settings[file_name]
+
+    def execute(self, task):
+        if task["kind"] != "evaluate":
+            raise ValueError("Worker: unknown task kind {}".format(task["kind"]))
+        from cache import get_pseudo_cache
+        from evaluate import evaluate
+        from results import get_results_store
+        settings = self._load_settings(task["settings"])
+        # relative paths in the settings (reference data, caches, results database) are resolved
+        # in the working directory of the coordinator
+        return evaluate(settings, task["radii"], task["fdf_file"],
+                        cache=get_pseudo_cache(settings, task["work_dir"]),
+                        results=get_results_store(settings, task["work_dir"], task["fdf_file"]),
+                        work_dir=task["work_dir"],
+                        fidelity=task.get("fidelity", FULL))
+
+    def run(self, max_tasks=None, idle_exit=None):
+        """ Runs tasks until max_tasks are done or the queue is empty for idle_exit seconds
+        """
+        self.queue.heartbeat(self.worker_id)
+        beat = threading.Thread(target=self._beat)
+        beat.daemon = True
+        beat.start()
+        n_tasks = 0
+        idle_since = time.time()
+        try:
+            while max_tasks is None or n_tasks < max_tasks:
+                task = self.queue.claim(self.worker_id)
+                if task is None:
+                    if idle_exit is not None and time.time() - idle_since > idle_exit:
+                        break
+                    self.queue.requeue_stale()
+                    time.sleep(self.queue.poll_interval)
+                    continue
+                print "Worker {}: task {}".format(self.worker_id, task["id"])
+                try:
+                    self.queue.finish(self.worker_id, task["id"], result=self.execute(task))
+                except Exception:
+                    self.queue.finish(self.worker_id, task["id"], error=traceback.format_exc())
+                n_tasks += 1
+                idle_since = time.time()
+        finally:
+            self._stop.set()
+            beat.join()
+            try:
+                os.remove(self.queue._dir("workers", self.worker_id))
+            except OSError:
+                pass
+        return n_tasks
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Runs candidate evaluations from the work queue")
+    parser.add_argument("queue_dir", help="queue directory (settings.work_queue of the coordinator)")
+    parser.add_argument("--max-tasks", type=int, default=None, help="exit after this number of tasks")
+    parser.add_argument("--idle-exit", type=float, default=None,
+                        help="exit if there are no tasks for this number of seconds")
+    parser.add_argument("--timeout", type=float, default=None,
+                        help="heartbeat timeout, s (default: work_queue_timeout of the coordinator)")
+    args = parser.parse_args(argv)
+    worker = Worker(WorkQueue(args.queue_dir, timeout=args.timeout))
+    print "Worker {}: {} tasks done".format(worker.worker_id, worker.run(args.max_tasks, args.idle_exit))
+
+
+if __name__ == "__main__":
+    main()
@@ -22,10 +22,85 @@ calc = {"element": element,
 # number of points to calculate BM EOS (odd value)
 volumes = 3
 
+# adaptive EOS sampling: start with eos_initial_points volumes and add eos_points_per_step points
+# around the fitted V0 until BM fit residual and jackknife errors of V0, B0 (relative) and B1 (absolute)
+# are within tolerances, or eos_max_points are calculated
+# adaptive_eos = True
+# eos_initial_points = 5
+# eos_points_per_step = 2
+# eos_max_points = 9
+# eos_residual_tol = 1e-4
+# eos_v0_tol = 1e-3
+# eos_b0_tol = 1e-2
+# eos_b1_tol = 0.1
+
 # pseudopotential parameters
 electrons = [2, 2]
 radii = [1.54, 1.54, 1.54, 1.54, -1.0]
 
+# SIESTA parallelization: MPI ranks per SIESTA run and total number of cores
+# for running the volume points concurrently (volume points are run one by one if not set)
+siesta_np = 4
+# n_cores = 64
+
+# execution backend: 'local', 'dry-run' (print SIESTA commands only, ATOM is run) or 'fake' (fake_siesta.py instead of SIESTA),
+# MPI launcher and its options, SIESTA run time (s) and memory (MB) limits
+# backend = 'local'
+# mpirun = 'mpirun'
+# mpi_options = '--bind-to core'
+# siesta_timeout = 36000
+# siesta_mem_limit = 4096
+
+# relative paths below are resolved against the working directory of the search (work_dir of minimize_delta
+# and find_pseudo, the campaign directory), not against the current directory of the process
+# cache of generated pseudopotentials and all-electron test references (switched off if not set), size in MB
+# pseudo_cache_dir = "pseudo_cache"
+# pseudo_cache_size = 500
+
+# reuse all-electron excitation energies of the test configurations (in this process and in the cache) and run
+# only the pseudopotential part of pt.sh; off by default until pt.sh output without the all-electron part is
+# checked against recorded ATOM runs (the parser is tested on synthetic outputs only)
+# reuse_ae_reference = True
+
+# journal of finished evaluations used to restart minimization
+# (default: {element}/journal.dat, None switches journaling off);
+# radii differing by less than journal_tol are considered equal; records made with other settings
+# (see journal.CONTEXT_SETTINGS) are not reused
+# journal_file = "C/journal.dat"
+# journal_tol = 1e-5
+
+# reference EOS data for delta factor (default: delta/WIEN2k.txt); several reference codes may be given
+# as {code: file name}, then delta factor is calculated with respect to reference_code and logged for the others
+# reference_file = "delta/WIEN2k.txt"
+# reference_files = {"WIEN2k": "delta/WIEN2k.txt", "VASP": "delta/VASP.txt"}
+# reference_code = "WIEN2k"
+
+# SQLite database of all evaluations (radii, ATOM errors, EOS points and fit, delta, timings),
+# queried with results.ResultsStore, e.g. ResultsStore("results.db").best("C", 10, max_err_max=1e-3)
+# (default: results.db in the working directory, None switches it off); evaluations are stored with the hash
+# of the settings (see journal.settings_hash) in the context column
+# results_db = "results.db"
+
+# thresholds on ATOM errors (Ry): pseudopotentials exceeding them are rejected before
+# SIESTA calculations, and penalty (times the largest error to threshold ratio) is returned instead of delta
+# max_err_pseudo = 1e-3
+# max_err_mean = 5e-3
+# max_err_max = 1e-2
+# penalty = 100.
+
+# campaign.py runs several elements in one process with a shared core budget
+# (e.g. python campaign.py -n 32 settings_Al settings_C settings_Fe): jobs of elements with higher priority
+# are started first, cores are shared between elements of equal priority in proportion to share;
+# SIESTA fdf template of the element (default siesta.fdf) and the number of radii optimized
+# starting from radii (default 2)
+# priority = 0
+# share = 1.
+# fdf_file = "siesta.fdf"
+# n_optimized = 2
+
+# start SIESTA runs from density matrices of the previous candidate or of the finished volume points
+# dm_warm_start = True
+
 # SIESTA calculation parameters
 siesta_calc = {"element": element,
                "title": element + " SIESTA calc",
@@ -45,4 +120,94 @@ configs = [[1.5, 2.5],
 eps = 0.05
 method = 'CG'
 tolerance = 1e-2
-min_options = {'disp': True}
\ No newline at end of file
+min_options = {'disp': True}
+# evaluate gradient points in a pipeline: ATOM generation and test of the next candidates overlaps
+# SIESTA runs of the previous ones; pipeline_max_pending candidates may wait for SIESTA
+# (also used by find_pseudo if radii is a list of radii sets)
+# pipeline = True
+# pipeline_atom_workers = 1
+# pipeline_siesta_workers = 2
+# pipeline_max_pending = 2
+
+# evaluate candidates by workers taking tasks from work_queue directory on a shared filesystem
+# (started on any node as python workqueue.py QUEUE_DIR); tasks of a worker which has not
+# updated its heartbeat for work_queue_timeout seconds are given to other workers (the timeout is written
+# to the queue directory and used by the workers started without --timeout)
+# work_queue = "/shared/scratch/queue"
+# work_queue_timeout = 120.
+# optimizer = "population" minimizes delta by CMA-ES instead of scipy.optimize.minimize: each generation
+# of population_size candidates (default 4 + 3 ln(number of optimized radii)) is evaluated concurrently;
+# population_sigma is the initial step (Bohr), optimized radii are kept within radii_bounds
+# optimizer = "population"
+# population_size = 16
+# population_sigma = 0.1
+# max_generations = 50
+# radii_bounds = (1.0, 3.5)
+# population_xtol = 1e-3
+# population_seed = 0
+
+# Gaussian process model of log(delta) trained on the journal (or results database records made with the same
+# settings) and updated with every evaluation, rejected candidates are left out; once it has surrogate_min_points points, a candidate is not evaluated (its predicted delta is
+# used instead) if the lower confidence bound, prediction - surrogate_kappa * std, is above the best delta;
+# used by the population search only, finite difference gradients need computed values of all points
+# surrogate = True
+# surrogate_min_points = 10
+# surrogate_kappa = 2.
+# surrogate_refit_every = 10
+
+# descriptors of the generated psf file computed before SIESTA runs and stored with the results: mesh cutoff
+# estimated from the Fourier tail of the charge density (est_cutoff, Ry, |rho(q)| / rho(0) < descriptor_tol beyond it),
+# angular momenta with ghost states of Kleinman-Bylander form (ghosts, Gonze-Stumpf-Scheffler test with LDA
+# screening and the highest-l potential as the local one) and the largest pseudization radius over half
+# of the nearest-neighbour distance at the smallest volume (core_overlap); the candidate is rejected (and penalty
+# is returned) if a descriptor exceeds its threshold, or if it has ghost states and reject_ghosts is set
+# psf_descriptors = True
+# descriptor_tol = 1e-3
+# max_est_cutoff = 500.
+# max_core_overlap = 1.2
+# reject_ghosts = True
+
+# converge MeshCutoff for every pseudopotential: SIESTA is run at the lattice constant of calc at increasing
+# mesh_cutoffs (Ry) until the energy changes by less than mesh_cutoff_tol (eV/atom), the lowest converged cutoff
+# replaces MeshCutoff of the fdf template in the EOS runs (at full fidelity); converged cutoffs are stored
+# in the pseudopotential cache
+# mesh_cutoff_convergence = True
+# mesh_cutoffs = [100., 150., 200., 250., 300., 400.]
+# mesh_cutoff_tol = 1e-3
+
+# follow SIESTA output while the runs go on (every scf_monitor_interval s) and kill the run if SCF diverges
+# (dDmax of the last scf_divergence_steps steps is scf_divergence_factor times larger than its minimum before)
+# or stagnates (dDmax has not decreased in scf_stagnation_steps steps); the candidate is rejected with penalty
+# scf_monitor = True
+# scf_monitor_interval = 2.
+# scf_divergence_factor = 10.
+# scf_divergence_steps = 5
+# scf_stagnation_steps = 50
+
+# stop SIESTA runs of the candidate when delta estimated from its prune_min_points (or more, at least 2) finished
+# volumes is more than prune_factor times the best delta found so far (2 points: EOS of the reference shape through
+# them, 3 or more: fitted parabola); the remaining runs are cancelled (status "pruned" in their manifests) and the
+# candidate is rejected with the estimated delta instead of penalty (so that finite difference gradients stay
+# meaningful). prune_min_points must be less than volumes, otherwise no run is left to stop
+# prune_factor = 3.
+# prune_min_points = 2
+
+# timing of every stage of candidate evaluation (ATOM generation and test, prescreen, SIESTA, fit) and of every
+# job (wall time, CPU time and peak RSS) is written as JSON lines to {element}/timing.jsonl next to log.dat,
+# with the summary per candidate and per run (also logged); print the summary by python timing.py {element}/timing.jsonl
+# timing = False
+
+# multi-fidelity evaluation: a batch of candidates (a generation of the population search or a list
+# of radii in find_pseudo) is first calculated with the fdf options replaced by screening["fdf"] (value
+# of a block is the list of its rows) at screening["volumes"] volume points, then the best screening["promote"]
+# fraction of the batch is calculated with the fdf template as is; the fidelity of every evaluation is
+# recorded in the results database and in the journal
+# screening = {"fdf": {"MeshCutoff": "200. Ry",
+#                      "kgrid_Monkhorst_Pack": [[5, 0, 0, 0.], [0, 5, 0, 0.], [0, 0, 5, 0.]]},
+#              "volumes": 3,
+#              "promote": 0.25}
+
+# evaluate finite difference gradient points concurrently in n_workers threads
+# (default: number of optimized radii + 1); ignored for the methods not using the gradient (e.g. Nelder-Mead)
+# parallel_gradient = True
+# n_workers = 3
\ No newline at end of file
@@ -0,0 +1,133 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "pseudogen"))
+
+from backend import Job, JobError, LocalBackend, FakeBackend
+from siesta import read_output
+
+
+class LocalBackendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.order_file = os.path.join(self.work_dir, "order")
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def job(self, name, **kwargs):
+        """ Job appending its name to the order file
+        """
+        return Job(["sh", "-c", "echo {} >> {}".format(name, self.order_file)], name=name, **kwargs)
+
+    def order(self):
+        with open(self.order_file) as f:
+            return f.read().split()
+
+    def test_priority(self):
+        backend = LocalBackend(n_cores=1)
+        blocker = backend.submit(Job(["sleep", "0.3"]))
+        futures = [backend.submit(self.job("low")),
+                   backend.submit(self.job("high", priority=1)),
+                   backend.submit(self.job("low2"))]
+        for future in [blocker] + futures:
+            self.assertEqual(future.result(), 0)
+        # higher priority first, FIFO among equal ones
+        self.assertEqual(self.order(), ["high", "low", "low2"])
+
+    def test_fair_share(self):
+        backend = LocalBackend(n_cores=2)
+        blocker = backend.submit(Job(["sleep", "0.3"], group="Ge"))
+        busy = backend.submit(Job(["sleep", "0.3"], group="Ge"))
+        futures = [backend.submit(self.job("Ge", group="Ge")),
+                   backend.submit(self.job("Si", group="Si"))]
+        # no cores left for the pending jobs
+        self.assertFalse(any(future.running() or future.done() for future in futures))
+        for future in [blocker, busy] + futures:
+            future.result()
+        # Ge uses a core when one is freed, so Si goes first
+        self.assertEqual(self.order()[0], "Si")
+
+    def test_core_budget(self):
+        backend = LocalBackend(n_cores=2)
+        t0 = time.time()
+        futures = [backend.submit(Job(["sleep", "0.2"], n_proc=2)) for _ in range(2)]
+        for future in futures:
+            future.result()
+        self.assertGreaterEqual(futures[1].start_time, futures[0].end_time)
+        self.assertGreaterEqual(time.time() - t0, 0.4)
+
+    def test_timeout(self):
+        backend = LocalBackend()
+        future = backend.submit(Job(["sleep", "10"], timeout=0.2))
+        with self.assertRaises(JobError) as cm:
+            future.result()
+        self.assertIn("timed out", str(cm.exception))
+        self.assertLess(future.wall_time, 5.)
+        self.assertFalse(future.aborted)
+
+    def test_monitor(self):
+        backend = LocalBackend()
+        future = backend.submit(Job(["sleep", "10"], monitor=lambda: "SCF diverges", monitor_interval=0.1))
+        with self.assertRaises(JobError) as cm:
+            future.result()
+        self.assertIn("SCF diverges", str(cm.exception))
+        self.assertTrue(future.aborted)
+
+    def test_exit_code(self):
+        backend = LocalBackend()
+        future = backend.submit(Job(["sh", "-c", "exit 3"]))
+        self.assertTrue(future.wait())
+        self.assertTrue(future.failed())
+        self.assertEqual(future.returncode, 3)
+
+    def test_rusage(self):
+        # CPU time of the child is reported by wait4
+        backend = LocalBackend()
+        future = backend.submit(Job([sys.executable, "-c", "sum(i * i for i in xrange(3000000))"]))
+        future.result()
+        self.assertGreater(future.rusage["utime"] + future.rusage["stime"], 0.)
+        self.assertGreater(future.rusage["maxrss"], 0.)
+        # the killed process is reaped by wait4 as well
+        future = backend.submit(Job(["sleep", "10"], timeout=0.1))
+        self.assertTrue(future.wait())
+        self.assertEqual(future.returncode, -9)
+        self.assertIsNotNone(future.rusage)
+
+    def test_cancel_pending(self):
+        backend = LocalBackend(n_cores=1)
+        blocker = backend.submit(Job(["sleep", "0.2"]))
+        future = backend.submit(self.job("cancelled"))
+        self.assertTrue(future.cancel())
+        blocker.result()
+        self.assertTrue(future.failed())
+        self.assertFalse(os.path.exists(self.order_file))
+
+
+class FakeBackendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_siesta(self):
+        with open(os.path.join(self.work_dir, "siesta.fdf"), "w") as f:
+            f.write("SystemLabel Ge\nLatticeConstant 2.0 Ang\n"
+                    "%block LatticeVectors\n1. 0. 0.\n0. 1. 0.\n0. 0. 1.\n%endblock LatticeVectors\n")
+        backend = FakeBackend()
+        job = Job(["siesta"], cwd=self.work_dir, stdin="siesta.fdf", stdout="siesta.out", name="siesta")
+        self.assertEqual(backend.run(job), 0)
+        out = read_output(os.path.join(self.work_dir, "siesta.out"))
+        self.assertTrue(out.completed)
+        self.assertAlmostEqual(out.volume, 8.)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "pseudogen"))
+
+from cache import PseudoCache, program_identity, get_pseudo_cache
+
+
+class PseudoCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.src_dir = os.path.join(self.work_dir, "src")
+        self.dest_dir = os.path.join(self.work_dir, "dest")
+        os.makedirs(self.src_dir)
+        os.makedirs(self.dest_dir)
+        self.program = os.path.join(self.work_dir, "atm")
+        with open(self.program, "w") as f:
+            f.write("binary")
+        # room for two entries of 1000 bytes
+        self.cache = PseudoCache(os.path.join(self.work_dir, "cache"), max_size=2500. / 1024 ** 2)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def put(self, text, err=0.1):
+        with open(os.path.join(self.src_dir, "Ge.psf"), "w") as f:
+            f.write(text[0] * 1000)
+        key = self.cache.key(text, self.program)
+        self.cache.put(key, ["Ge.psf"], err, src_dir=self.src_dir)
+        return key
+
+    def test_get(self):
+        key = self.put("a", err=0.25)
+        self.assertEqual(self.cache.get(key, ["Ge.psf"], dest_dir=self.dest_dir), 0.25)
+        with open(os.path.join(self.dest_dir, "Ge.psf")) as f:
+            self.assertEqual(f.read(), "a" * 1000)
+        self.assertIsNone(self.cache.get(self.cache.key("b", self.program), ["Ge.psf"], dest_dir=self.dest_dir))
+
+    def test_key(self):
+        key = self.cache.key("a", self.program)
+        self.assertNotEqual(key, self.cache.key("b", self.program))
+        # recompiled ATOM invalidates the cache
+        with open(self.program, "w") as f:
+            f.write("another binary")
+        later = time.time() + 10.
+        os.utime(self.program, (later, later))
+        self.assertNotEqual(key, self.cache.key("a", self.program))
+        self.assertEqual(program_identity(self.program), program_identity(self.program))
+
+    def test_eviction(self):
+        keys = []
+        for i, text in enumerate(("a", "b")):
+            keys.append(self.put(text))
+            # mtime resolution may be coarse, order entries explicitly
+            os.utime(self.cache._entry(keys[-1]), (1000. + i, 1000. + i))
+        # reading the oldest entry marks it as recently used
+        self.assertIsNotNone(self.cache.get(keys[0], ["Ge.psf"], dest_dir=self.dest_dir))
+        keys.append(self.put("c"))
+        self.assertIsNotNone(self.cache.get(keys[0], ["Ge.psf"], dest_dir=self.dest_dir))
+        self.assertIsNone(self.cache.get(keys[1], ["Ge.psf"], dest_dir=self.dest_dir))
+        self.assertIsNotNone(self.cache.get(keys[2], ["Ge.psf"], dest_dir=self.dest_dir))
+
+    def test_array(self):
+        self.assertIsNone(self.cache.get_array("ae"))
+        array = np.linspace(0., 1., 1000)
+        self.cache.put_array("ae", array)
+        np.testing.assert_array_equal(self.cache.get_array("ae"), array)
+        # arrays are not counted as entries and are never evicted
+        for text in ("a", "b", "c"):
+            self.put(text)
+        np.testing.assert_array_equal(self.cache.get_array("ae"), array)
+
+
+class GetPseudoCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_settings(self):
+        class Settings(object):
+            pass
+        settings = Settings()
+        self.assertIsNone(get_pseudo_cache(settings, self.work_dir))
+        settings.pseudo_cache_dir = "cache"
+        settings.pseudo_cache_size = 10
+        cache = get_pseudo_cache(settings, self.work_dir)
+        self.assertEqual(cache.cache_dir, os.path.join(os.path.abspath(self.work_dir), "cache"))
+        self.assertEqual(cache.max_size, 10 * 1024 * 1024)
+
+
+if __name__ == "__main__":
+    unittest.main()
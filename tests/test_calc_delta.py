@@ -0,0 +1,106 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "pseudogen"))
+
+from calc_delta import estimate_delta, _bm_energy, calcDelta, echarge, BM, BM_batch, DeltaCalculation
+
+
+def eos(v0, b0=100., b1=4.5):
+    return np.core.records.fromrecords([("X", v0, b0, b1)], names=('element', 'V0', 'B0', 'BP'))
+
+
+class EstimateDeltaTest(unittest.TestCase):
+    """ Delta factor estimated from the points of the candidate EOS which differs from the reference in V0 only
+    """
+
+    def setUp(self):
+        self.ref = eos(12.)
+        self.volumes = np.array([11.5, 12., 12.5])
+
+    def points(self, v0):
+        return self.volumes, np.array([_bm_energy(v, v0, 100. / (echarge * 1.0e21), 4.5) for v in self.volumes])
+
+    def test_two_points(self):
+        # two volumes are enough to prune a candidate with volumes = 3
+        for v0 in (11.5, 12., 12.3):
+            volumes, energies = self.points(v0)
+            delta = calcDelta(eos(v0), self.ref, False)[0]
+            self.assertAlmostEqual(estimate_delta(volumes[:2], energies[:2], self.ref), delta, places=3)
+
+    def test_three_points(self):
+        volumes, energies = self.points(12.3)
+        delta = calcDelta(eos(12.3), self.ref, False)[0]
+        self.assertAlmostEqual(estimate_delta(volumes, energies, self.ref), delta, delta=0.2 * delta)
+
+    def test_no_minimum(self):
+        volumes, energies = self.points(20.)
+        self.assertIsNone(estimate_delta(volumes[:2], energies[:2], self.ref))
+
+
+class BMBatchTest(unittest.TestCase):
+
+    def test_three_points(self):
+        # second order EOS (B1 = 4) is exact for 3 points
+        volumes = np.array([[11.5, 12., 12.5]])
+        energies = np.array([[_bm_energy(v, 12.2, 0.6, 4.) for v in volumes[0]]])
+        v0, b0, b1, _, failed = BM_batch(volumes, energies)
+        self.assertFalse(failed[0])
+        self.assertAlmostEqual(v0[0], 12.2)
+        self.assertAlmostEqual(b0[0], 0.6)
+        self.assertAlmostEqual(b1[0], 4.)
+
+    def test_failure_mask(self):
+        volumes = np.tile(np.linspace(11.4, 12.6, 7), (2, 1))
+        energies = np.array([[_bm_energy(v, 12., 0.6, 4.5) for v in volumes[0]]])
+        v0, _, _, _, failed = BM_batch(volumes, np.vstack((energies, -energies)))
+        self.assertEqual(list(failed), [False, True])
+        self.assertAlmostEqual(v0[0], 12.)
+
+
+class Settings(object):
+    calc = {"element": "X", "nat": 1}
+    timing = False
+
+
+class GetDeltaTest(unittest.TestCase):
+    """ EOS fit of the volume points of the candidate and its delta factor
+    """
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.settings = Settings()
+        self.settings.reference_file = os.path.join(self.work_dir, "WIEN2k.txt")
+        with open(self.settings.reference_file, "w") as f:
+            f.write("X 12.0 100.0 4.5\n")
+        self.delta_calc = DeltaCalculation(self.settings, "test", work_dir=self.work_dir)
+        self.delta_calc.volumes = np.linspace(11.4, 12.6, 7)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_delta(self):
+        b0 = 100. / (echarge * 1.0e21)
+        self.delta_calc.energies = np.array([_bm_energy(v, 12.3, b0, 4.5) for v in self.delta_calc.volumes])
+        self.delta_calc.get_delta()
+        self.assertIsNone(self.delta_calc.aborted)
+        self.assertAlmostEqual(self.delta_calc.v0, 12.3)
+        self.assertAlmostEqual(self.delta_calc.b0, 100., places=4)
+        self.assertAlmostEqual(self.delta_calc.delta, calcDelta(eos(12.3), eos(12.), False)[0])
+
+    def test_no_minimum(self):
+        # the process must not exit: the candidate is rejected instead
+        b0 = 100. / (echarge * 1.0e21)
+        self.delta_calc.energies = np.array([-_bm_energy(v, 12., b0, 4.5) for v in self.delta_calc.volumes])
+        self.delta_calc.get_delta()
+        self.assertIsNotNone(self.delta_calc.aborted)
+        with self.assertRaises(ValueError):
+            BM(np.vstack((self.delta_calc.volumes, self.delta_calc.energies)).T)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "pseudogen"))
+
+from evaluate import Candidate
+from calc_delta import _bm_energy, _best_deltas, update_best_delta, calcDelta, echarge
+
+
+def eos(v0):
+    return np.core.records.fromrecords([("X", v0, 100., 4.5)], names=('element', 'V0', 'B0', 'BP'))
+
+
+class Settings(object):
+    calc = {"element": "X", "nat": 1}
+    timing = False
+    penalty = 50.
+
+
+class FitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.candidate = Candidate(Settings(), [1.5, 2., 2., 2., 1.], work_dir=self.work_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_no_minimum_rejected(self):
+        delta_calc = self.candidate.delta_calc
+        delta_calc.volumes = np.linspace(11.4, 12.6, 7)
+        # upside-down EOS
+        delta_calc.energies = np.array([-_bm_energy(v, 12., 0.6, 4.5) for v in delta_calc.volumes])
+        self.candidate.fit()
+        record = self.candidate.finish()
+        self.assertTrue(record["rejected"])
+        self.assertEqual(record["delta"], 50.)
+
+
+class FakeSiestaCalculation(object):
+
+    def __init__(self, points):
+        self.points = points
+
+    def results(self, alat):
+        return self.points.get(alat)
+
+
+class PruneTest(unittest.TestCase):
+    """ Pruned candidate, e.g. the gradient neighbour of the current point, gets its estimated delta
+    instead of the flat penalty, so that the finite difference gradient stays finite
+    """
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        settings = Settings()
+        settings.prune_factor = 1.5
+        settings.reference_file = os.path.join(self.work_dir, "WIEN2k.txt")
+        with open(settings.reference_file, "w") as f:
+            f.write("X 12.0 100.0 4.5\n")
+        self.candidate = Candidate(settings, [1.6, 2., 2., 2., 1.], work_dir=self.work_dir)
+        update_best_delta("X", 1.)
+
+    def tearDown(self):
+        _best_deltas.pop("X", None)
+        shutil.rmtree(self.work_dir)
+
+    def test_pruned_delta(self):
+        delta_calc = self.candidate.delta_calc
+        b0 = 100. / (echarge * 1.0e21)
+        points = dict((v, (v, _bm_energy(v, 12.5, b0, 4.5))) for v in (11.5, 12.))
+
+        def run_calcs(fdf_file, fidelity):
+            # two of three volumes have finished
+            delta_calc._check_run(FakeSiestaCalculation(points), [11.5, 12., 12.5])
+
+        delta_calc.run_calcs = run_calcs
+        self.candidate.run_siesta(None)
+        self.candidate.fit()
+        record = self.candidate.finish()
+        self.assertTrue(record["rejected"].startswith("pruned"))
+        self.assertAlmostEqual(record["delta"], calcDelta(eos(12.5), eos(12.), False)[0], places=3)
+        self.assertLess(record["delta"], Settings.penalty)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "pseudogen"))
+
+import generate
+from generate import read_excitations, PTInputFile
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+
+class ReadExcitationsTest(unittest.TestCase):
+
+    def test_ae_and_ps_series(self):
+        ae, ps = read_excitations(os.path.join(DATA_DIR, "pt_ae_ps.OUT"), 3)
+        self.assertAlmostEqual(ae[2, 1], 0.5266)
+        self.assertAlmostEqual(ae[1, 2], 0.5266)
+        self.assertAlmostEqual(ps[2, 0], 0.9771)
+        self.assertTrue(np.all(np.diag(ps) == 0.))
+
+    def test_ps_only_series(self):
+        # the fixtures are synthetic outputs in the layout of ATOM; the layout of the run with all-electron
+        # reference taken from cache is not checked against a recorded run, so reusing it is off by default
+        series = read_excitations(os.path.join(DATA_DIR, "pt_ps.OUT"), 3)
+        self.assertEqual(len(series), 1)
+        full = read_excitations(os.path.join(DATA_DIR, "pt_ae_ps.OUT"), 3)
+        np.testing.assert_array_equal(series[0], full[1])
+
+
+class AEReferenceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        open(os.path.join(self.work_dir, "C.ca.pg.vps"), "w").close()
+
+    def tearDown(self):
+        generate._ae_references.clear()
+        shutil.rmtree(self.work_dir)
+
+    def input_text(self, **kwds):
+        pt = PTInputFile("C", 1, 2, work_dir=self.work_dir, **kwds)
+        for electrons in ([2, 2], [1, 3]):
+            pt.add_configuration(electrons)
+        # the all-electron reference of the same configurations was calculated before
+        pt._ae_reference()
+        generate._ae_references[pt._ae_key] = np.zeros((2, 2))
+        pt._pre_execute()
+        with open(os.path.join(self.work_dir, pt._file_name)) as f:
+            return f.read()
+
+    def test_not_reused_by_default(self):
+        self.assertEqual(self.input_text().count("   ae "), 2)
+
+    def test_reused(self):
+        self.assertEqual(self.input_text(reuse_ae=True).count("   ae "), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
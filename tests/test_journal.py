@@ -0,0 +1,57 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "pseudogen"))
+
+from journal import Journal, settings_hash
+
+
+class Settings(object):
+    calc = {"element": "X", "nat": 1}
+    electrons = [2, 2]
+    configs = []
+    volumes = 7
+
+
+class SettingsHashTest(unittest.TestCase):
+    """ Records made with settings changing the evaluation are not replayed
+    """
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.fdf_file = os.path.join(self.work_dir, "siesta.fdf")
+        with open(self.fdf_file, "w") as f:
+            f.write("SystemLabel X\n")
+        self.settings = Settings()
+        self.context = settings_hash(self.settings, self.fdf_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_changed(self):
+        for name, value in (("max_err_max", 1e-2), ("penalty", 50.), ("adaptive_eos", True),
+                            ("mesh_cutoff_convergence", True), ("prune_factor", 3.), ("prune_min_points", 3)):
+            settings = Settings()
+            setattr(settings, name, value)
+            self.assertNotEqual(settings_hash(settings, self.fdf_file), self.context, name)
+
+    def test_unchanged(self):
+        # the way the candidates are evaluated does not change their records
+        self.settings.n_workers = 4
+        self.settings.pipeline = True
+        self.assertEqual(settings_hash(self.settings, self.fdf_file), self.context)
+
+    def test_restart(self):
+        file_name = os.path.join(self.work_dir, "journal.dat")
+        Journal(file_name, context=self.context).add({"radii": [1.5, 2.], "delta": 3.})
+        self.assertIsNotNone(Journal(file_name, context=self.context).lookup([1.5, 2.]))
+        self.settings.penalty = 50.
+        journal = Journal(file_name, context=settings_hash(self.settings, self.fdf_file))
+        self.assertIsNone(journal.lookup([1.5, 2.]))
+
+
+if __name__ == "__main__":
+    unittest.main()
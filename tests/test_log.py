@@ -0,0 +1,49 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "pseudogen"))
+
+from log import get_logger
+
+
+class GetLoggerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.work_dir)
+
+    def read(self, *path):
+        with open(os.path.join(self.work_dir, *path)) as f:
+            return f.read()
+
+    def test_work_dirs(self):
+        # the same element run in two work directories of one process
+        first = get_logger("find_pseudo", "Ge", os.path.join(self.work_dir, "a"))
+        second = get_logger("find_pseudo", "Ge", os.path.join(self.work_dir, "b"))
+        self.assertIsNot(first, second)
+        first.info("first run")
+        second.info("second run")
+        self.assertIn("find_pseudo.Ge - INFO - first run", self.read("a", "Ge", "log.dat"))
+        self.assertNotIn("second run", self.read("a", "Ge", "log.dat"))
+        self.assertIn("second run", self.read("b", "Ge", "log.dat"))
+        self.assertNotIn("first run", self.read("b", "Ge", "log.dat"))
+
+    def test_same_file(self):
+        logger = get_logger("find_pseudo", "Si", self.work_dir)
+        os.chdir(self.work_dir)
+        # relative work_dir resolving to the same log file
+        self.assertIs(get_logger("find_pseudo", "Si", "."), logger)
+        logger.info("once")
+        self.assertEqual(self.read("Si", "log.dat").count("once"), 1)
+        self.assertIsNot(get_logger("find_pseudo", "Ge", self.work_dir), logger)
+
+
+if __name__ == "__main__":
+    unittest.main()
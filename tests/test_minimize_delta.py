@@ -0,0 +1,161 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "pseudogen"))
+
+import minimize_delta
+from results import ResultsStore
+
+
+class Settings(object):
+    """ Settings module stand-in: minimal calculation description, optional features switched off
+    """
+    calc = {"element": "X", "nat": 1}
+    electrons = [2, 2]
+    configs = []
+    journal_file = None
+    timing = False
+    method = "Nelder-Mead"
+    min_options = {"maxiter": 5}
+
+
+class EvaluateBatchTest(unittest.TestCase):
+    """ minimize_delta with evaluate stubbed by a model delta, so that evaluate_batch runs without ATOM and SIESTA
+    """
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        with open(os.path.join(self.work_dir, "siesta.fdf"), "w") as f:
+            f.write("SystemLabel X\n")
+        self.settings = Settings()
+        self.settings.results_db = os.path.join(self.work_dir, "results.db")
+        self.calls = []
+        self._evaluate = minimize_delta.evaluate
+        minimize_delta.evaluate = self.evaluate
+
+    def tearDown(self):
+        minimize_delta.evaluate = self._evaluate
+        shutil.rmtree(self.work_dir)
+
+    def evaluate(self, settings, radii, fdf_file, cache=None, results=None, work_dir=None, fidelity="full"):
+        self.calls.append(list(radii))
+        self.assertIsInstance(results, ResultsStore)
+        return {"uuid": "%08d" % len(self.calls),
+                "radii": list(radii),
+                "delta": 1. + (radii[0] - 1.5) ** 2,
+                "fidelity": fidelity}
+
+    def test_serial(self):
+        res = minimize_delta.minimize_delta(self.settings, [1.2], ([2.],), work_dir=self.work_dir)
+        self.assertTrue(self.calls)
+        self.assertTrue(all(radii[1] == 2. for radii in self.calls))
+        self.assertLess(res.fun, 1. + 0.3 ** 2)
+
+    def test_no_surrogate_in_gradients(self):
+        # predicted values of skipped points must not enter finite difference gradients
+        built = []
+        _get_surrogate = minimize_delta.get_surrogate
+        minimize_delta.get_surrogate = lambda *args, **kwds: built.append(True)
+        self.settings.method = "BFGS"
+        self.settings.surrogate = True
+        try:
+            minimize_delta.minimize_delta(self.settings, [1.2], ([2.],), work_dir=self.work_dir)
+        finally:
+            minimize_delta.get_surrogate = _get_surrogate
+        self.assertFalse(built)
+
+    def test_parallel_gradient(self):
+        self.settings.method = "BFGS"
+        self.settings.parallel_gradient = True
+        self.settings.n_workers = 2
+        res = minimize_delta.minimize_delta(self.settings, [1.2], ([2.],), work_dir=self.work_dir)
+        self.assertLess(res.fun, 1. + 0.3 ** 2)
+
+    def test_parallel_gradient_free(self):
+        # gradient points are not evaluated for the methods not using the gradient
+        self.settings.parallel_gradient = True
+        self.settings.n_workers = 2
+        minimize_delta.minimize_delta(self.settings, [1.2], ([2.],), work_dir=self.work_dir)
+        serial = Settings()
+        serial.results_db = self.settings.results_db
+        calls, self.calls = self.calls, []
+        minimize_delta.minimize_delta(serial, [1.2], ([2.],), work_dir=self.work_dir)
+        self.assertEqual(calls, self.calls)
+
+
+class BatchRecorder(object):
+    """ Stand-in of the work queue recording the size of every batch it gets
+    """
+
+    def __init__(self, evaluate):
+        self.evaluate = evaluate
+        self.batches = []
+
+    def map_evaluate(self, settings, radii_list, fdf_file, work_dir, fidelity="full"):
+        self.batches.append(len(radii_list))
+        return [self.evaluate(settings, radii, fdf_file, fidelity=fidelity) for radii in radii_list]
+
+
+class PipelineRecorder(object):
+    """ Stand-in of the pipeline passing batches to BatchRecorder
+    """
+
+    def __init__(self, recorder):
+        self.recorder = recorder
+
+    def map(self, radii_list, fidelity="full"):
+        return self.recorder.map_evaluate(None, radii_list, None, None, fidelity=fidelity)
+
+    def close(self):
+        pass
+
+
+class DistributedBatchTest(unittest.TestCase):
+    """ Gradient points are sent to the workers at once only for the methods using the gradient
+    """
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.settings = Settings()
+        self.settings.results_db = None
+        self.recorder = BatchRecorder(lambda settings, radii, fdf_file, fidelity: {
+            "uuid": "x", "radii": list(radii), "delta": 1. + (radii[0] - 1.5) ** 2, "fidelity": fidelity})
+        self._get_work_queue = minimize_delta.get_work_queue
+        minimize_delta.get_work_queue = lambda settings: self.recorder
+
+    def tearDown(self):
+        minimize_delta.get_work_queue = self._get_work_queue
+        shutil.rmtree(self.work_dir)
+
+    def test_gradient_free(self):
+        minimize_delta.minimize_delta(self.settings, [1.2], ([2.],), work_dir=self.work_dir)
+        self.assertEqual(set(self.recorder.batches), set([1]))
+
+    def test_gradient(self):
+        self.settings.method = "BFGS"
+        minimize_delta.minimize_delta(self.settings, [1.2], ([2.],), work_dir=self.work_dir)
+        self.assertIn(2, self.recorder.batches)
+
+    def test_pipeline_gradient_free(self):
+        recorder = self.recorder
+        minimize_delta.get_work_queue = lambda settings: None
+        _get_pipeline = minimize_delta.get_pipeline
+        minimize_delta.get_pipeline = lambda *args, **kwds: PipelineRecorder(recorder)
+        try:
+            minimize_delta.minimize_delta(self.settings, [1.2], ([2.],), work_dir=self.work_dir)
+        finally:
+            minimize_delta.get_pipeline = _get_pipeline
+        self.assertEqual(set(recorder.batches), set([1]))
+
+    def test_uses_gradient(self):
+        self.assertTrue(minimize_delta.uses_gradient(None))
+        self.assertTrue(minimize_delta.uses_gradient("L-BFGS-B"))
+        self.assertFalse(minimize_delta.uses_gradient("Nelder-Mead"))
+        self.assertFalse(minimize_delta.uses_gradient("Powell"))
+
+
+if __name__ == "__main__":
+    unittest.main()
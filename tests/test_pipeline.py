@@ -0,0 +1,121 @@
+import os
+import sys
+import time
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "pseudogen"))
+
+import pipeline
+from pipeline import Pipeline, get_pipeline
+
+
+class FakeCandidate(object):
+    """ Candidate with radii (SIESTA time, ...): generation fails if the time is negative,
+    SIESTA raises if it is None
+    """
+
+    lock = threading.Lock()
+    # number of candidates generated and not yet run by SIESTA, and its maximum
+    waiting = 0
+    max_waiting = 0
+
+    def __init__(self, settings, radii, work_dir=None, fidelity=None):
+        self.radii = radii
+        self.fidelity = fidelity
+        self.stages = []
+
+    def generate(self, cache=None):
+        self.stages.append("generate")
+        return self.radii[0] is None or self.radii[0] >= 0.
+
+    def prescreen(self, fdf_file):
+        self.stages.append("prescreen")
+        with self.lock:
+            FakeCandidate.waiting += 1
+            FakeCandidate.max_waiting = max(FakeCandidate.max_waiting, FakeCandidate.waiting)
+        return True
+
+    def run_siesta(self, fdf_file):
+        with self.lock:
+            FakeCandidate.waiting -= 1
+        if self.radii[0] is None:
+            raise RuntimeError("SIESTA failed")
+        time.sleep(self.radii[0])
+        self.stages.append("siesta")
+
+    def fit(self):
+        self.stages.append("fit")
+
+    def finish(self, results=None):
+        return {"radii": self.radii, "fidelity": self.fidelity, "stages": self.stages}
+
+
+class Settings(object):
+    pass
+
+
+class PipelineTest(unittest.TestCase):
+
+    def setUp(self):
+        self._candidate = pipeline.Candidate
+        pipeline.Candidate = FakeCandidate
+        FakeCandidate.waiting = FakeCandidate.max_waiting = 0
+
+    def tearDown(self):
+        pipeline.Candidate = self._candidate
+
+    def test_order(self):
+        # the first candidates finish last
+        radii_list = [[0.3], [0.2], [-1.], [0.], [0.1]]
+        with Pipeline(Settings(), "siesta.fdf", siesta_workers=3) as p:
+            records = p.map(radii_list, fidelity="low")
+        self.assertEqual([r["radii"] for r in records], radii_list)
+        self.assertEqual(set(r["fidelity"] for r in records), set(["low"]))
+        self.assertEqual(records[0]["stages"], ["generate", "prescreen", "siesta", "fit"])
+        # a rejected candidate does not go to SIESTA
+        self.assertEqual(records[2]["stages"], ["generate"])
+
+    def test_error(self):
+        with Pipeline(Settings(), "siesta.fdf") as p:
+            with self.assertRaises(RuntimeError):
+                p.map([[0.], [None], [0.1]])
+            # the pipeline is still usable after the error
+            self.assertEqual(len(p.map([[0.], [0.]])), 2)
+
+    def test_max_pending(self):
+        with Pipeline(Settings(), "siesta.fdf", atom_workers=2, siesta_workers=1, max_pending=1) as p:
+            p.map([[0.02]] * 10)
+        # at most one candidate in the queue, one per ATOM worker blocked on put and one per SIESTA worker
+        # taken from the queue and not started yet
+        self.assertLessEqual(FakeCandidate.max_waiting, 4)
+
+    def test_threads(self):
+        results = {}
+
+        def run(name, radii_list):
+            results[name] = p.map(radii_list)
+
+        with Pipeline(Settings(), "siesta.fdf", siesta_workers=2) as p:
+            threads = [threading.Thread(target=run, args=(name, [[0.05 * i]] * 3)) for i, name in enumerate("ab")]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual([r["radii"] for r in results["a"]], [[0.]] * 3)
+        self.assertEqual([r["radii"] for r in results["b"]], [[0.05]] * 3)
+
+    def test_settings(self):
+        settings = Settings()
+        self.assertIsNone(get_pipeline(settings, "siesta.fdf"))
+        settings.pipeline = True
+        settings.pipeline_siesta_workers = 3
+        p = get_pipeline(settings, "siesta.fdf")
+        try:
+            self.assertEqual(len(p._stages[1][1]), 3)
+        finally:
+            p.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import sys
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "pseudogen"))
+
+from population import cmaes
+
+MINIMUM = np.array([1.5, 2.0, 1.8, 1.2])
+# ill-conditioned and rotated, so that the covariance has to be adapted
+SCALES = np.diag([1., 10., 100., 1000.])
+ROTATION = np.linalg.qr(np.random.RandomState(0).standard_normal((4, 4)))[0]
+HESSIAN = ROTATION.dot(SCALES).dot(ROTATION.T)
+
+
+def quadratic(x):
+    dx = np.asarray(x) - MINIMUM
+    return dx.dot(HESSIAN).dot(dx)
+
+
+class CmaesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.batches = []
+
+    def fun_batch(self, xs):
+        self.batches.append(len(xs))
+        return [quadratic(x) for x in xs]
+
+    def test_quadratic(self):
+        res = cmaes(self.fun_batch, [1., 1., 1., 1.], 0.5, max_generations=500, xtol=1e-6, ftol=1e-12, seed=1)
+        np.testing.assert_allclose(res.x, MINIMUM, atol=1e-3)
+        self.assertLess(res.fun, 1e-6)
+        self.assertNotEqual(res.message, "Maximum number of generations reached")
+        # the whole generation is evaluated in one batch
+        self.assertEqual(set(self.batches), set([4 + int(3 * np.log(4))]))
+        self.assertEqual((res.nit, res.nfev), (len(self.batches), sum(self.batches)))
+
+    def test_bounds(self):
+        lower, upper = np.zeros(4), np.array([1.4, 3., 3., 3.])
+
+        def fun_batch(xs):
+            for x in xs:
+                self.assertTrue(np.all(np.asarray(x) >= lower) and np.all(np.asarray(x) <= upper))
+            return [quadratic(x) for x in xs]
+
+        res = cmaes(fun_batch, [1., 1., 1., 1.], 0.5, popsize=12, max_generations=300,
+                    bounds=(lower, upper), xtol=1e-6, ftol=1e-12, seed=2)
+        # the minimum is outside of the bounds
+        self.assertAlmostEqual(res.x[0], 1.4, places=3)
+
+    def test_seed(self):
+        runs = [cmaes(self.fun_batch, [1., 1., 1., 1.], 0.5, max_generations=5, seed=3) for _ in range(2)]
+        np.testing.assert_array_equal(runs[0].x, runs[1].x)
+
+    def test_callback(self):
+        generations = []
+
+        def callback(generation, xs, fs, best_x, best_f):
+            self.assertEqual(len(xs), 6)
+            self.assertEqual(best_f, min(min(fs), generations[-1][1] if generations else np.inf))
+            generations.append((generation, best_f))
+
+        res = cmaes(self.fun_batch, [1., 1., 1., 1.], 0.5, popsize=6, max_generations=10, xtol=0., ftol=0., seed=4,
+                    callback=callback)
+        self.assertEqual([g for g, _ in generations], range(10))
+        self.assertEqual(generations[-1][1], res.fun)
+
+
+if __name__ == "__main__":
+    unittest.main()
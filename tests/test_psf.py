@@ -0,0 +1,138 @@
+import os
+import sys
+import time
+import shutil
+import struct
+import tempfile
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "pseudogen"))
+
+from psf import read_psf, read_vps, load_pseudo, describe, fourier_cutoff, ghost_states, _fortran_records, BOHR
+
+# C.psf (ATOM 3, LDA, no core correction) and Fe.psf (ATOM 3, GGA, relativistic, with core correction)
+# are ATOM outputs distributed with aiida-siesta (MIT license)
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+
+def record(data):
+    return struct.pack("<i", len(data)) + data + struct.pack("<i", len(data))
+
+
+def write_vps(pseudo, file_name, nr, b, a):
+    """ Writes the pseudopotential in the unformatted layout read by SIESTA (pseudo_read_unformatted)
+    """
+    header = (pseudo.element.ljust(2) + "ca" + "nrl" + "nc  " + "ATM3".ljust(60) + pseudo.text[:70].ljust(70) +
+              struct.pack("<3i3d", len(pseudo.potentials), 0, nr, b, a, pseudo.zion))
+    records = [header, pseudo.r.astype("<f8").tostring()]
+    records += [struct.pack("<i", l) + pseudo.potentials[l].astype("<f8").tostring() for l in sorted(pseudo.potentials)]
+    records += [np.zeros_like(pseudo.r).astype("<f8").tostring(), pseudo.valence.astype("<f8").tostring()]
+    with open(file_name, "wb") as f:
+        f.write("".join(record(r) for r in records))
+
+
+class ReadPsfTest(unittest.TestCase):
+
+    def test_carbon(self):
+        pseudo = read_psf(os.path.join(DATA_DIR, "C.psf"))
+        self.assertEqual(pseudo.element, "C")
+        self.assertEqual(pseudo.zion, 4.)
+        self.assertEqual(len(pseudo.r), 1006)
+        self.assertEqual(sorted(pseudo.potentials), [0, 1, 2, 3])
+        self.assertIsNone(pseudo.core)
+        self.assertEqual(pseudo.radii, [1.25] * 4)
+        # r V_l(r) -> -2 zion far from the core, the valence charge integrates to zion
+        for rv in pseudo.potentials.values():
+            self.assertAlmostEqual(rv[-1], -8.)
+        self.assertAlmostEqual(np.trapz(pseudo.valence, pseudo.r), 4., places=3)
+
+    def test_core_correction(self):
+        # the file has numbers with 3 digit exponents written without E, e.g. 0.962929169563-100
+        pseudo = read_psf(os.path.join(DATA_DIR, "Fe.psf"))
+        self.assertEqual((pseudo.element, pseudo.zion, len(pseudo.r)), ("Fe", 8., 1123))
+        self.assertIsNotNone(pseudo.core)
+        self.assertTrue(np.all(np.isfinite(pseudo.core)))
+        self.assertAlmostEqual(np.trapz(pseudo.valence, pseudo.r), 8., places=3)
+
+
+class ReadVpsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_fortran_records(self):
+        data = record("ab") + record(struct.pack("<2d", 1., 2.))
+        self.assertEqual(_fortran_records(data), ["ab", struct.pack("<2d", 1., 2.)])
+
+    def test_same_as_psf(self):
+        psf = read_psf(os.path.join(DATA_DIR, "C.psf"))
+        file_name = os.path.join(self.work_dir, "C.vps")
+        write_vps(psf, file_name, 1006, 0.413125362778E-03, 0.125E-01)
+        vps = read_vps(file_name)
+        self.assertEqual((vps.element, vps.zion, vps.text.strip()), (psf.element, psf.zion, psf.text[:70].strip()))
+        self.assertIsNone(vps.core)
+        np.testing.assert_array_equal(vps.r, psf.r)
+        np.testing.assert_array_equal(vps.valence, psf.valence)
+        for l in psf.potentials:
+            np.testing.assert_array_equal(vps.potentials[l], psf.potentials[l])
+
+
+class LoadPseudoTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.work_dir, "Fe.psf")
+        shutil.copy(os.path.join(DATA_DIR, "Fe.psf"), self.file_name)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_cache(self):
+        parsed = load_pseudo(self.file_name)
+        self.assertTrue(os.path.exists(os.path.join(self.work_dir, ".Fe.psf.npy")))
+        cached = load_pseudo(self.file_name)
+        self.assertIsInstance(cached.r, np.memmap)
+        self.assertEqual((cached.element, cached.zion, cached.text), (parsed.element, parsed.zion, parsed.text))
+        self.assertEqual(sorted(cached.potentials), sorted(parsed.potentials))
+        for l in parsed.potentials:
+            np.testing.assert_array_equal(cached.potentials[l], parsed.potentials[l])
+        np.testing.assert_array_equal(cached.core, parsed.core)
+        np.testing.assert_array_equal(cached.valence, parsed.valence)
+
+    def test_invalidated(self):
+        load_pseudo(self.file_name)
+        later = time.time() + 10.
+        os.utime(self.file_name, (later, later))
+        self.assertNotIsInstance(load_pseudo(self.file_name).r, np.memmap)
+        self.assertIsInstance(load_pseudo(self.file_name).r, np.memmap)
+
+
+class DescriptorsTest(unittest.TestCase):
+
+    def test_fourier_cutoff(self):
+        # |rho(q)| / rho(0) = exp(-q^2 s^2 / 2) of the gaussian density is below tol for q^2 > 2 ln(1 / tol) / s^2
+        r = np.linspace(1e-4, 20., 4000)
+        s = 0.5
+        cutoff = fourier_cutoff(r, 4. * np.pi * r ** 2 * np.exp(-r ** 2 / (2. * s ** 2)), tol=1e-3)
+        self.assertAlmostEqual(cutoff, 2. * np.log(1e3) / s ** 2, delta=3.)
+
+    def test_carbon(self):
+        pseudo = read_psf(os.path.join(DATA_DIR, "C.psf"))
+        descriptors = describe(pseudo, nn_distance=1.54)
+        self.assertGreater(descriptors["est_cutoff"], 0.)
+        self.assertLess(descriptors["est_cutoff"], 2000.)
+        self.assertEqual(descriptors["ghosts"], "")
+        self.assertAlmostEqual(descriptors["core_overlap"], 2. * 1.25 * BOHR / 1.54)
+
+    def test_local_channel(self):
+        # the channel of the local potential has no projector
+        pseudo = read_psf(os.path.join(DATA_DIR, "C.psf"))
+        self.assertNotIn(0, ghost_states(pseudo, local_l=0))
+
+
+if __name__ == "__main__":
+    unittest.main()
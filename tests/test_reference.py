@@ -0,0 +1,104 @@
+import os
+import sys
+import stat
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "pseudogen"))
+
+import reference
+from reference import ReferenceData, load_reference, reference_files, reference_code, get_reference, get_references
+
+
+class Settings(object):
+    pass
+
+
+class ReferenceDataTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.work_dir, "WIEN2k.txt")
+        self.write("# element V0 B0 BP\nGe 23.9 59.1 4.9\nSi 20.5 88.5 4.3\n")
+        reference._registry.clear()
+
+    def tearDown(self):
+        os.chmod(self.work_dir, stat.S_IRWXU)
+        shutil.rmtree(self.work_dir)
+        reference._registry.clear()
+
+    def write(self, text, mtime=1000.):
+        with open(self.file_name, "w") as f:
+            f.write(text)
+        os.utime(self.file_name, (mtime, mtime))
+
+    def test_get(self):
+        data = ReferenceData(self.file_name)
+        self.assertEqual(data.elements(), ["Ge", "Si"])
+        self.assertIn("Ge", data)
+        self.assertNotIn("Fe", data)
+        ge = data.get("Ge")
+        self.assertEqual((ge["V0"][0], ge["B0"][0], ge["BP"][0]), (23.9, 59.1, 4.9))
+        with self.assertRaises(KeyError):
+            data.get("Fe")
+
+    def test_one_element(self):
+        self.write("Ge 23.9 59.1 4.9\n")
+        self.assertEqual(ReferenceData(self.file_name).elements(), ["Ge"])
+
+    def test_cache(self):
+        ReferenceData(self.file_name)
+        self.assertTrue(os.path.exists(os.path.join(self.work_dir, ".WIEN2k.txt.npz")))
+        # the file is not parsed again while its mtime is the same
+        self.write("Ge 1. 1. 1.\n")
+        self.assertEqual(ReferenceData(self.file_name).get("Ge")["V0"][0], 23.9)
+        self.write("Ge 1. 1. 1.\n", mtime=2000.)
+        self.assertEqual(ReferenceData(self.file_name).elements(), ["Ge"])
+
+    def test_read_only(self):
+        os.chmod(self.work_dir, stat.S_IRUSR | stat.S_IXUSR)
+        self.assertEqual(ReferenceData(self.file_name).elements(), ["Ge", "Si"])
+
+    def test_registry(self):
+        data = load_reference(self.file_name)
+        self.assertIs(load_reference(os.path.relpath(self.file_name)), data)
+        self.write("Ge 1. 1. 1.\n", mtime=2000.)
+        self.assertIsNot(load_reference(self.file_name), data)
+
+
+class SettingsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        for name, text in (("WIEN2k.txt", "Ge 23.9 59.1 4.9\nSi 20.5 88.5 4.3\n"), ("VASP.txt", "Ge 24.1 58. 4.8\n")):
+            with open(os.path.join(self.work_dir, name), "w") as f:
+                f.write(text)
+        reference._registry.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+        reference._registry.clear()
+
+    def test_single(self):
+        settings = Settings()
+        settings.reference_file = "WIEN2k.txt"
+        self.assertEqual(reference_files(settings, self.work_dir),
+                         {"WIEN2k": os.path.join(self.work_dir, "WIEN2k.txt")})
+        self.assertEqual(reference_code(settings), "WIEN2k")
+        self.assertEqual(get_reference(settings, work_dir=self.work_dir).elements(), ["Ge", "Si"])
+
+    def test_several(self):
+        settings = Settings()
+        settings.reference_files = {"WIEN2k": "WIEN2k.txt", "VASP": "VASP.txt"}
+        with self.assertRaises(ValueError):
+            reference_code(settings)
+        settings.reference_code = "VASP"
+        self.assertEqual(get_reference(settings, work_dir=self.work_dir).elements(), ["Ge"])
+        references = get_references(settings, work_dir=self.work_dir)
+        self.assertEqual(sorted(references), ["VASP", "WIEN2k"])
+        self.assertIn("Si", references["WIEN2k"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "pseudogen"))
+
+from results import ResultsStore, COLUMNS
+from fidelity import FULL
+
+
+def record(delta, err_max=1e-3, **kwargs):
+    d = {"radii": [1.5, 1.6, 1.7, 0., 1.2], "delta": delta, "err_max": err_max,
+         "volumes": [12.5, 11.5, 12.], "energies": [-1., -1., -1.1]}
+    d.update(kwargs)
+    return d
+
+
+class ResultsStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.work_dir, "results.db")
+        self.store = ResultsStore(self.db_file, context="abc")
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_add(self):
+        eval_id = self.store.add("Ge", record(2.))
+        row, = self.store.query(element="Ge")
+        self.assertEqual(row["id"], eval_id)
+        self.assertEqual(row["radii"], [1.5, 1.6, 1.7, 0., 1.2])
+        self.assertEqual((row["r_s"], row["r_ps"]), (1.5, 1.2))
+        self.assertEqual((row["fidelity"], row["context"]), (FULL, "abc"))
+        # EOS points are returned ordered by volume
+        self.assertEqual(self.store.eos_points(eval_id), [(11.5, -1.), (12., -1.1), (12.5, -1.)])
+
+    def test_query(self):
+        for delta, err_max in ((3., 1e-3), (1., 1e-2), (2., 1e-4)):
+            self.store.add("Ge", record(delta, err_max))
+        self.store.add("Si", record(0.5))
+        self.store.add("Ge", record(None, rejected="err_max"))
+        self.assertEqual([r["delta"] for r in self.store.query(element="Ge")], [1., 2., 3.])
+        self.assertEqual([r["delta"] for r in self.store.query(element="Ge", max_err_max=1e-3)], [2., 3.])
+        self.assertEqual([r["delta"] for r in self.store.query(element="Ge", min_delta=1.5, limit=1)], [2.])
+        # rows without the sort key go last
+        rows = self.store.query(element="Ge", include_rejected=True)
+        self.assertEqual(rows[-1]["rejected"], "err_max")
+        self.assertEqual([r["err_max"] for r in self.store.query(element="Ge", order_by="err_max")],
+                         [1e-4, 1e-3, 1e-2])
+        with self.assertRaises(ValueError):
+            self.store.query(nonexistent=1)
+        with self.assertRaises(ValueError):
+            self.store.query(order_by="delta; DROP TABLE evaluations")
+
+    def test_best(self):
+        self.store.add("Ge", record(1., fidelity="low"))
+        self.store.add("Ge", record(2.))
+        self.store.add("Ge", record(3.))
+        self.assertEqual([r["delta"] for r in self.store.best("Ge", 1)], [2.])
+        self.assertEqual([r["delta"] for r in self.store.best("Ge", fidelity="low")], [1.])
+
+    def test_context(self):
+        self.store.add("Ge", record(1.))
+        ResultsStore(self.db_file, context="def").add("Ge", record(2.))
+        self.assertEqual([r["delta"] for r in self.store.query(element="Ge", context="def")], [2.])
+        self.assertEqual(len(self.store.query(element="Ge")), 2)
+
+
+class MigrationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.work_dir, "results.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_old_database(self):
+        # database written before fidelity, descriptors and context were added
+        columns = [c for c in COLUMNS if c[0] not in ("fidelity", "mesh_cutoff", "est_cutoff", "ghosts",
+                                                      "core_overlap", "context")]
+        conn = sqlite3.connect(self.db_file)
+        with conn:
+            conn.execute("CREATE TABLE evaluations (id INTEGER PRIMARY KEY AUTOINCREMENT, {})".format(
+                         ", ".join(" ".join(c) for c in columns)))
+            conn.execute("INSERT INTO evaluations (element, uuid, radii, delta) VALUES ('Ge', 'a', '[1.5]', 1.)")
+        conn.close()
+        store = ResultsStore(self.db_file)
+        old, = store.best("Ge")
+        self.assertEqual((old["uuid"], old["radii"], old["fidelity"]), ("a", [1.5], FULL))
+        self.assertIsNone(old["context"])
+        store.add("Ge", record(2., mesh_cutoff=200.))
+        self.assertEqual([r["mesh_cutoff"] for r in store.best("Ge")], [None, 200.])
+        # opening the migrated database again changes nothing
+        self.assertEqual(len(ResultsStore(self.db_file).best("Ge")), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
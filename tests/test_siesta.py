@@ -0,0 +1,125 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "pseudogen"))
+
+from siesta import read_output, ScfMonitor
+
+HEADER = """\
+outcell: Cell volume (Ang**3)        :     45.1234
+siesta: iscf   Eharris(eV)      E_KS(eV)   FreeEng(eV)   dDmax  Ef(eV)
+"""
+
+SCF = "   scf: {:4d} {:14.6f} {:14.6f} {:14.6f} {:9.6f} {:8.4f}\n"
+
+FOOTER = """
+SCF Convergence by dMax criterion
+siesta: Final energy (eV):
+siesta:  Band Struct. =     -97.225353
+siesta:       Kinetic =     153.164893
+siesta:         Total =    -212.633546
+
+timer: Elapsed wall time (sec) =     12.345
+>> End of run:  18-OCT-2026  12:00:00
+"""
+
+
+def scf_lines(dDmax, start=1):
+    return "".join(SCF.format(i, -212.6, -212.6, -212.6, d, -4.) for i, d in enumerate(dDmax, start))
+
+
+class ReadOutputTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.out_file = os.path.join(self.work_dir, "siesta.out")
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def write(self, text):
+        with open(self.out_file, "w") as f:
+            f.write(text)
+
+    def test_completed(self):
+        self.write(HEADER + scf_lines([1., 0.1, 0.01]) + FOOTER)
+        out = read_output(self.out_file)
+        self.assertEqual(list(out.final()), [45.1234, -212.633546])
+        self.assertEqual(out.scf_steps, 3)
+        self.assertEqual(out.dDmax, [1., 0.1, 0.01])
+        self.assertEqual(out.wall_time, 12.345)
+        self.assertTrue(out.converged)
+        self.assertTrue(out.completed)
+
+    def test_not_converged(self):
+        self.write(HEADER + scf_lines([1., 3., 9.]) + "\nSCF_NOT_CONV: SCF did not converge in maximum number of steps.\n")
+        out = read_output(self.out_file)
+        self.assertIsNone(out.final())
+        self.assertEqual(out.scf_steps, 3)
+        self.assertFalse(out.converged)
+        self.assertFalse(out.completed)
+
+    def test_last_block(self):
+        # the energy of the final block is taken with the volume printed before it
+        text = HEADER + scf_lines([0.1]) + FOOTER.replace("-212.633546", "-200.0")
+        text += HEADER.replace("45.1234", "46.0") + scf_lines([0.1, 0.01]) + FOOTER
+        self.write(text)
+        out = read_output(self.out_file)
+        self.assertEqual(list(out.final()), [46.0, -212.633546])
+        self.assertEqual(out.scf_steps, 2)
+        self.assertEqual(len(out.dDmax), 3)
+
+    def test_long_output(self):
+        self.write(HEADER + scf_lines([1. / (i + 1) for i in range(20000)]) + FOOTER)
+        out = read_output(self.out_file)
+        self.assertEqual(out.scf_steps, 20000)
+        self.assertEqual(len(out.dDmax), 20000)
+        self.assertEqual(list(out.final()), [45.1234, -212.633546])
+
+
+class ScfMonitorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.out_file = os.path.join(self.work_dir, "siesta.out")
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def append(self, text):
+        with open(self.out_file, "a") as f:
+            f.write(text)
+
+    def test_incremental(self):
+        monitor = ScfMonitor(self.out_file, stagnation_steps=None)
+        # the output file does not exist before the run starts
+        self.assertIsNone(monitor())
+        lines = scf_lines([1., 0.1])
+        self.append(HEADER + lines[:-10])
+        self.assertIsNone(monitor())
+        self.assertEqual(monitor.dDmax, [1.])
+        # the rest of the line written in the meantime
+        self.append(lines[-10:])
+        self.assertIsNone(monitor())
+        self.assertEqual(monitor.dDmax, [1., 0.1])
+
+    def test_divergence(self):
+        monitor = ScfMonitor(self.out_file, divergence_factor=10., divergence_steps=2)
+        self.append(HEADER + scf_lines([1., 0.1, 0.01]))
+        self.assertIsNone(monitor())
+        self.append(scf_lines([0.5, 0.6], start=4))
+        self.assertIn("diverges", monitor())
+
+    def test_stagnation(self):
+        monitor = ScfMonitor(self.out_file, stagnation_steps=3)
+        self.append(HEADER + scf_lines([1., 0.1, 0.2, 0.2]))
+        self.assertIsNone(monitor())
+        self.append(scf_lines([0.3], start=5))
+        self.assertIn("stagnates", monitor())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "pseudogen"))
+
+from surrogate import Surrogate, get_surrogate
+from results import ResultsStore
+from journal import Journal
+
+
+class Settings(object):
+    calc = {"element": "X", "nat": 1}
+    surrogate = True
+    surrogate_min_points = 100
+
+
+def record(r, delta, rejected=None):
+    return {"uuid": "%.1f" % r, "radii": [r, 2.], "delta": delta, "rejected": rejected}
+
+
+class TrainingDataTest(unittest.TestCase):
+    """ The model is trained on delta factors only: rejected candidates and other settings are left out
+    """
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_add_rejected(self):
+        surrogate = Surrogate(min_points=100)
+        surrogate.add([1.5, 2.], 3.)
+        surrogate.add([1.0, 2.], 100., "err_max = 0.1 > 0.01")
+        self.assertEqual(len(surrogate._pending), 1)
+        self.assertEqual(surrogate.best, 3.)
+
+    def test_results_context(self):
+        results = ResultsStore(os.path.join(self.work_dir, "results.db"), context="a")
+        results.add("X", record(1.5, 3.))
+        results.add("X", record(1.0, 100., "pruned: estimated delta = 20. > 1.5 x best delta 3."))
+        ResultsStore(results.db_file, context="b").add("X", record(1.2, 5.))
+        ResultsStore(results.db_file, context="a").add("Y", record(1.3, 4.))
+        surrogate = get_surrogate(Settings(), results=results)
+        self.assertEqual([p[0] for p in surrogate._pending], [[1.5, 2.]])
+
+    def test_journal_rejected(self):
+        journal = Journal(os.path.join(self.work_dir, "journal.dat"), context="a")
+        journal.add(record(1.5, 3.))
+        journal.add(record(1.0, 100., "SCF diverges"))
+        surrogate = get_surrogate(Settings(), journal=journal)
+        self.assertEqual([p[1] for p in surrogate._pending], [3.])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "pseudogen"))
+
+from timing import TimingLog, CandidateTiming, summarize, report, get_timing_log
+from backend import Job, LocalBackend
+
+
+def stage(name, start, wall, utime=0., maxrss=0.):
+    return {"type": "stage", "stage": name, "start": start, "wall": wall, "utime": utime, "stime": 0.,
+            "maxrss": maxrss}
+
+
+class SummarizeTest(unittest.TestCase):
+
+    def test_totals(self):
+        records = [stage("atom", 100., 1., utime=0.5, maxrss=10.),
+                   stage("siesta", 101., 10., utime=30., maxrss=200.),
+                   {"type": "job", "program": "siesta", "start": 101., "wall": 9., "utime": 30., "stime": 1.,
+                    "maxrss": 200.},
+                   {"type": "candidate", "start": 100., "wall": 11.5, "rejected": None},
+                   stage("atom", 105., 2., utime=1., maxrss=20.),
+                   {"type": "candidate", "start": 105., "wall": 2., "rejected": "err_max"},
+                   # killed job without rusage
+                   {"type": "job", "program": "siesta", "start": 108., "wall": None}]
+        summary = summarize(records)
+        self.assertEqual((summary["start"], summary["span"]), (100., 11.5))
+        self.assertEqual((summary["n_candidates"], summary["n_rejected"]), (2, 1))
+        self.assertEqual(summary["candidate_wall"], 13.5)
+        self.assertEqual(summary["stages"]["atom"], {"count": 2, "wall": 3., "cpu": 1.5, "maxrss": 20.})
+        self.assertEqual(summary["stages"]["siesta"]["count"], 1)
+        self.assertEqual(summary["programs"]["siesta"], {"count": 2, "wall": 9., "cpu": 31., "maxrss": 200.})
+        text = report(summary).splitlines()
+        self.assertEqual(text[0], "2 candidates (1 rejected) in 11.5 s, 13.5 s of candidate wall time")
+        # stages are sorted by their total wall time
+        self.assertEqual([line.split()[0] for line in text[2:4]], ["siesta", "atom"])
+
+    def test_empty(self):
+        summary = summarize([])
+        self.assertEqual((summary["start"], summary["span"], summary["n_candidates"]), (None, 0., 0))
+        self.assertEqual(len(report(summary).splitlines()), 3)
+
+
+class Settings(object):
+    calc = {"element": "Ge"}
+
+
+class TimingLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_read(self):
+        log = get_timing_log(Settings(), self.work_dir)
+        self.assertIs(get_timing_log(Settings(), self.work_dir), log)
+        self.assertEqual(log.file_name, os.path.join(self.work_dir, "Ge", "timing.jsonl"))
+        log.write(stage("atom", 100., 1.))
+        with open(log.file_name, "a") as f:
+            # line cut by a killed process
+            f.write('{"type": "stage", "st\n')
+        log.write(stage("siesta", 200., 1.))
+        self.assertEqual([r["stage"] for r in log.read()], ["atom", "siesta"])
+        self.assertEqual([r["stage"] for r in log.read(since=150.)], ["siesta"])
+
+    def test_switched_off(self):
+        settings = Settings()
+        settings.timing = False
+        self.assertIsNone(get_timing_log(settings, self.work_dir))
+
+    def test_candidate(self):
+        log = TimingLog(os.path.join(self.work_dir, "timing.jsonl"))
+        timing = CandidateTiming(log, "abc", [1.5, 1.6], "full")
+        backend = LocalBackend()
+        with timing.stage("atom"):
+            backend.run(Job([sys.executable, "-c", "sum(i * i for i in xrange(3000000))"], name="atom"))
+        # jobs submitted outside of the stage are not recorded
+        backend.run(Job(["true"]))
+        summary = timing.finish({"delta": 1.})
+        records = log.read()
+        self.assertEqual([r["type"] for r in records], ["job", "stage", "candidate"])
+        job, stage_record = records[:2]
+        self.assertEqual((job["stage"], job["uuid"], job["program"], job["returncode"]),
+                         ("atom", "abc", os.path.basename(sys.executable), 0))
+        # CPU time and peak memory of the job are taken from wait4
+        self.assertGreater(job["utime"] + job["stime"], 0.)
+        self.assertGreater(job["maxrss"], 0.)
+        self.assertEqual(stage_record["n_jobs"], 1)
+        self.assertEqual(stage_record["utime"], job["utime"])
+        self.assertEqual((summary["delta"], summary["n_jobs"], summary["maxrss"]), (1., 1, job["maxrss"]))
+        self.assertIn("Timing of abc", timing.report(summary))
+
+
+if __name__ == "__main__":
+    unittest.main()
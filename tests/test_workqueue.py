@@ -0,0 +1,109 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "pseudogen"))
+
+from workqueue import WorkQueue, Worker, DEFAULT_TIMEOUT
+
+
+class RecordingWorker(Worker):
+    """ Worker squaring the number of the task and recording the tasks it has run
+    """
+
+    executed = []
+    lock = threading.Lock()
+
+    def execute(self, task):
+        with self.lock:
+            self.executed.append(task["id"])
+        time.sleep(0.01)
+        if task["x"] < 0:
+            raise ValueError("negative x")
+        return task["x"] ** 2
+
+
+class WorkQueueTest(unittest.TestCase):
+    """ Several workers of one machine sharing the queue directory
+    """
+
+    def setUp(self):
+        self.queue_dir = tempfile.mkdtemp()
+        # the coordinator shares its timeout with the workers, see get_work_queue
+        self.queue = self.make_queue(timeout=2.)
+        self.queue.write_config()
+        RecordingWorker.executed = []
+
+    def tearDown(self):
+        shutil.rmtree(self.queue_dir)
+
+    def make_queue(self, timeout=None):
+        queue = WorkQueue(self.queue_dir, timeout=timeout)
+        queue.poll_interval = 0.05
+        return queue
+
+    def run_workers(self, n_workers):
+        workers = [RecordingWorker(self.make_queue(), "w{}".format(i)) for i in range(n_workers)]
+        threads = [threading.Thread(target=w.run, kwargs={"idle_exit": 0.3}) for w in workers]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def test_claim_exclusive(self):
+        task_ids = [self.queue.submit({"x": x}) for x in range(20)]
+        for thread in self.run_workers(3):
+            thread.join()
+        self.assertEqual(sorted(RecordingWorker.executed), sorted(task_ids))
+
+    def test_wait(self):
+        task_ids = [self.queue.submit({"x": x}) for x in range(10)]
+        threads = self.run_workers(3)
+        self.assertEqual(self.queue.wait(task_ids), [x ** 2 for x in range(10)])
+        for thread in threads:
+            thread.join()
+        self.assertEqual(os.listdir(self.queue._dir("done")), [])
+
+    def test_wait_error(self):
+        task_ids = [self.queue.submit({"x": x}) for x in (1, -1)]
+        threads = self.run_workers(2)
+        with self.assertRaises(RuntimeError):
+            self.queue.wait(task_ids)
+        for thread in threads:
+            thread.join()
+
+    def test_requeue_stale(self):
+        task_id = self.queue.submit({"x": 3})
+        # the worker is killed after it has claimed the task
+        self.queue.heartbeat("killed")
+        self.assertEqual(self.queue.claim("killed")["id"], task_id)
+        self.assertEqual(self.queue.requeue_stale(), [])
+        old = time.time() - 10.
+        os.utime(self.queue._dir("workers", "killed"), (old, old))
+        self.assertEqual(self.queue.requeue_stale(), [task_id])
+        threads = self.run_workers(2)
+        self.assertEqual(self.queue.wait([task_id]), [9])
+        for thread in threads:
+            thread.join()
+        self.assertNotIn("killed", os.listdir(self.queue._dir("workers")))
+
+    def test_finish_twice(self):
+        # the requeued task is finished by the killed worker after it has come back
+        task_id = self.queue.submit({"x": 3})
+        self.queue.claim("late")
+        self.queue.finish("other", task_id, result=9)
+        self.queue.finish("late", task_id, result=10)
+        self.assertEqual(self.queue.result(task_id), (9, None))
+        self.assertEqual(os.listdir(self.queue._dir("running")), [])
+
+    def test_timeout(self):
+        self.assertEqual(self.make_queue().timeout, 2.)
+        os.remove(os.path.join(self.queue_dir, "config.json"))
+        self.assertEqual(self.make_queue().timeout, DEFAULT_TIMEOUT)
+
+
+if __name__ == "__main__":
+    unittest.main()